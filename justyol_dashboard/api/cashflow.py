@@ -150,4 +150,15 @@ def get_cashflow_dashboard(company="Justyol Morocco", period="month"):
             "company": company,
         }
 
-    return get_cached(cache_key, compute)
+    return get_cached(
+        cache_key,
+        compute,
+        revalidate=("justyol_dashboard.api.cashflow.get_cashflow_dashboard", {"company": company, "period": period}),
+        company=company,
+        depends_on={
+            # Aging reads all outstanding invoices; payments change outstanding amounts
+            "Sales Invoice": None,
+            "Payment Entry": None,
+            "Sales Order": [dates],
+        },
+    )
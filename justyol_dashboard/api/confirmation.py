@@ -1,5 +1,18 @@
 import frappe
-from justyol_dashboard.services.kpi_service import get_period_dates
+from justyol_dashboard.services.kpi_service import (
+    get_period_dates,
+    scan_orders,
+    scan_order_facts,
+    is_today,
+    aggregate_orders,
+    rank_groups,
+    rate,
+    DRAFT,
+    PENDING,
+    CONFIRMED,
+    CANCELLED,
+    NO_RESPONSE,
+)
 from justyol_dashboard.services.cache_service import get_cached
 
 
@@ -10,91 +23,63 @@ def get_confirmation_dashboard(company="Justyol Morocco", period="today"):
     cache_key = f"dashboard:confirmation:{company}:{dates['from']}:{dates['to']}"
 
     def compute():
-        from_date = dates["from"]
-        to_date = dates["to"] + " 23:59:59"
+        # Today is served from the live counters, which keep agent and hour
+        rows = scan_order_facts(company, dates) if is_today(dates) else scan_orders(company, dates)
 
         # Overall confirmation KPIs
-        kpis = frappe.db.sql("""
-            SELECT
-                COUNT(name) as total_orders,
-                SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed,
-                SUM(CASE WHEN custom_sales_status = 'Cancelled' THEN 1 ELSE 0 END) as cancelled,
-                SUM(CASE WHEN custom_sales_status = 'Pending' THEN 1 ELSE 0 END) as pending,
-                SUM(CASE WHEN custom_sales_status = 'Draft' THEN 1 ELSE 0 END) as draft,
-                SUM(CASE WHEN custom_sales_status = 'No Response' THEN 1 ELSE 0 END) as no_response
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-        """, (company, from_date, to_date), as_dict=True)[0]
+        kpis = aggregate_orders(rows, {
+            "total_orders": ("orders", None),
+            "confirmed": ("orders", CONFIRMED),
+            "cancelled": ("orders", CANCELLED),
+            "pending": ("orders", PENDING),
+            "draft": ("orders", DRAFT),
+            "no_response": ("orders", NO_RESPONSE),
+        })
 
-        total = kpis.total_orders or 0
-        confirmed = kpis.confirmed or 0
-        cancelled = kpis.cancelled or 0
-        pending = kpis.pending or 0
+        total = kpis["total_orders"]
+        confirmed = kpis["confirmed"]
+        cancelled = kpis["cancelled"]
+        pending = kpis["pending"]
 
         # Per-agent performance
-        agents = frappe.db.sql("""
-            SELECT
-                COALESCE(owner, 'Unassigned') as agent,
-                COUNT(name) as total_orders,
-                SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed,
-                SUM(CASE WHEN custom_sales_status = 'Cancelled' THEN 1 ELSE 0 END) as cancelled,
-                SUM(CASE WHEN custom_sales_status = 'Pending' THEN 1 ELSE 0 END) as pending,
-                SUM(CASE WHEN custom_sales_status = 'No Response' THEN 1 ELSE 0 END) as no_response,
-                COALESCE(AVG(grand_total), 0) as avg_order_value
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-            GROUP BY owner
-            ORDER BY confirmed DESC
-        """, (company, from_date, to_date), as_dict=True)
+        agents = aggregate_orders(rows, {
+            "total_orders": ("orders", None),
+            "confirmed": ("orders", CONFIRMED),
+            "cancelled": ("orders", CANCELLED),
+            "pending": ("orders", PENDING),
+            "no_response": ("orders", NO_RESPONSE),
+            "gmv": ("gmv", None),
+        }, key=("owner", "Unassigned"))
 
         agent_data = []
-        for a in agents:
-            a_total = a.total_orders or 0
-            a_confirmed = a.confirmed or 0
+        for agent, a in rank_groups(agents, "confirmed"):
+            a_total = a["total_orders"]
+            a_confirmed = a["confirmed"]
             agent_data.append({
-                "agent": a.agent,
+                "agent": agent,
                 "total_orders": a_total,
                 "confirmed": a_confirmed,
-                "cancelled": a.cancelled or 0,
-                "pending": a.pending or 0,
-                "no_response": a.no_response or 0,
-                "confirmation_rate": round(a_confirmed / a_total * 100, 1) if a_total > 0 else 0,
-                "avg_order_value": float(a.avg_order_value or 0),
+                "cancelled": a["cancelled"],
+                "pending": a["pending"],
+                "no_response": a["no_response"],
+                "confirmation_rate": rate(a_confirmed, a_total),
+                "avg_order_value": a["gmv"] / a_total if a_total > 0 else 0,
             })
 
         # Hourly confirmation activity
-        hourly = frappe.db.sql("""
-            SELECT
-                HOUR(creation) as hour,
-                COUNT(name) as orders,
-                SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed,
-                SUM(CASE WHEN custom_sales_status = 'Cancelled' THEN 1 ELSE 0 END) as cancelled
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-            GROUP BY HOUR(creation)
-            ORDER BY hour ASC
-        """, (company, from_date, to_date), as_dict=True)
+        hourly = aggregate_orders(rows, {
+            "orders": ("orders", None),
+            "confirmed": ("orders", CONFIRMED),
+            "cancelled": ("orders", CANCELLED),
+        }, key="hour")
 
         # Cancellation reasons
-        reasons = frappe.db.sql("""
-            SELECT
-                COALESCE(custom_cancellation_reason, 'Unknown') as reason,
-                COUNT(name) as count
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-                AND custom_sales_status = 'Cancelled'
-            GROUP BY custom_cancellation_reason
-            ORDER BY count DESC
-            LIMIT 10
-        """, (company, from_date, to_date), as_dict=True)
+        reasons = aggregate_orders(
+            rows,
+            {"count": ("orders", None)},
+            key=("custom_cancellation_reason", "Unknown"),
+            where=CANCELLED,
+        )
 
         return {
             "kpis": {
@@ -102,22 +87,28 @@ def get_confirmation_dashboard(company="Justyol Morocco", period="today"):
                 "confirmed": confirmed,
                 "cancelled": cancelled,
                 "pending": pending,
-                "draft": kpis.draft or 0,
-                "no_response": kpis.no_response or 0,
-                "confirmation_rate": round(confirmed / total * 100, 1) if total > 0 else 0,
-                "cancellation_rate": round(cancelled / total * 100, 1) if total > 0 else 0,
+                "draft": kpis["draft"],
+                "no_response": kpis["no_response"],
+                "confirmation_rate": rate(confirmed, total),
+                "cancellation_rate": rate(cancelled, total),
             },
             "agents": agent_data,
             "hourly_activity": [
-                {"hour": r.hour, "orders": r.orders, "confirmed": r.confirmed, "cancelled": r.cancelled}
-                for r in hourly
+                {"hour": hour, "orders": r["orders"], "confirmed": r["confirmed"], "cancelled": r["cancelled"]}
+                for hour, r in sorted(hourly.items())
             ],
             "cancellation_reasons": [
-                {"reason": r.reason, "count": r.count}
-                for r in reasons
+                {"reason": reason, "count": r["count"]}
+                for reason, r in rank_groups(reasons, "count", 10)
             ],
             "period": dates,
             "company": company,
         }
 
-    return get_cached(cache_key, compute)
+    return get_cached(
+        cache_key,
+        compute,
+        revalidate=("justyol_dashboard.api.confirmation.get_confirmation_dashboard", {"company": company, "period": period}),
+        company=company,
+        depends_on={"Sales Order": [dates]},
+    )
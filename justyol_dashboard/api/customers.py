@@ -1,7 +1,19 @@
 import frappe
-from justyol_dashboard.services.kpi_service import get_period_dates
+from justyol_dashboard.services.kpi_service import get_period_dates, scan_order_facts, aggregate_orders
 from justyol_dashboard.services.cache_service import get_cached
 
+FREQUENCY_SEGMENTS = ("1 Order", "2-3 Orders", "4-5 Orders", "6+ Orders")
+
+
+def _frequency_segment(order_count):
+    if order_count <= 1:
+        return "1 Order"
+    if order_count <= 3:
+        return "2-3 Orders"
+    if order_count <= 5:
+        return "4-5 Orders"
+    return "6+ Orders"
+
 
 @frappe.whitelist()
 def get_customer_dashboard(company="Justyol Morocco", period="month"):
@@ -14,47 +26,10 @@ def get_customer_dashboard(company="Justyol Morocco", period="month"):
         to_date = dates["to"] + " 23:59:59"
 
         # Customer overview
-        customer_kpis = frappe.db.sql("""
-            SELECT
-                COUNT(DISTINCT customer) as unique_customers,
-                COUNT(name) as total_orders,
-                COALESCE(SUM(grand_total), 0) as total_revenue,
-                COALESCE(AVG(grand_total), 0) as avg_order_value
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-        """, (company, from_date, to_date), as_dict=True)[0]
-
-        # New vs repeat customers
-        repeat_data = frappe.db.sql("""
-            SELECT
-                customer,
-                COUNT(name) as order_count,
-                COALESCE(SUM(grand_total), 0) as total_spend,
-                MIN(creation) as first_order
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-            GROUP BY customer
-        """, (company, from_date, to_date), as_dict=True)
-
-        # Check which customers had prior orders
-        new_customers = 0
-        repeat_customers = 0
-        for c in repeat_data:
-            prior = frappe.db.count("Sales Order", {
-                "company": company,
-                "customer": c.customer,
-                "creation": ["<", from_date],
-            })
-            if prior > 0:
-                repeat_customers += 1
-            else:
-                new_customers += 1
-
-        repeat_pct = round(repeat_customers / max(len(repeat_data), 1) * 100, 1)
+        customer_kpis = aggregate_orders(scan_order_facts(company, dates), {
+            "total_orders": ("orders", None),
+            "total_revenue": ("gmv", None),
+        })
 
         # Top customers by spend
         top_customers = frappe.db.sql("""
@@ -76,78 +51,87 @@ def get_customer_dashboard(company="Justyol Morocco", period="month"):
             LIMIT 20
         """, (company, from_date, to_date), as_dict=True)
 
-        # Customer segments by order frequency
-        frequency_dist = frappe.db.sql("""
+        # Lifetime stats of the customers who ordered in the period, from the
+        # customer index (orders, returns and segments over their whole history)
+        period_customers = frappe.db.sql("""
             SELECT
-                CASE
-                    WHEN cnt = 1 THEN '1 Order'
-                    WHEN cnt BETWEEN 2 AND 3 THEN '2-3 Orders'
-                    WHEN cnt BETWEEN 4 AND 5 THEN '4-5 Orders'
-                    ELSE '6+ Orders'
-                END as segment,
-                COUNT(*) as customers,
-                SUM(spend) as total_spend
+                cs.customer,
+                cs.customer_name,
+                cs.first_order,
+                cs.order_count,
+                cs.total_spend,
+                cs.returns,
+                cs.cancelled,
+                cs.rto_rate,
+                cs.risk_score,
+                cs.rfm_segment
             FROM (
-                SELECT
-                    customer,
-                    COUNT(name) as cnt,
-                    SUM(grand_total) as spend
+                SELECT DISTINCT customer
                 FROM `tabSales Order`
                 WHERE company = %s
                     AND creation >= %s
                     AND creation <= %s
-                GROUP BY customer
-            ) t
-            GROUP BY segment
-            ORDER BY FIELD(segment, '1 Order', '2-3 Orders', '4-5 Orders', '6+ Orders')
-        """, (company, from_date, to_date), as_dict=True)
+            ) so
+            INNER JOIN `tabDashboard Customer Stats` cs
+                ON cs.company = %s AND cs.customer = so.customer
+        """, (company, from_date, to_date, company), as_dict=True)
+
+        # The period's customers are listed above anyway, so they are counted
+        # exactly here rather than through the unique-customer sketches
+        unique_customers = len(period_customers)
+
+        # New vs repeat customers: a customer is repeat when their first
+        # order is before the period
+        repeat_customers = sum(1 for c in period_customers if str(c.first_order) < from_date)
+        new_customers = unique_customers - repeat_customers
+        repeat_pct = round(repeat_customers / max(unique_customers, 1) * 100, 1)
+
+        # Customer segments by lifetime order frequency and by RFM
+        frequency_dist = {segment: {"customers": 0, "total_spend": 0.0} for segment in FREQUENCY_SEGMENTS}
+        rfm_dist = {}
+        for c in period_customers:
+            segment = frequency_dist[_frequency_segment(c.order_count)]
+            segment["customers"] += 1
+            segment["total_spend"] += float(c.total_spend or 0)
+
+            rfm = rfm_dist.setdefault(c.rfm_segment or "Unscored", {"customers": 0, "total_spend": 0.0})
+            rfm["customers"] += 1
+            rfm["total_spend"] += float(c.total_spend or 0)
 
         # Risk scoring — high RTO customers
-        risky_customers = frappe.db.sql("""
-            SELECT
-                customer,
-                customer_name,
-                COUNT(name) as total_orders,
-                SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns,
-                SUM(CASE WHEN custom_sales_status = 'Cancelled' THEN 1 ELSE 0 END) as cancelled,
-                COALESCE(SUM(grand_total), 0) as total_value
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-            GROUP BY customer, customer_name
-            HAVING returns > 0 OR cancelled > 1
-            ORDER BY returns DESC, cancelled DESC
-            LIMIT 20
-        """, (company, from_date, to_date), as_dict=True)
+        risky_customers = sorted(
+            (c for c in period_customers if c.returns > 0 or c.cancelled > 1),
+            key=lambda c: (c.returns, c.cancelled),
+            reverse=True,
+        )[:20]
 
         # Customer acquisition trend (new customers per day)
         acquisition_trend = frappe.db.sql("""
             SELECT
                 DATE(first_order) as date,
                 COUNT(*) as new_customers
-            FROM (
-                SELECT customer, MIN(creation) as first_order
-                FROM `tabSales Order`
-                WHERE company = %s
-                GROUP BY customer
-                HAVING MIN(creation) >= %s AND MIN(creation) <= %s
-            ) t
+            FROM `tabDashboard Customer Stats`
+            WHERE company = %s
+                AND first_order >= %s
+                AND first_order <= %s
             GROUP BY DATE(first_order)
             ORDER BY date ASC
         """, (company, from_date, to_date), as_dict=True)
 
+        total_orders = customer_kpis["total_orders"]
+        total_revenue = customer_kpis["total_revenue"]
+
         return {
             "kpis": {
-                "unique_customers": customer_kpis.unique_customers or 0,
-                "total_orders": customer_kpis.total_orders or 0,
-                "total_revenue": float(customer_kpis.total_revenue or 0),
-                "avg_order_value": float(customer_kpis.avg_order_value or 0),
+                "unique_customers": unique_customers,
+                "total_orders": total_orders,
+                "total_revenue": total_revenue,
+                "avg_order_value": total_revenue / total_orders if total_orders > 0 else 0,
                 "new_customers": new_customers,
                 "repeat_customers": repeat_customers,
                 "repeat_rate": repeat_pct,
-                "avg_orders_per_customer": round((customer_kpis.total_orders or 0) / max(customer_kpis.unique_customers or 1, 1), 1),
-                "revenue_per_customer": round(float(customer_kpis.total_revenue or 0) / max(customer_kpis.unique_customers or 1, 1), 2),
+                "avg_orders_per_customer": round(total_orders / max(unique_customers, 1), 1),
+                "revenue_per_customer": round(total_revenue / max(unique_customers, 1), 2),
             },
             "top_customers": [
                 {
@@ -163,18 +147,25 @@ def get_customer_dashboard(company="Justyol Morocco", period="month"):
                 for r in top_customers
             ],
             "frequency_distribution": [
-                {"segment": r.segment, "customers": r.customers, "total_spend": float(r.total_spend or 0)}
-                for r in frequency_dist
+                {"segment": segment, "customers": r["customers"], "total_spend": r["total_spend"]}
+                for segment, r in frequency_dist.items()
+                if r["customers"]
+            ],
+            "rfm_segments": [
+                {"segment": segment, "customers": r["customers"], "total_spend": r["total_spend"]}
+                for segment, r in sorted(rfm_dist.items(), key=lambda item: item[1]["customers"], reverse=True)
             ],
             "risky_customers": [
                 {
                     "customer": r.customer,
                     "customer_name": r.customer_name,
-                    "total_orders": r.total_orders,
-                    "returns": r.returns or 0,
-                    "cancelled": r.cancelled or 0,
-                    "total_value": float(r.total_value or 0),
-                    "risk_score": min(100, round(((r.returns or 0) * 30 + (r.cancelled or 0) * 15) / max(r.total_orders, 1) * 100)),
+                    "total_orders": r.order_count,
+                    "returns": r.returns,
+                    "cancelled": r.cancelled,
+                    "total_value": float(r.total_spend or 0),
+                    "rto_rate": r.rto_rate,
+                    "risk_score": r.risk_score,
+                    "segment": r.rfm_segment,
                 }
                 for r in risky_customers
             ],
@@ -186,4 +177,29 @@ def get_customer_dashboard(company="Justyol Morocco", period="month"):
             "company": company,
         }
 
-    return get_cached(cache_key, compute)
+    return get_cached(
+        cache_key,
+        compute,
+        revalidate=("justyol_dashboard.api.customers.get_customer_dashboard", {"company": company, "period": period}),
+        company=company,
+        depends_on={"Sales Order": [{"from": None, "to": dates["to"]}]},
+    )
+
+
+@frappe.whitelist()
+def get_customer_risk(customer, company="Justyol Morocco"):
+    """Precomputed lifetime stats, RTO rate, risk score and RFM segment of one customer.
+
+    Cheap enough to call per order (e.g. from the confirmation screen).
+    """
+    stats = frappe.db.get_value(
+        "Dashboard Customer Stats",
+        {"company": company, "customer": customer},
+        [
+            "order_count", "total_spend", "first_order", "last_order",
+            "delivered", "returns", "cancelled", "rto_rate", "risk_score",
+            "rfm_segment", "r_score", "f_score", "m_score",
+        ],
+        as_dict=True,
+    )
+    return stats or {"order_count": 0, "risk_score": 0, "rfm_segment": None}
@@ -1,8 +1,10 @@
 import frappe
 from justyol_dashboard.services.kpi_service import (
     get_period_dates,
-    get_previous_period_dates,
+    get_comparison_windows,
+    is_today,
     compute_sales_kpis,
+    compute_sales_kpi_windows,
     compute_revenue_trend,
     compute_status_distribution,
     compute_logistics_pipeline,
@@ -18,20 +20,27 @@ def get_executive_dashboard(company="Justyol Morocco", period="today"):
     """Single API call returning all executive dashboard data.
 
     This replaces 10-20 individual frappe.call() requests with one efficient call.
-    Results are cached in Redis for 2 minutes.
+    Results are cached in Redis and evicted when the orders they read change.
     """
     dates = get_period_dates(period)
-    prev_dates = get_previous_period_dates(dates, period)
+    windows = get_comparison_windows(dates, period)
+    prev_dates = windows["previous"]
 
     cache_key = f"dashboard:executive:{company}:{dates['from']}:{dates['to']}"
 
     def compute():
-        kpis = compute_sales_kpis(company, dates)
-        prev_kpis = compute_sales_kpis(company, prev_dates)
+        if is_today(dates):
+            # Today comes from the live counters; the comparison windows are
+            # cached apart so today's saves do not recompute them
+            kpis = dict(compute_sales_kpi_windows(company, {name: windows[name] for name in ("previous", "last_year")}))
+            kpis["current"] = compute_sales_kpis(company, dates)
+        else:
+            kpis = compute_sales_kpi_windows(company, windows)
 
         return {
-            "kpis": kpis,
-            "previous_kpis": prev_kpis,
+            "kpis": kpis["current"],
+            "previous_kpis": kpis["previous"],
+            "last_year_kpis": kpis["last_year"],
             "revenue_trend": compute_revenue_trend(company, dates),
             "status_distribution": compute_status_distribution(company, dates),
             "logistics_pipeline": compute_logistics_pipeline(company, dates),
@@ -44,8 +53,16 @@ def get_executive_dashboard(company="Justyol Morocco", period="today"):
                 "to_date": dates["to"],
                 "prev_from_date": prev_dates["from"],
                 "prev_to_date": prev_dates["to"],
+                "last_year_from_date": windows["last_year"]["from"],
+                "last_year_to_date": windows["last_year"]["to"],
             },
             "company": company,
         }
 
-    return get_cached(cache_key, compute)
+    return get_cached(
+        cache_key,
+        compute,
+        revalidate=("justyol_dashboard.api.executive.get_executive_dashboard", {"company": company, "period": period}),
+        company=company,
+        depends_on={"Sales Order": list(windows.values())},
+    )
@@ -141,4 +141,16 @@ def get_finance_dashboard(company="Justyol Morocco", period="month"):
             "company": company,
         }
 
-    return get_cached(cache_key, compute)
+    return get_cached(
+        cache_key,
+        compute,
+        revalidate=("justyol_dashboard.api.finance.get_finance_dashboard", {"company": company, "period": period}),
+        company=company,
+        depends_on={
+            # Receivable/payable totals are all-time, so any invoice or payment counts
+            "Sales Invoice": None,
+            "Purchase Invoice": None,
+            "Payment Entry": None,
+            "Sales Order": [dates],
+        },
+    )
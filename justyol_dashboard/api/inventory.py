@@ -139,4 +139,11 @@ def get_inventory_dashboard(company="Justyol Morocco"):
             "company": company,
         }
 
-    return get_cached(cache_key, compute, ttl=180)
+    return get_cached(
+        cache_key,
+        compute,
+        ttl=1800,
+        revalidate=("justyol_dashboard.api.inventory.get_inventory_dashboard", {"company": company}),
+        company=company,
+        depends_on={"Bin": None, "Purchase Order": None},
+    )
@@ -1,6 +1,21 @@
 import frappe
-from justyol_dashboard.services.kpi_service import get_period_dates
+from justyol_dashboard.services.kpi_service import (
+    get_period_dates,
+    scan_order_facts,
+    aggregate_orders,
+    rank_groups,
+    CONFIRMED,
+    CANCELLED,
+    DELIVERED,
+    RETURNED,
+)
 from justyol_dashboard.services.cache_service import get_cached
+from justyol_dashboard.services.sketch_service import (
+    count_customers,
+    count_customers_by_source,
+    order_value_percentiles,
+    UNKNOWN_SOURCE,
+)
 
 
 @frappe.whitelist()
@@ -10,128 +25,106 @@ def get_marketing_dashboard(company="Justyol Morocco", period="month"):
     cache_key = f"dashboard:marketing:{company}:{dates['from']}:{dates['to']}"
 
     def compute():
-        from_date = dates["from"]
-        to_date = dates["to"] + " 23:59:59"
+        facts = scan_order_facts(company, dates)
 
         # Full funnel metrics
-        funnel = frappe.db.sql("""
-            SELECT
-                COUNT(name) as total_orders,
-                COALESCE(SUM(grand_total), 0) as total_gmv,
-                SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed,
-                COALESCE(SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN grand_total ELSE 0 END), 0) as confirmed_gmv,
-                SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN 1 ELSE 0 END) as delivered,
-                COALESCE(SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN grand_total ELSE 0 END), 0) as delivered_gmv,
-                SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns,
-                SUM(CASE WHEN custom_sales_status = 'Cancelled' THEN 1 ELSE 0 END) as cancelled,
-                COUNT(DISTINCT customer) as unique_customers
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-        """, (company, from_date, to_date), as_dict=True)[0]
+        funnel = aggregate_orders(facts, {
+            "total_orders": ("orders", None),
+            "total_gmv": ("gmv", None),
+            "confirmed": ("orders", CONFIRMED),
+            "confirmed_gmv": ("gmv", CONFIRMED),
+            "delivered": ("orders", DELIVERED),
+            "delivered_gmv": ("gmv", DELIVERED),
+            "returns": ("orders", RETURNED),
+            "cancelled": ("orders", CANCELLED),
+        })
 
-        total = funnel.total_orders or 0
-        confirmed = funnel.confirmed or 0
-        delivered = funnel.delivered or 0
+        total = funnel["total_orders"]
+        confirmed = funnel["confirmed"]
+        delivered = funnel["delivered"]
 
         # Source/channel breakdown (using source field if available)
-        source_breakdown = frappe.db.sql("""
-            SELECT
-                COALESCE(source, 'Direct / Unknown') as source,
-                COUNT(name) as orders,
-                COALESCE(SUM(grand_total), 0) as gmv,
-                SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed,
-                SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN 1 ELSE 0 END) as delivered,
-                SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns,
-                COUNT(DISTINCT customer) as customers
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-            GROUP BY COALESCE(source, 'Direct / Unknown')
-            ORDER BY orders DESC
-        """, (company, from_date, to_date), as_dict=True)
+        sources = aggregate_orders(facts, {
+            "orders": ("orders", None),
+            "gmv": ("gmv", None),
+            "confirmed": ("orders", CONFIRMED),
+            "delivered": ("orders", DELIVERED),
+            "returns": ("orders", RETURNED),
+        }, key=("source", UNKNOWN_SOURCE))
+        source_breakdown = rank_groups(sources, "orders")
+        source_customers = count_customers_by_source(company, dates, [source for source, _ in source_breakdown])
 
         # Daily orders trend for acquisition rate
-        daily_orders = frappe.db.sql("""
-            SELECT
-                DATE(creation) as date,
-                COUNT(name) as orders,
-                COALESCE(SUM(grand_total), 0) as gmv,
-                SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed,
-                SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN 1 ELSE 0 END) as delivered
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-            GROUP BY DATE(creation)
-            ORDER BY date ASC
-        """, (company, from_date, to_date), as_dict=True)
+        daily_orders = aggregate_orders(scan_order_facts(company, dates), {
+            "orders": ("orders", None),
+            "gmv": ("gmv", None),
+            "confirmed": ("orders", CONFIRMED),
+            "delivered": ("orders", DELIVERED),
+        }, key="day")
 
         # Top performing products (by delivery success)
         product_perf = frappe.db.sql("""
             SELECT
-                soi.item_code,
-                soi.item_name,
-                COUNT(DISTINCT so.name) as orders,
-                SUM(soi.qty) as qty,
-                COALESCE(SUM(soi.amount), 0) as revenue,
-                SUM(CASE WHEN so.custom_track_shipment_status = 'Delivered' THEN 1 ELSE 0 END) as delivered,
-                SUM(CASE WHEN so.custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns
-            FROM `tabSales Order Item` soi
-            INNER JOIN `tabSales Order` so ON so.name = soi.parent
-            WHERE so.company = %s
-                AND so.creation >= %s
-                AND so.creation <= %s
-            GROUP BY soi.item_code, soi.item_name
+                item_code,
+                MAX(item_name) as item_name,
+                SUM(orders) as orders,
+                SUM(qty) as qty,
+                COALESCE(SUM(revenue), 0) as revenue,
+                SUM(CASE WHEN shipment_status = 'Delivered' THEN orders ELSE 0 END) as delivered,
+                SUM(CASE WHEN shipment_status = 'Return' THEN orders ELSE 0 END) as returns
+            FROM `tabDashboard Item Fact`
+            WHERE company = %s
+                AND day BETWEEN %s AND %s
+            GROUP BY item_code
+            HAVING SUM(orders) > 0
             ORDER BY revenue DESC
             LIMIT 15
-        """, (company, from_date, to_date), as_dict=True)
+        """, (company, dates["from"], dates["to"]), as_dict=True)
 
         confirmed_rate = round(confirmed / total * 100, 1) if total > 0 else 0
         delivered_rate = round(delivered / confirmed * 100, 1) if confirmed > 0 else 0
-        revenue_after_rto = float(funnel.delivered_gmv or 0)
+        revenue_after_rto = funnel["delivered_gmv"]
 
         return {
             "kpis": {
                 "total_orders": total,
-                "total_gmv": float(funnel.total_gmv or 0),
+                "total_gmv": funnel["total_gmv"],
                 "confirmed": confirmed,
-                "confirmed_gmv": float(funnel.confirmed_gmv or 0),
+                "confirmed_gmv": funnel["confirmed_gmv"],
                 "delivered": delivered,
-                "delivered_gmv": float(funnel.delivered_gmv or 0),
-                "returns": funnel.returns or 0,
-                "cancelled": funnel.cancelled or 0,
-                "unique_customers": funnel.unique_customers or 0,
+                "delivered_gmv": funnel["delivered_gmv"],
+                "returns": funnel["returns"],
+                "cancelled": funnel["cancelled"],
+                "unique_customers": count_customers(company, dates),
                 "confirmation_rate": confirmed_rate,
                 "delivery_rate": delivered_rate,
                 "revenue_after_rto": revenue_after_rto,
                 "effective_rate": round(delivered / total * 100, 1) if total > 0 else 0,
             },
             "funnel_stages": [
-                {"stage": "Orders Created", "count": total, "value": float(funnel.total_gmv or 0), "color": "#6366f1"},
-                {"stage": "Confirmed", "count": confirmed, "value": float(funnel.confirmed_gmv or 0), "color": "#3b82f6"},
-                {"stage": "Shipped", "count": confirmed, "value": float(funnel.confirmed_gmv or 0), "color": "#06b6d4"},
-                {"stage": "Delivered", "count": delivered, "value": float(funnel.delivered_gmv or 0), "color": "#22c55e"},
+                {"stage": "Orders Created", "count": total, "value": funnel["total_gmv"], "color": "#6366f1"},
+                {"stage": "Confirmed", "count": confirmed, "value": funnel["confirmed_gmv"], "color": "#3b82f6"},
+                {"stage": "Shipped", "count": confirmed, "value": funnel["confirmed_gmv"], "color": "#06b6d4"},
+                {"stage": "Delivered", "count": delivered, "value": funnel["delivered_gmv"], "color": "#22c55e"},
                 {"stage": "Cash Collected", "count": delivered, "value": revenue_after_rto, "color": "#14b8a6"},
             ],
             "source_breakdown": [
                 {
-                    "source": r.source,
-                    "orders": r.orders,
-                    "gmv": float(r.gmv or 0),
-                    "confirmed": r.confirmed or 0,
-                    "delivered": r.delivered or 0,
-                    "returns": r.returns or 0,
-                    "customers": r.customers,
-                    "conf_rate": round((r.confirmed or 0) / max(r.orders, 1) * 100, 1),
+                    "source": source,
+                    "orders": r["orders"],
+                    "gmv": r["gmv"],
+                    "confirmed": r["confirmed"],
+                    "delivered": r["delivered"],
+                    "returns": r["returns"],
+                    "customers": source_customers[source],
+                    "median_order_value": order_value_percentiles(company, dates, source)["p50"],
+                    "conf_rate": round(r["confirmed"] / max(r["orders"], 1) * 100, 1),
                 }
-                for r in source_breakdown
+                for source, r in source_breakdown
             ],
             "daily_trend": [
-                {"date": str(r.date), "orders": r.orders, "gmv": float(r.gmv), "confirmed": r.confirmed, "delivered": r.delivered}
-                for r in daily_orders
+                {"date": str(day), "orders": r["orders"], "gmv": r["gmv"], "confirmed": r["confirmed"], "delivered": r["delivered"]}
+                for day, r in sorted(daily_orders.items())
             ],
             "product_performance": [
                 {
@@ -150,4 +143,10 @@ def get_marketing_dashboard(company="Justyol Morocco", period="month"):
             "company": company,
         }
 
-    return get_cached(cache_key, compute)
+    return get_cached(
+        cache_key,
+        compute,
+        revalidate=("justyol_dashboard.api.marketing.get_marketing_dashboard", {"company": company, "period": period}),
+        company=company,
+        depends_on={"Sales Order": [dates]},
+    )
@@ -1,6 +1,23 @@
 import frappe
-from justyol_dashboard.services.kpi_service import get_period_dates, compute_operations_funnel
+from justyol_dashboard.services.kpi_service import (
+    get_period_dates,
+    compute_operations_funnel,
+    scan_order_facts,
+    is_today,
+    SECTION_TTL,
+    aggregate_orders,
+    rank_groups,
+    rate,
+    PENDING,
+    CONFIRMED,
+    CANCELLED,
+    READY_TO_SHIP,
+    SHIPPED,
+    DELIVERED,
+    RETURNED,
+)
 from justyol_dashboard.services.cache_service import get_cached
+from justyol_dashboard.services.transition_service import get_stage_durations, STAGES, STAGE_GROUPS
 
 
 @frappe.whitelist()
@@ -14,76 +31,127 @@ def get_operations_dashboard(company="Justyol Morocco", period="today"):
         to_date = dates["to"] + " 23:59:59"
 
         # Pipeline counts
-        pipeline = frappe.db.sql("""
-            SELECT
-                SUM(CASE WHEN custom_sales_status = 'Pending' THEN 1 ELSE 0 END) as pending_confirmation,
-                SUM(CASE WHEN custom_sales_status = 'Confirmed' AND custom_logistics_status = 'Pending' THEN 1 ELSE 0 END) as pending_preparation,
-                SUM(CASE WHEN custom_logistics_status = 'Ready to Ship' THEN 1 ELSE 0 END) as ready_to_ship,
-                SUM(CASE WHEN custom_logistics_status = 'Shipped' THEN 1 ELSE 0 END) as shipped,
-                SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN 1 ELSE 0 END) as delivered,
-                SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-        """, (company, from_date, to_date), as_dict=True)[0]
-
-        # Hourly order flow (for activity chart)
-        hourly = frappe.db.sql("""
-            SELECT
-                HOUR(creation) as hour,
-                COUNT(name) as orders,
-                SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-            GROUP BY HOUR(creation)
-            ORDER BY hour ASC
-        """, (company, from_date, to_date), as_dict=True)
+        facts = scan_order_facts(company, dates)
+        pipeline = aggregate_orders(facts, {
+            "pending_confirmation": ("orders", PENDING),
+            "pending_preparation": ("orders", dict(CONFIRMED, custom_logistics_status="Pending")),
+            "ready_to_ship": ("orders", READY_TO_SHIP),
+            "shipped": ("orders", SHIPPED),
+            "delivered": ("orders", DELIVERED),
+            "returns": ("orders", RETURNED),
+        })
+
+        # Hourly order flow (for activity chart); today's live rows carry the hour
+        if is_today(dates):
+            hours = aggregate_orders(facts, {
+                "orders": ("orders", None),
+                "confirmed": ("orders", CONFIRMED),
+            }, key="hour")
+            hourly = [frappe._dict(hour=hour, **row) for hour, row in sorted(hours.items())]
+        else:
+            hourly = _hourly_activity(company, from_date, to_date)
 
         # Team workload (orders by assigned user)
-        workload = frappe.db.sql("""
-            SELECT
-                COALESCE(owner, 'Unassigned') as agent,
-                COUNT(name) as orders,
-                SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed,
-                SUM(CASE WHEN custom_sales_status = 'Cancelled' THEN 1 ELSE 0 END) as cancelled
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-            GROUP BY owner
-            ORDER BY orders DESC
-            LIMIT 20
-        """, (company, from_date, to_date), as_dict=True)
+        workload = aggregate_orders(facts, {
+            "orders": ("orders", None),
+            "confirmed": ("orders", CONFIRMED),
+            "cancelled": ("orders", CANCELLED),
+        }, key=("owner", "Unassigned"))
+
+        # Hours spent per stage, from the transition log
+        stage_durations = _stage_durations(company, dates)
 
         return {
-            "pipeline": {
-                "pending_confirmation": pipeline.pending_confirmation or 0,
-                "pending_preparation": pipeline.pending_preparation or 0,
-                "ready_to_ship": pipeline.ready_to_ship or 0,
-                "shipped": pipeline.shipped or 0,
-                "delivered": pipeline.delivered or 0,
-                "returns": pipeline.returns or 0,
-            },
+            "pipeline": pipeline,
             "hourly_activity": [
                 {"hour": row.hour, "orders": row.orders, "confirmed": row.confirmed}
                 for row in hourly
             ],
             "team_workload": [
                 {
-                    "agent": row.agent,
-                    "orders": row.orders,
-                    "confirmed": row.confirmed or 0,
-                    "cancelled": row.cancelled or 0,
-                    "rate": round((row.confirmed or 0) / row.orders * 100, 1) if row.orders > 0 else 0,
+                    "agent": agent,
+                    "orders": row["orders"],
+                    "confirmed": row["confirmed"],
+                    "cancelled": row["cancelled"],
+                    "rate": rate(row["confirmed"], row["orders"]),
                 }
-                for row in workload
+                for agent, row in rank_groups(workload, "orders", 20)
             ],
             "funnel": compute_operations_funnel(company, dates),
+            "stage_durations": stage_durations,
+            "period": dates,
+            "company": company,
+        }
+
+    return get_cached(
+        cache_key,
+        compute,
+        revalidate=("justyol_dashboard.api.operations.get_operations_dashboard", {"company": company, "period": period}),
+        company=company,
+        depends_on={"Sales Order": [dates]},
+    )
+
+
+def _hourly_activity(company, from_date, to_date):
+    return frappe.db.sql("""
+        SELECT
+            HOUR(creation) as hour,
+            COUNT(name) as orders,
+            SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed
+        FROM `tabSales Order`
+        WHERE company = %s
+            AND creation >= %s
+            AND creation <= %s
+        GROUP BY HOUR(creation)
+        ORDER BY hour ASC
+    """, (company, from_date, to_date), as_dict=True)
+
+
+def _stage_durations(company, dates):
+    """Overall row per stage, cached on a timer only.
+
+    Percentiles move slowly, so unlike the rest of the dashboard they are
+    not recomputed on every Sales Order save of the period.
+    """
+    def compute():
+        stage_durations = {}
+        for stage in STAGES:
+            rows = get_stage_durations(company, dates, stage)
+            stage_durations[stage] = rows[0] if rows else {"orders": 0, "p50": 0, "p90": 0, "p99": 0}
+        return stage_durations
+
+    return get_cached(
+        f"dashboard:section:stage_durations:{company}:{dates['from']}:{dates['to']}",
+        compute,
+        ttl=SECTION_TTL,
+        company=company,
+    )
+
+
+@frappe.whitelist()
+def get_stage_duration_breakdown(company="Justyol Morocco", period="week", stage="confirmation", group_by="day"):
+    """P50/P90/P99 hours orders spent in one stage, per day, agent or zone.
+
+    Cached on a timer only, like the overall rows of the operations view.
+    """
+    if stage not in STAGES or group_by not in STAGE_GROUPS:
+        frappe.throw(f"Unknown stage or grouping: {stage}, {group_by}")
+
+    dates = get_period_dates(period)
+    cache_key = f"dashboard:stage_durations:{company}:{stage}:{group_by}:{dates['from']}:{dates['to']}"
+
+    def compute():
+        return {
+            "stage": stage,
+            "group_by": group_by,
+            "rows": get_stage_durations(company, dates, stage, group_by),
             "period": dates,
             "company": company,
         }
 
-    return get_cached(cache_key, compute)
+    return get_cached(
+        cache_key,
+        compute,
+        ttl=SECTION_TTL,
+        company=company,
+    )
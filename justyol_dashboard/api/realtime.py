@@ -1,28 +1,57 @@
+from functools import partial
+
 import frappe
-from justyol_dashboard.services.realtime_service import push_dashboard_update
-from justyol_dashboard.services.cache_service import invalidate_dashboard_cache
+from justyol_dashboard.services import realtime_service
+from justyol_dashboard.services.invalidation_service import get_doc_target
 
 
 def on_sales_order_change(doc, method):
-    """Hook called when a Sales Order is created, updated, or submitted.
+    """Hook called when a Sales Order is updated, submitted, changed after submit or deleted.
 
-    Pushes real-time updates to all connected dashboard clients and
-    invalidates relevant caches.
+    Once the save commits, queues the order for its company's next
+    coalesced push, which also invalidates the cached data whose date range
+    includes it. Saves that touch no field the dashboards read are ignored.
     """
-    # Invalidate cached data for this company
-    invalidate_dashboard_cache(company=doc.company)
-
-    # Push real-time event to dashboards
-    push_dashboard_update(
-        event_type="sales_order_update",
-        data={
-            "order_name": doc.name,
-            "customer": doc.customer,
-            "grand_total": float(doc.grand_total or 0),
-            "sales_status": doc.custom_sales_status,
-            "logistics_status": doc.custom_logistics_status,
-            "shipment_status": doc.custom_track_shipment_status,
-            "action": method,  # "after_insert", "on_update", "on_submit"
-        },
-        company=doc.company,
-    )
+    if not realtime_service.has_tracked_changes(doc):
+        return
+
+    target = get_doc_target(doc)
+    if target:
+        frappe.db.after_commit.add(partial(
+            realtime_service.queue_order_change, doc, dates=target["dates"], deleted=method == "on_trash",
+        ))
+
+
+@frappe.whitelist()
+def subscribe(company, dashboard, client_id):
+    """Called by dashboard clients when they open a company's dashboard, and
+    every minute while it stays open."""
+    realtime_service.subscribe(company, dashboard, client_id)
+
+
+@frappe.whitelist()
+def unsubscribe(company, client_id):
+    """Called by dashboard clients when they leave a company."""
+    realtime_service.unsubscribe(company, client_id)
+
+
+@frappe.whitelist()
+def get_events_since(company, since=0):
+    """Events a reconnecting client missed since the last sequence number it saw."""
+    frappe.has_permission("Company", "read", company, throw=True)
+    return realtime_service.get_events_since(company, since)
+
+
+@frappe.whitelist()
+def get_subscriptions(company="Justyol Morocco"):
+    """Clients viewing a company per dashboard, with push fan-out counters."""
+    frappe.only_for("System Manager")
+    dashboards = {}
+    for sub in realtime_service.get_subscribers(company).values():
+        dashboards[sub["dashboard"]] = dashboards.get(sub["dashboard"], 0) + 1
+
+    return {
+        "company": company,
+        "dashboards": dashboards,
+        "metrics": realtime_service.get_realtime_metrics(),
+    }
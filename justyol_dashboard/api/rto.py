@@ -1,5 +1,19 @@
 import frappe
-from justyol_dashboard.services.kpi_service import get_period_dates, get_previous_period_dates
+from justyol_dashboard.services.kpi_service import (
+    get_period_dates,
+    get_comparison_windows,
+    scan_orders,
+    scan_order_fact_windows,
+    aggregate_windows,
+    aggregate_orders,
+    rank_groups,
+    rate,
+    CONFIRMED,
+    CANCELLED,
+    SHIPPED,
+    DELIVERED,
+    RETURNED,
+)
 from justyol_dashboard.services.cache_service import get_cached
 
 
@@ -7,149 +21,106 @@ from justyol_dashboard.services.cache_service import get_cached
 def get_rto_dashboard(company="Justyol Morocco", period="month"):
     """Single API call returning all RTO & Returns analytics data."""
     dates = get_period_dates(period)
+    windows = get_comparison_windows(dates, period, compare=("previous",))
     cache_key = f"dashboard:rto:{company}:{dates['from']}:{dates['to']}"
 
     def compute():
-        from_date = dates["from"]
-        to_date = dates["to"] + " 23:59:59"
-        prev_dates = get_previous_period_dates(dates, period)
+        rows = scan_orders(company, dates)
 
-        # Core RTO metrics
-        rto_kpis = frappe.db.sql("""
-            SELECT
-                COUNT(name) as total_orders,
-                SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed,
-                SUM(CASE WHEN custom_logistics_status = 'Shipped' THEN 1 ELSE 0 END) as total_shipped,
-                SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN 1 ELSE 0 END) as delivered,
-                SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns,
-                COALESCE(SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN grand_total ELSE 0 END), 0) as return_value,
-                COALESCE(SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN grand_total ELSE 0 END), 0) as delivered_value,
-                COALESCE(SUM(CASE WHEN custom_logistics_status = 'Shipped' THEN grand_total ELSE 0 END), 0) as shipped_value,
-                SUM(CASE WHEN custom_sales_status = 'Cancelled' THEN 1 ELSE 0 END) as cancelled
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-        """, (company, from_date, to_date), as_dict=True)[0]
+        # Core RTO metrics, for this period and the previous one in one scan
+        windows_kpis = aggregate_windows(scan_order_fact_windows(company, windows), windows, {
+            "total_orders": ("orders", None),
+            "confirmed": ("orders", CONFIRMED),
+            "total_shipped": ("orders", SHIPPED),
+            "delivered": ("orders", DELIVERED),
+            "returns": ("orders", RETURNED),
+            "return_value": ("gmv", RETURNED),
+            "delivered_value": ("gmv", DELIVERED),
+            "shipped_value": ("gmv", SHIPPED),
+            "cancelled": ("orders", CANCELLED),
+        })
+        rto_kpis = windows_kpis["current"]
+        prev_kpis = windows_kpis["previous"]
 
-        # Previous period for comparison
-        prev_kpis = frappe.db.sql("""
-            SELECT
-                SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns,
-                SUM(CASE WHEN custom_logistics_status = 'Shipped' THEN 1 ELSE 0 END) as total_shipped
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-        """, (company, prev_dates["from"], prev_dates["to"] + " 23:59:59"), as_dict=True)[0]
-
-        total_shipped = (rto_kpis.total_shipped or 0) + (rto_kpis.delivered or 0) + (rto_kpis.returns or 0)
-        rto_rate = round((rto_kpis.returns or 0) / total_shipped * 100, 1) if total_shipped > 0 else 0
-        prev_shipped = (prev_kpis.total_shipped or 0)
-        prev_rto_rate = round((prev_kpis.returns or 0) / prev_shipped * 100, 1) if prev_shipped > 0 else 0
+        total_shipped = rto_kpis["total_shipped"] + rto_kpis["delivered"] + rto_kpis["returns"]
+        rto_rate = rate(rto_kpis["returns"], total_shipped)
+        prev_rto_rate = rate(prev_kpis["returns"], prev_kpis["total_shipped"])
 
         # Estimated RTO cost (shipping cost per return — rough estimate)
-        avg_order_value = float(rto_kpis.shipped_value or 0) / total_shipped if total_shipped > 0 else 0
+        avg_order_value = rto_kpis["shipped_value"] / total_shipped if total_shipped > 0 else 0
         estimated_shipping_cost = avg_order_value * 0.08  # ~8% of AOV as shipping estimate
-        total_rto_cost = float(rto_kpis.return_value or 0) + (estimated_shipping_cost * (rto_kpis.returns or 0))
+        total_rto_cost = rto_kpis["return_value"] + (estimated_shipping_cost * rto_kpis["returns"])
 
         # RTO by cancellation reason (for returned orders)
-        rto_reasons = frappe.db.sql("""
-            SELECT
-                COALESCE(custom_cancellation_reason, 'No Reason Given') as reason,
-                COUNT(name) as count,
-                COALESCE(SUM(grand_total), 0) as value
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-                AND custom_track_shipment_status = 'Return'
-            GROUP BY custom_cancellation_reason
-            ORDER BY count DESC
-            LIMIT 10
-        """, (company, from_date, to_date), as_dict=True)
+        rto_reasons = aggregate_orders(
+            rows,
+            {"count": ("orders", None), "value": ("gmv", None)},
+            key=("custom_cancellation_reason", "No Reason Given"),
+            where=RETURNED,
+        )
 
         # RTO trend over time
-        rto_trend = frappe.db.sql("""
-            SELECT
-                DATE(creation) as date,
-                SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN 1 ELSE 0 END) as delivered,
-                SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns,
-                SUM(CASE WHEN custom_logistics_status = 'Shipped' THEN 1 ELSE 0 END) as shipped
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-            GROUP BY DATE(creation)
-            ORDER BY date ASC
-        """, (company, from_date, to_date), as_dict=True)
+        rto_trend = aggregate_orders(rows, {
+            "delivered": ("orders", DELIVERED),
+            "returns": ("orders", RETURNED),
+            "shipped": ("orders", SHIPPED),
+        }, key="day")
 
         # RTO by product (which products get returned most)
         rto_products = frappe.db.sql("""
             SELECT
-                soi.item_code,
-                soi.item_name,
-                COUNT(DISTINCT so.name) as return_orders,
-                SUM(soi.qty) as return_qty,
-                COALESCE(SUM(soi.amount), 0) as return_value
-            FROM `tabSales Order Item` soi
-            INNER JOIN `tabSales Order` so ON so.name = soi.parent
-            WHERE so.company = %s
-                AND so.creation >= %s
-                AND so.creation <= %s
-                AND so.custom_track_shipment_status = 'Return'
-            GROUP BY soi.item_code, soi.item_name
+                item_code,
+                MAX(item_name) as item_name,
+                SUM(orders) as return_orders,
+                SUM(qty) as return_qty,
+                COALESCE(SUM(revenue), 0) as return_value
+            FROM `tabDashboard Item Fact`
+            WHERE company = %s
+                AND day BETWEEN %s AND %s
+                AND shipment_status = 'Return'
+            GROUP BY item_code
+            HAVING SUM(orders) > 0
             ORDER BY return_orders DESC
             LIMIT 15
-        """, (company, from_date, to_date), as_dict=True)
+        """, (company, dates["from"], dates["to"]), as_dict=True)
 
         # RTO by city/zone
-        rto_zones = frappe.db.sql("""
-            SELECT
-                COALESCE(shipping_address_name, customer_address, 'Unknown') as zone,
-                COUNT(name) as total_orders,
-                SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN 1 ELSE 0 END) as delivered,
-                SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns
-            FROM `tabSales Order`
-            WHERE company = %s
-                AND creation >= %s
-                AND creation <= %s
-                AND custom_logistics_status IN ('Shipped')
-            GROUP BY COALESCE(shipping_address_name, customer_address, 'Unknown')
-            HAVING returns > 0
-            ORDER BY returns DESC
-            LIMIT 15
-        """, (company, from_date, to_date), as_dict=True)
+        rto_zones = aggregate_orders(rows, {
+            "total_orders": ("orders", None),
+            "delivered": ("orders", DELIVERED),
+            "returns": ("orders", RETURNED),
+        }, key=("zone", "Unknown"), where=SHIPPED)
+        rto_zones = {zone: r for zone, r in rto_zones.items() if r["returns"] > 0}
 
         return {
             "kpis": {
-                "total_orders": rto_kpis.total_orders or 0,
-                "confirmed": rto_kpis.confirmed or 0,
+                "total_orders": rto_kpis["total_orders"],
+                "confirmed": rto_kpis["confirmed"],
                 "total_shipped": total_shipped,
-                "delivered": rto_kpis.delivered or 0,
-                "returns": rto_kpis.returns or 0,
-                "cancelled": rto_kpis.cancelled or 0,
+                "delivered": rto_kpis["delivered"],
+                "returns": rto_kpis["returns"],
+                "cancelled": rto_kpis["cancelled"],
                 "rto_rate": rto_rate,
                 "prev_rto_rate": prev_rto_rate,
-                "delivery_rate": round((rto_kpis.delivered or 0) / total_shipped * 100, 1) if total_shipped > 0 else 0,
-                "return_value": float(rto_kpis.return_value or 0),
-                "delivered_value": float(rto_kpis.delivered_value or 0),
+                "delivery_rate": rate(rto_kpis["delivered"], total_shipped),
+                "return_value": rto_kpis["return_value"],
+                "delivered_value": rto_kpis["delivered_value"],
                 "total_rto_cost": round(total_rto_cost, 2),
-                "revenue_after_rto": float(rto_kpis.delivered_value or 0),
+                "revenue_after_rto": rto_kpis["delivered_value"],
             },
             "rto_reasons": [
-                {"reason": r.reason, "count": r.count, "value": float(r.value)}
-                for r in rto_reasons
+                {"reason": reason, "count": r["count"], "value": r["value"]}
+                for reason, r in rank_groups(rto_reasons, "count", 10)
             ],
             "rto_trend": [
                 {
-                    "date": str(r.date),
-                    "delivered": r.delivered or 0,
-                    "returns": r.returns or 0,
-                    "shipped": r.shipped or 0,
-                    "rto_rate": round((r.returns or 0) / max((r.shipped or 0) + (r.delivered or 0) + (r.returns or 0), 1) * 100, 1),
+                    "date": str(day),
+                    "delivered": r["delivered"],
+                    "returns": r["returns"],
+                    "shipped": r["shipped"],
+                    "rto_rate": round(r["returns"] / max(r["shipped"] + r["delivered"] + r["returns"], 1) * 100, 1),
                 }
-                for r in rto_trend
+                for day, r in sorted(rto_trend.items())
             ],
             "rto_products": [
                 {
@@ -163,16 +134,22 @@ def get_rto_dashboard(company="Justyol Morocco", period="month"):
             ],
             "rto_zones": [
                 {
-                    "zone": r.zone,
-                    "total_orders": r.total_orders,
-                    "delivered": r.delivered or 0,
-                    "returns": r.returns or 0,
-                    "rto_rate": round((r.returns or 0) / max(r.total_orders, 1) * 100, 1),
+                    "zone": zone,
+                    "total_orders": r["total_orders"],
+                    "delivered": r["delivered"],
+                    "returns": r["returns"],
+                    "rto_rate": round(r["returns"] / max(r["total_orders"], 1) * 100, 1),
                 }
-                for r in rto_zones
+                for zone, r in rank_groups(rto_zones, "returns", 15)
             ],
             "period": dates,
             "company": company,
         }
 
-    return get_cached(cache_key, compute)
+    return get_cached(
+        cache_key,
+        compute,
+        revalidate=("justyol_dashboard.api.rto.get_rto_dashboard", {"company": company, "period": period}),
+        company=company,
+        depends_on={"Sales Order": list(windows.values())},
+    )
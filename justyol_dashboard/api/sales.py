@@ -1,8 +1,8 @@
 import frappe
 from justyol_dashboard.services.kpi_service import (
     get_period_dates,
-    get_previous_period_dates,
-    compute_sales_kpis,
+    get_comparison_windows,
+    compute_sales_kpi_windows,
     compute_revenue_trend,
     compute_status_distribution,
     compute_logistics_pipeline,
@@ -27,16 +27,17 @@ def get_sales_dashboard(company="Justyol Morocco", from_date=None, to_date=None,
     else:
         dates = get_period_dates(period)
 
-    prev_dates = get_previous_period_dates(dates, period)
+    windows = get_comparison_windows(dates, period)
+    prev_dates = windows["previous"]
     cache_key = f"dashboard:sales:{company}:{dates['from']}:{dates['to']}"
 
     def compute():
-        kpis = compute_sales_kpis(company, dates)
-        prev_kpis = compute_sales_kpis(company, prev_dates)
+        kpis = compute_sales_kpi_windows(company, windows)
 
         return {
-            "kpis": kpis,
-            "previous_kpis": prev_kpis,
+            "kpis": kpis["current"],
+            "previous_kpis": kpis["previous"],
+            "last_year_kpis": kpis["last_year"],
             "revenue_trend": compute_revenue_trend(company, dates),
             "status_distribution": compute_status_distribution(company, dates),
             "logistics_pipeline": compute_logistics_pipeline(company, dates),
@@ -50,11 +51,21 @@ def get_sales_dashboard(company="Justyol Morocco", from_date=None, to_date=None,
                 "label": period,
                 "from_date": dates["from"],
                 "to_date": dates["to"],
+                "prev_from_date": prev_dates["from"],
+                "prev_to_date": prev_dates["to"],
+                "last_year_from_date": windows["last_year"]["from"],
+                "last_year_to_date": windows["last_year"]["to"],
             },
             "company": company,
         }
 
-    return get_cached(cache_key, compute)
+    return get_cached(
+        cache_key,
+        compute,
+        revalidate=("justyol_dashboard.api.sales.get_sales_dashboard", {"company": company, "from_date": from_date, "to_date": to_date, "period": period}),
+        company=company,
+        depends_on={"Sales Order": list(windows.values())},
+    )
 
 
 @frappe.whitelist()
@@ -153,4 +153,15 @@ def get_warehouse_dashboard(company="Justyol Morocco", period="today"):
             "company": company,
         }
 
-    return get_cached(cache_key, compute)
+    return get_cached(
+        cache_key,
+        compute,
+        revalidate=("justyol_dashboard.api.warehouse.get_warehouse_dashboard", {"company": company, "period": period}),
+        company=company,
+        depends_on={
+            "Sales Order": [dates],
+            "Delivery Note": [dates],
+            "Stock Entry": [dates],
+            "Bin": None,
+        },
+    )
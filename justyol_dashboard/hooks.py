@@ -21,24 +21,95 @@ required_apps = ["frappe", "erpnext"]
 page_js = {"justyol-hub": "public/dist/js/dashboard.bundle.js"}
 page_css = {"justyol-hub": "public/dist/js/dashboard.bundle.css"}
 
-# --- Real-time Events (Socket.IO) ---
-# Push live updates to dashboards when Sales Orders change
+# --- Document Events ---
+# Sales Orders push live updates to dashboards (and invalidate their caches).
+# Every other doctype a dashboard reads goes through the invalidation router,
+# which evicts only the cache entries that depend on it.
+_invalidate = "justyol_dashboard.services.invalidation_service.on_doc_change"
+_invalidate_events = {
+    "on_update": _invalidate,
+    "on_submit": _invalidate,
+    "on_cancel": _invalidate,
+    "on_update_after_submit": _invalidate,
+    "on_trash": _invalidate,
+}
+_order_facts = "justyol_dashboard.services.order_fact_service.on_sales_order_change"
+_customer_index = "justyol_dashboard.services.customer_index_service.on_sales_order_change"
+_item_facts = "justyol_dashboard.services.item_fact_service.on_sales_order_change"
+_sketches = "justyol_dashboard.services.sketch_service.on_sales_order_change"
+_transitions = "justyol_dashboard.services.transition_service.on_sales_order_change"
+_sla_timers = "justyol_dashboard.services.sla_service.on_sales_order_change"
+_live_counters = "justyol_dashboard.services.live_counter_service.on_sales_order_change"
+# Alert rules are re-evaluated (in the background) when a doctype they watch changes
+_alerts = "justyol_dashboard.services.alert_service.on_doc_change"
+_invalidate_and_alert_events = {event: [_invalidate, _alerts] for event in _invalidate_events}
+
 doc_events = {
+    # Sales Order maintainers are kept in step on every save. A submit (of a
+    # draft, or an insert with docstatus=1) runs on_update and then on_submit
+    # with the same doc before save, so maintainers that apply deltas hook
+    # on_update only; on_submit or after_insert would apply them twice.
     "Sales Order": {
-        "after_insert": "justyol_dashboard.api.realtime.on_sales_order_change",
-        "on_update": "justyol_dashboard.api.realtime.on_sales_order_change",
-        "on_submit": "justyol_dashboard.api.realtime.on_sales_order_change",
-    }
+        "on_update": [
+            _order_facts, _item_facts, _customer_index, _sketches, _transitions, _sla_timers,
+            _live_counters, "justyol_dashboard.api.realtime.on_sales_order_change", _alerts,
+        ],
+        "on_submit": [_alerts],
+        "on_cancel": [_order_facts, _item_facts, _live_counters, _invalidate, _alerts],
+        "on_update_after_submit": [
+            _order_facts, _item_facts, _customer_index, _sketches, _transitions, _sla_timers,
+            _live_counters, "justyol_dashboard.api.realtime.on_sales_order_change", _alerts,
+        ],
+        "on_trash": [
+            _order_facts, _item_facts, _customer_index, _sketches, _sla_timers, _live_counters,
+            "justyol_dashboard.api.realtime.on_sales_order_change", _alerts,
+        ],
+    },
+    "Sales Invoice": _invalidate_and_alert_events,
+    "Purchase Invoice": _invalidate_events,
+    "Payment Entry": _invalidate_and_alert_events,
+    "Delivery Note": _invalidate_events,
+    "Stock Entry": _invalidate_events,
+    "Purchase Order": _invalidate_events,
+    "Bin": _invalidate_and_alert_events,
+    "Stock Ledger Entry": {
+        "on_submit": [_invalidate, _alerts],
+        "on_cancel": [_invalidate, _alerts],
+    },
 }
 
 # --- Scheduled Tasks ---
 scheduler_events = {
-    # Refresh dashboard cache every 2 minutes
+    # Warm the most requested dashboards every 2 minutes
     "cron": {
         "*/2 * * * *": [
             "justyol_dashboard.services.cache_service.refresh_dashboard_cache"
-        ]
+        ],
+        # Time-based alerts (overdue orders and invoices, today's rates)
+        "*/5 * * * *": [
+            "justyol_dashboard.services.alert_service.evaluate_timed_rules"
+        ],
+        # Realtime pushes deferred by the per-company push interval
+        "* * * * *": [
+            "justyol_dashboard.services.realtime_service.flush_due_order_changes"
+        ],
+        # Reload today's live counters from Sales Orders (db_set drift)
+        "*/15 * * * *": [
+            "justyol_dashboard.services.live_counter_service.reconcile_live_counters"
+        ],
     },
+    "hourly": [
+        "justyol_dashboard.services.customer_index_service.segment_customers"
+    ],
+    "daily": [
+        "justyol_dashboard.services.order_fact_service.reconcile_order_facts",
+        "justyol_dashboard.services.item_fact_service.reconcile_item_facts",
+        "justyol_dashboard.services.customer_index_service.reconcile_customer_index",
+        "justyol_dashboard.services.sketch_service.reconcile_sketches",
+        "justyol_dashboard.services.transition_service.purge_old_transitions",
+        "justyol_dashboard.services.sla_service.reconcile_sla_timers",
+        "justyol_dashboard.services.alert_service.purge_resolved_alerts",
+    ],
 }
 
 # --- Jinja Methods (available in templates) ---
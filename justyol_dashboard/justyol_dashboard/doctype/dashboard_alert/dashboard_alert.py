@@ -0,0 +1,15 @@
+import frappe
+from frappe.model.document import Document
+
+
+class DashboardAlert(Document):
+    """State of one alert raised by an alert rule, with its raised/resolved times.
+
+    Rows are written directly by alert_service, not through the ORM.
+    """
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Dashboard Alert", ["company", "status"])
+    frappe.db.add_index("Dashboard Alert", ["company", "rule", "status"])
@@ -0,0 +1,16 @@
+import frappe
+from frappe.model.document import Document
+
+
+class DashboardCustomerStats(Document):
+    """One row per company and customer with lifetime order stats and RFM segment.
+
+    Rows are written directly by customer_index_service, not through the ORM.
+    """
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_unique("Dashboard Customer Stats", ["company", "customer"])
+    frappe.db.add_index("Dashboard Customer Stats", ["company", "first_order"])
+    frappe.db.add_index("Dashboard Customer Stats", ["company", "rfm_segment"])
@@ -0,0 +1,50 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from justyol_dashboard.services.customer_index_service import _refresh_customer, segment_customers
+from justyol_dashboard.tests.utils import RebuildComparisonTests, get_test_company, get_test_customer
+
+# Bookkeeping and hourly RFM columns, which the per-order maintenance does not own
+IGNORED_FIELDS = {
+    "name", "creation", "modified", "modified_by", "owner", "docstatus", "idx",
+    "r_score", "f_score", "m_score", "rfm_segment",
+}
+
+
+class TestDashboardCustomerStats(RebuildComparisonTests, FrappeTestCase):
+    def setUp(self):
+        self.company = get_test_company()
+        # A fresh customer per test, so its stats cover only the orders made here
+        self.customer = get_test_customer(f"_Test Dashboard Customer {frappe.generate_hash(length=8)}")
+
+    def order_fields(self):
+        return {"customer": self.customer}
+
+    def rebuild(self):
+        _refresh_customer(self.company, self.customer)
+
+    def snapshot(self):
+        rows = frappe.db.sql("""
+            SELECT * FROM `tabDashboard Customer Stats`
+            WHERE company = %s AND customer = %s
+        """, (self.company, self.customer), as_dict=True)
+        return [
+            {field: str(value) for field, value in row.items() if field not in IGNORED_FIELDS}
+            for row in rows
+        ]
+
+    def count_orders(self):
+        return sum(int(row["order_count"]) for row in self.snapshot())
+
+    def test_refresh_keeps_rfm_segment(self):
+        so = self.make_order(docstatus=1, custom_sales_status="Pending")
+        segment_customers(self.company)
+        filters = {"company": self.company, "customer": self.customer}
+        segment = frappe.db.get_value("Dashboard Customer Stats", filters, "rfm_segment")
+        self.assertTrue(segment)
+
+        # A tracked change re-reads the customer's orders
+        so.custom_sales_status = "Cancelled"
+        so.save()
+        self.assertEqual(frappe.db.get_value("Dashboard Customer Stats", filters, "rfm_segment"), segment)
+        self.assertEqual(frappe.db.get_value("Dashboard Customer Stats", filters, "cancelled"), 1)
@@ -0,0 +1,14 @@
+import frappe
+from frappe.model.document import Document
+
+
+class DashboardItemFact(Document):
+    """One row per company, day, item, supplier and shipment status.
+
+    Rows are written directly by item_fact_service, not through the ORM.
+    """
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Dashboard Item Fact", ["company", "day"])
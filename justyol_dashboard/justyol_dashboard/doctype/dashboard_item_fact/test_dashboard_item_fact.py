@@ -0,0 +1,30 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import nowdate
+
+from justyol_dashboard.services.item_fact_service import rebuild_item_facts
+from justyol_dashboard.tests.utils import RebuildComparisonTests, get_test_company, get_test_item
+
+
+class TestDashboardItemFact(RebuildComparisonTests, FrappeTestCase):
+    def setUp(self):
+        self.company = get_test_company()
+        self.day = nowdate()
+        self.rebuild()
+
+    def rebuild(self):
+        rebuild_item_facts(self.company, self.day, self.day)
+
+    def snapshot(self):
+        rows = frappe.db.sql("""
+            SELECT item_code, supplier, shipment_status, orders, supplier_orders, qty, revenue
+            FROM `tabDashboard Item Fact`
+            WHERE company = %s AND day = %s AND orders != 0
+        """, (self.company, self.day))
+        return sorted(
+            (row[:3] + tuple(round(float(value), 4) for value in row[3:]) for row in rows),
+            key=str,
+        )
+
+    def count_orders(self):
+        return sum(row[3] for row in self.snapshot() if row[0] == get_test_item())
@@ -0,0 +1,14 @@
+import frappe
+from frappe.model.document import Document
+
+
+class DashboardOrderFact(Document):
+    """One row per company, day and status combination.
+
+    Rows are written directly by order_fact_service, not through the ORM.
+    """
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Dashboard Order Fact", ["company", "day"])
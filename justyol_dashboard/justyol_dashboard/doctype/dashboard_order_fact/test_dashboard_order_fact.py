@@ -0,0 +1,27 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import nowdate
+
+from justyol_dashboard.services.order_fact_service import rebuild_order_facts
+from justyol_dashboard.tests.utils import RebuildComparisonTests, get_test_company
+
+
+class TestDashboardOrderFact(RebuildComparisonTests, FrappeTestCase):
+    def setUp(self):
+        self.company = get_test_company()
+        self.day = nowdate()
+        self.rebuild()
+
+    def rebuild(self):
+        rebuild_order_facts(self.company, self.day, self.day)
+
+    def snapshot(self):
+        rows = frappe.db.sql("""
+            SELECT sales_status, logistics_status, shipment_status, source, agent, cancellation_reason, orders, gmv
+            FROM `tabDashboard Order Fact`
+            WHERE company = %s AND day = %s AND orders != 0
+        """, (self.company, self.day))
+        return sorted((row[:-2] + (int(row[-2]), round(float(row[-1]), 2)) for row in rows), key=str)
+
+    def count_orders(self):
+        return sum(row[-2] for row in self.snapshot())
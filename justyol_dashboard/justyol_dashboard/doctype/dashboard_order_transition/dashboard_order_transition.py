@@ -0,0 +1,15 @@
+import frappe
+from frappe.model.document import Document
+
+
+class DashboardOrderTransition(Document):
+    """One status change of one Sales Order field.
+
+    Rows are appended directly by transition_service, not through the ORM.
+    """
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Dashboard Order Transition", ["sales_order", "field", "to_status"])
+    frappe.db.add_index("Dashboard Order Transition", ["company", "field", "to_status", "changed_at"])
@@ -0,0 +1,6 @@
+from justyol_dashboard.services.customer_index_service import rebuild_customer_index
+
+
+def execute():
+    """Build the Dashboard Customer Stats table from existing Sales Orders."""
+    rebuild_customer_index()
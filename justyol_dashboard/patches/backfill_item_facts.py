@@ -0,0 +1,6 @@
+from justyol_dashboard.services.item_fact_service import rebuild_item_facts
+
+
+def execute():
+    """Build the Dashboard Item Fact table from existing Sales Orders."""
+    rebuild_item_facts()
@@ -0,0 +1,6 @@
+from justyol_dashboard.services.order_fact_service import rebuild_order_facts
+
+
+def execute():
+    """Build the Dashboard Order Fact table from existing Sales Orders."""
+    rebuild_order_facts()
@@ -0,0 +1,6 @@
+from justyol_dashboard.services.transition_service import seed_transitions
+
+
+def execute():
+    """Log the current statuses of existing Sales Orders as their first transitions."""
+    seed_transitions()
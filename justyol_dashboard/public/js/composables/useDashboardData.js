@@ -6,17 +6,23 @@ import { ref, watch, onMounted, onBeforeUnmount } from "vue";
  *
  * @param {string} apiMethod - Frappe whitelisted method path
  * @param {Object} params - Reactive params object
- * @param {Object} options - { autoRefresh: bool, refreshInterval: number, realtimeEvent: string }
+ * @param {Object} options - { autoRefresh: bool, refreshInterval: number, realtimeEvent: string,
+ *   applyRealtime: (data, eventData) => bool — patch data in place from an event; refetch if it returns false }
  */
 export function useDashboardData(apiMethod, params = {}, options = {}) {
   const data = ref(null);
   const loading = ref(true);
   const error = ref(null);
   const lastUpdated = ref(null);
+  const stale = ref(false);
 
-  const { autoRefresh = false, refreshInterval = 300000, realtimeEvent = null } = options;
+  const { autoRefresh = false, refreshInterval = 300000, realtimeEvent = null, applyRealtime = null } = options;
+
+  // Stale responses are being recomputed server-side; pick up the fresh copy shortly
+  const STALE_RETRY_DELAY = 5000;
 
   let refreshTimer = null;
+  let staleRetryTimer = null;
 
   async function fetchData() {
     loading.value = true;
@@ -30,7 +36,15 @@ export function useDashboardData(apiMethod, params = {}, options = {}) {
       });
 
       data.value = result.message;
-      lastUpdated.value = new Date();
+      lastUpdated.value = parseServerTime(result.message?.computed_at) || new Date();
+      stale.value = Boolean(result.message?.stale);
+
+      if (stale.value && !staleRetryTimer) {
+        staleRetryTimer = setTimeout(() => {
+          staleRetryTimer = null;
+          fetchData();
+        }, STALE_RETRY_DELAY);
+      }
     } catch (err) {
       error.value = err.message || "Failed to load data";
       console.error(`Dashboard data error (${apiMethod}):`, err);
@@ -60,7 +74,16 @@ export function useDashboardData(apiMethod, params = {}, options = {}) {
   // Real-time updates
   function onRealtimeUpdate(event) {
     const detail = event.detail;
+    // Events were missed and could not be replayed
+    if (detail.type === "resync") {
+      fetchData();
+      return;
+    }
     if (realtimeEvent && detail.type === realtimeEvent) {
+      if (applyRealtime && data.value && applyRealtime(data.value, detail.data)) {
+        lastUpdated.value = new Date();
+        return;
+      }
       fetchData();
     }
   }
@@ -74,12 +97,131 @@ export function useDashboardData(apiMethod, params = {}, options = {}) {
 
   onBeforeUnmount(() => {
     if (refreshTimer) clearInterval(refreshTimer);
+    if (staleRetryTimer) clearTimeout(staleRetryTimer);
     if (realtimeEvent) {
       window.removeEventListener("dashboard-update", onRealtimeUpdate);
     }
   });
 
-  return { data, loading, error, lastUpdated, refresh };
+  return { data, loading, error, lastUpdated, stale, refresh };
+}
+
+
+/**
+ * Parse a Frappe datetime string ("YYYY-MM-DD HH:MM:SS.ffffff") into a Date.
+ */
+function parseServerTime(value) {
+  if (!value) return null;
+  const date = new Date(String(value).replace(" ", "T"));
+  return isNaN(date.getTime()) ? null : date;
+}
+
+
+// Sales KPI counters -> the order field and value they count
+const KPI_STATUSES = {
+  confirmed: ["sales_status", "Confirmed"],
+  cancelled: ["sales_status", "Cancelled"],
+  pending: ["sales_status", "Pending"],
+  draft: ["sales_status", "Draft"],
+  ready_to_ship: ["logistics_status", "Ready to Ship"],
+  shipped: ["logistics_status", "Shipped"],
+  delivered: ["shipment_status", "Delivered"],
+  returns: ["shipment_status", "Return"],
+};
+
+// Operations funnel stages -> the KPI counter they show
+const FUNNEL_STAGES = {
+  Draft: "draft",
+  Pending: "pending",
+  Confirmed: "confirmed",
+  "Ready to Ship": "ready_to_ship",
+  Shipped: "shipped",
+  Delivered: "delivered",
+  Returns: "returns",
+  Cancelled: "cancelled",
+};
+
+function rate(part, whole) {
+  return whole > 0 ? Math.round((part / whole) * 1000) / 10 : 0;
+}
+
+function moveInBreakdown(rows, key, status, sign, grandTotal) {
+  if (!rows) return;
+  let row = rows.find((r) => r[key] === status);
+  if (!row) {
+    row = { [key]: status, count: 0 };
+    if (rows.length && "gmv" in rows[0]) row.gmv = 0;
+    rows.push(row);
+  }
+  row.count += sign;
+  if ("gmv" in row) row.gmv += sign * grandTotal;
+  rows.sort((a, b) => b.count - a.count);
+  for (let i = rows.length - 1; i >= 0; i--) {
+    if (rows[i].count <= 0) rows.splice(i, 1);
+  }
+}
+
+/**
+ * Apply the order changes of a sales_order_update event to a single-day
+ * sales payload (kpis, funnel, status breakdowns, revenue trend) in place.
+ *
+ * Each change carries the order's old and new state; the old one is taken
+ * out of every bucket it counted in and the new one added. Order value
+ * percentiles, products and customers cannot be derived this way and wait
+ * for the next full refetch.
+ *
+ * @returns {boolean} false when the event cannot be applied (multi-day view
+ *   or a burst too large to carry its changes), so the caller refetches.
+ */
+export function applyOrderChanges(data, eventData) {
+  const day = data?.period?.from_date;
+  if (!day || day !== data.period.to_date || !eventData?.changes || !data.kpis) return false;
+
+  const kpis = data.kpis;
+  for (const change of eventData.changes) {
+    for (const [order, sign] of [[change.old, -1], [change.new, 1]]) {
+      if (!order || order.date !== day) continue;
+
+      kpis.total_orders += sign;
+      kpis.gmv += sign * order.grand_total;
+      for (const [kpi, [field, value]] of Object.entries(KPI_STATUSES)) {
+        if (order[field] === value) kpis[kpi] += sign;
+      }
+
+      moveInBreakdown(data.status_distribution, "status", order.sales_status || "Unknown", sign, order.grand_total);
+      moveInBreakdown(data.logistics_pipeline, "status", order.logistics_status || "Unknown", sign, order.grand_total);
+      moveInBreakdown(data.shipment_tracking, "status", order.shipment_status || "Pending", sign, order.grand_total);
+      if (order.sales_status === "Cancelled") {
+        moveInBreakdown(data.cancellation_reasons, "reason", order.cancellation_reason || "Unknown", sign, order.grand_total);
+      }
+
+      const point = (data.revenue_trend || []).find((p) => p.date === day);
+      if (point) {
+        point.gmv += sign * order.grand_total;
+        point.orders += sign;
+        if (order.sales_status === "Confirmed") point.confirmed += sign;
+      } else if (data.revenue_trend && sign > 0) {
+        data.revenue_trend.push({
+          date: day,
+          gmv: order.grand_total,
+          orders: 1,
+          confirmed: order.sales_status === "Confirmed" ? 1 : 0,
+        });
+      }
+    }
+  }
+
+  kpis.aov = kpis.total_orders > 0 ? kpis.gmv / kpis.total_orders : 0;
+  kpis.confirmation_rate = rate(kpis.confirmed, kpis.total_orders);
+  kpis.cancellation_rate = rate(kpis.cancelled, kpis.total_orders);
+  kpis.delivery_rate = rate(kpis.delivered, kpis.confirmed);
+  kpis.return_rate = rate(kpis.returns, kpis.confirmed);
+
+  for (const stage of data.funnel || []) {
+    const kpi = FUNNEL_STAGES[stage.stage];
+    if (kpi) stage.count = kpis[kpi];
+  }
+  return true;
 }
 
 
@@ -19,12 +19,50 @@ function setupDashboardApp(wrapper) {
 }
 
 function SetupRealtime(app) {
-  // Global realtime event bus
+  // Global realtime event bus. Company events are numbered per company; the
+  // last number seen is kept so that a gap, or a reconnect, replays what was
+  // missed from the server's event stream instead of reloading dashboards.
   if (window.frappe && window.frappe.realtime) {
-    window.frappe.realtime.on("dashboard_update", (data) => {
-      window.dispatchEvent(
-        new CustomEvent("dashboard-update", { detail: data })
-      );
+    const lastSeq = {};
+
+    function dispatch(data) {
+      window.dispatchEvent(new CustomEvent("dashboard-update", { detail: data }));
+    }
+
+    function deliver(data) {
+      const { company, seq } = data;
+      if (!company || !seq) return dispatch(data);
+      if (lastSeq[company] && seq <= lastSeq[company]) return; // already delivered
+      if (lastSeq[company] && seq > lastSeq[company] + 1) return replay(company);
+      lastSeq[company] = seq;
+      dispatch(data);
+    }
+
+    async function replay(company) {
+      const since = lastSeq[company];
+      const result = await window.frappe.call({
+        method: "justyol_dashboard.api.realtime.get_events_since",
+        args: { company, since },
+        freeze: false,
+      });
+      const { events, seq, complete } = result.message;
+      if (!complete) {
+        // Too far behind to replay: dashboards of the company refetch
+        lastSeq[company] = seq;
+        return dispatch({ type: "resync", company, seq });
+      }
+      for (const event of events) {
+        if (event.seq > lastSeq[company]) {
+          lastSeq[company] = event.seq;
+          dispatch(event);
+        }
+      }
+    }
+
+    window.frappe.realtime.on("dashboard_update", deliver);
+
+    window.frappe.realtime.socket?.on("connect", () => {
+      Object.keys(lastSeq).forEach(replay);
     });
   }
 }
@@ -0,0 +1,494 @@
+import hashlib
+import json
+from functools import partial
+
+import frappe
+from frappe.utils import now_datetime, nowdate, add_days
+from justyol_dashboard.services.invalidation_service import DOCTYPE_ALIASES, get_doc_company
+from justyol_dashboard.services.realtime_service import push_dashboard_update
+from justyol_dashboard.services.kpi_service import scan_order_facts, aggregate_orders, rate, CONFIRMED, RETURNED
+from justyol_dashboard.services.sla_service import overdue_count, oldest_overdue
+
+ALERT_DOCTYPE = "Dashboard Alert"
+ALERT_FIELDS = ("type", "category", "priority", "title", "detail", "link", "orders")
+PRIORITY_ORDER = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+
+# Seconds a queued or running evaluation holds its marker; only lapses when a job dies
+EVALUATE_MARKER_TTL = 120
+RESOLVED_RETENTION_DAYS = 30
+
+
+# --- Rules ---
+# Each rule returns the alerts that currently hold as {key: alert}; the key
+# identifies the alert within the rule (an item and warehouse, a day), so
+# the same condition keeps the same alert across evaluations.
+
+def _stock_bins(company, condition, limit):
+    return frappe.db.sql(f"""
+        SELECT
+            b.item_code,
+            i.item_name,
+            b.actual_qty,
+            b.warehouse
+        FROM `tabBin` b
+        LEFT JOIN `tabItem` i ON i.name = b.item_code
+        WHERE b.warehouse IN (
+            SELECT name FROM `tabWarehouse`
+            WHERE company = %(company)s AND is_group = 0
+        )
+        AND {condition}
+        ORDER BY b.actual_qty ASC
+        LIMIT %(limit)s
+    """, {"company": company, "limit": limit}, as_dict=True)
+
+
+def low_stock(company, max_qty, critical_qty, limit):
+    return {
+        f"{item.item_code}:{item.warehouse}": {
+            "type": "warning",
+            "category": "Inventory",
+            "title": f"Low Stock: {item.item_name or item.item_code}",
+            "detail": f"Only {int(item.actual_qty)} units left in {item.warehouse}",
+            "priority": "high" if item.actual_qty <= critical_qty else "medium",
+            "link": f"/app/item/{item.item_code}",
+        }
+        for item in _stock_bins(company, f"b.actual_qty > 0 AND b.actual_qty <= {float(max_qty)}", limit)
+    }
+
+
+def out_of_stock(company, limit):
+    return {
+        f"{item.item_code}:{item.warehouse}": {
+            "type": "danger",
+            "category": "Inventory",
+            "title": f"Out of Stock: {item.item_name or item.item_code}",
+            "detail": f"Zero stock in {item.warehouse}",
+            "priority": "critical",
+            "link": f"/app/item/{item.item_code}",
+        }
+        for item in _stock_bins(company, "b.actual_qty <= 0", limit)
+    }
+
+
+def _order_links(overdue):
+    """Oldest overdue orders with links to open them.
+
+    Ages are left out so the alert only changes when the orders do.
+    """
+    return [
+        {
+            "sales_order": row["sales_order"],
+            "since": row["since"],
+            "link": f"/app/sales-order/{row['sales_order']}",
+        }
+        for row in overdue
+    ]
+
+
+def pending_confirmation(company, hours, limit):
+    count = overdue_count(company, "pending_confirmation", hours)
+    if not count:
+        return {}
+    return {"overdue": {
+        "type": "warning",
+        "category": "Operations",
+        "title": f"{count} orders pending > {hours} hours",
+        "detail": f"Orders awaiting confirmation for more than {hours} hours",
+        "priority": "high",
+        "link": "/app/sales-order?custom_sales_status=Pending",
+        "orders": _order_links(oldest_overdue(company, "pending_confirmation", limit, hours)),
+    }}
+
+
+def awaiting_pickup(company, hours, limit):
+    count = overdue_count(company, "awaiting_pickup", hours)
+    if not count:
+        return {}
+    return {"overdue": {
+        "type": "warning",
+        "category": "Logistics",
+        "title": f"{count} orders ready but not shipped > {hours}h",
+        "detail": "Prepared orders stuck in warehouse",
+        "priority": "high",
+        "link": "/app/sales-order?custom_logistics_status=Ready to Ship",
+        "orders": _order_links(oldest_overdue(company, "awaiting_pickup", limit, hours)),
+    }}
+
+
+def _today_orders(company):
+    today = nowdate()
+    return today, aggregate_orders(scan_order_facts(company, {"from": today, "to": today}), {
+        "total": ("orders", None),
+        "confirmed": ("orders", CONFIRMED),
+        "returns": ("orders", RETURNED),
+        "completed": ("orders", {"custom_track_shipment_status": ("Delivered", "Return")}),
+    })
+
+
+def high_rto_today(company, min_completed, max_rate):
+    today, orders = _today_orders(company)
+    rto_rate = rate(orders["returns"], orders["completed"])
+    if orders["completed"] <= min_completed or rto_rate <= max_rate:
+        return {}
+    return {today: {
+        "type": "danger",
+        "category": "Returns",
+        "title": f"High RTO Rate Today: {rto_rate}%",
+        "detail": f"{orders['returns']} returns out of {orders['completed']} completed orders",
+        "priority": "critical",
+        "link": "/app/sales-order?custom_track_shipment_status=Return",
+    }}
+
+
+def low_confirmation_today(company, min_orders, min_rate):
+    today, orders = _today_orders(company)
+    conf_rate = rate(orders["confirmed"], orders["total"])
+    if orders["total"] <= min_orders or conf_rate >= min_rate:
+        return {}
+    return {today: {
+        "type": "warning",
+        "category": "Confirmation",
+        "title": f"Low Confirmation Rate Today: {conf_rate}%",
+        "detail": f"Only {orders['confirmed']} of {orders['total']} orders confirmed",
+        "priority": "high",
+        "link": "#/confirmation",
+    }}
+
+
+def overdue_invoices(company, days):
+    invoices = frappe.db.sql("""
+        SELECT
+            COUNT(name) as count,
+            COALESCE(SUM(outstanding_amount), 0) as amount
+        FROM `tabSales Invoice`
+        WHERE company = %s
+            AND outstanding_amount > 0
+            AND docstatus = 1
+            AND posting_date < %s
+    """, (company, add_days(nowdate(), -days)), as_dict=True)[0]
+
+    if not invoices.count:
+        return {}
+    return {"overdue": {
+        "type": "warning",
+        "category": "Finance",
+        "title": f"{invoices.count} invoices overdue > {days} days",
+        "detail": f"Outstanding amount: {float(invoices.amount):,.0f}",
+        "priority": "medium",
+        "link": "/app/sales-invoice?outstanding_amount=[\">\",0]",
+    }}
+
+
+# Rule -> what it evaluates, the doctypes whose changes re-evaluate it, its
+# default thresholds, and whether the passage of time alone can change it
+# (re-evaluated on a schedule as well). Thresholds can be overridden per
+# rule in site config, e.g.
+#   bench set-config -p dashboard_alert_thresholds '{"low_stock": {"max_qty": 5}}'
+ALERT_RULES = {
+    "low_stock": {
+        "evaluate": low_stock,
+        "doctypes": ("Bin",),
+        "thresholds": {"max_qty": 3, "critical_qty": 1, "limit": 20},
+    },
+    "out_of_stock": {
+        "evaluate": out_of_stock,
+        "doctypes": ("Bin",),
+        "thresholds": {"limit": 20},
+    },
+    "pending_confirmation": {
+        "evaluate": pending_confirmation,
+        "doctypes": ("Sales Order",),
+        "thresholds": {"hours": 24, "limit": 10},
+        "timed": True,
+    },
+    "awaiting_pickup": {
+        "evaluate": awaiting_pickup,
+        "doctypes": ("Sales Order",),
+        "thresholds": {"hours": 48, "limit": 10},
+        "timed": True,
+    },
+    "high_rto_today": {
+        "evaluate": high_rto_today,
+        "doctypes": ("Sales Order",),
+        "thresholds": {"min_completed": 5, "max_rate": 25},
+        "timed": True,
+    },
+    # Payments update invoice outstanding amounts without invoice events
+    "overdue_invoices": {
+        "evaluate": overdue_invoices,
+        "doctypes": ("Sales Invoice", "Payment Entry"),
+        "thresholds": {"days": 30},
+        "timed": True,
+    },
+    "low_confirmation_today": {
+        "evaluate": low_confirmation_today,
+        "doctypes": ("Sales Order",),
+        "thresholds": {"min_orders": 10, "min_rate": 40},
+        "timed": True,
+    },
+}
+
+
+def get_thresholds(rule):
+    """Default thresholds of a rule with any site config overrides applied."""
+    overrides = (frappe.conf.get("dashboard_alert_thresholds") or {}).get(rule) or {}
+    return dict(ALERT_RULES[rule]["thresholds"], **overrides)
+
+
+# --- State ---
+
+def _alert_name(company, rule, key):
+    """Stable alert ID, so re-raising the same condition updates one row."""
+    return hashlib.md5(f"{company}\x1f{rule}\x1f{key}".encode("utf-8")).hexdigest()[:20]
+
+
+def evaluate_rules(company, rules=None):
+    """Re-evaluate rules for a company, persist the alert state and push what changed.
+
+    Alerts that are new or whose content changed are pushed as
+    `alert_raised` (clients upsert them by ID); alerts that no longer hold
+    are pushed as `alert_resolved`.
+
+    Args:
+        company: Company name
+        rules: Rule names to evaluate (all rules if omitted)
+
+    Returns:
+        (raised, resolved) lists of alert names that changed.
+    """
+    raised, resolved = [], []
+    for rule in rules or ALERT_RULES:
+        current = {
+            row.name: row
+            for row in frappe.get_all(
+                ALERT_DOCTYPE,
+                filters={"company": company, "rule": rule, "status": "Raised"},
+                fields=["name", "raised_at"] + list(ALERT_FIELDS),
+            )
+        }
+        alerts = ALERT_RULES[rule]["evaluate"](company, **get_thresholds(rule))
+
+        names = set()
+        for key, alert in alerts.items():
+            name = _alert_name(company, rule, key)
+            names.add(name)
+            old = current.get(name)
+            if old and not _changed(old, alert):
+                continue
+            raised_at = old.raised_at if old else now_datetime()
+            _upsert_alert(name, company, rule, key, alert)
+            _push_alert("alert_raised", company, dict(alert, id=name, rule=rule, raised_at=str(raised_at)))
+            raised.append(name)
+
+        gone = [name for name in current if name not in names]
+        if gone:
+            resolved_at = now_datetime()
+            frappe.db.sql("""
+                UPDATE `tabDashboard Alert`
+                SET status = 'Resolved', resolved_at = %s, modified = %s
+                WHERE name IN %s
+            """, (resolved_at, resolved_at, gone))
+            for name in gone:
+                _push_alert("alert_resolved", company, {"id": name, "rule": rule, "resolved_at": str(resolved_at)})
+            resolved.extend(gone)
+
+    return raised, resolved
+
+
+def _changed(row, alert):
+    """Whether a persisted alert differs from its re-evaluated content."""
+    for field in ALERT_FIELDS:
+        new = alert.get(field)
+        old = row.get(field)
+        if field == "orders":
+            old = json.loads(old) if isinstance(old, str) else old
+        if old != new:
+            return True
+    return False
+
+
+def _upsert_alert(name, company, rule, key, alert):
+    values = {field: alert.get(field) for field in ALERT_FIELDS}
+    values["orders"] = json.dumps(values["orders"]) if values["orders"] is not None else None
+    values.update(
+        name=name,
+        company=company,
+        rule=rule,
+        alert_key=key,
+        now=now_datetime(),
+        user=frappe.session.user,
+    )
+
+    # ON DUPLICATE KEY UPDATE assigns left to right: raised_at must read the
+    # old status, so it comes before status is set
+    frappe.db.sql("""
+        INSERT INTO `tabDashboard Alert`
+            (name, creation, modified, modified_by, owner, docstatus,
+             company, rule, alert_key, status, raised_at, resolved_at,
+             type, category, priority, title, detail, link, orders)
+        VALUES
+            (%(name)s, %(now)s, %(now)s, %(user)s, %(user)s, 0,
+             %(company)s, %(rule)s, %(alert_key)s, 'Raised', %(now)s, NULL,
+             %(type)s, %(category)s, %(priority)s, %(title)s, %(detail)s, %(link)s, %(orders)s)
+        ON DUPLICATE KEY UPDATE
+            raised_at = IF(status = 'Raised', raised_at, VALUES(raised_at)),
+            status = 'Raised',
+            resolved_at = NULL,
+            type = VALUES(type),
+            category = VALUES(category),
+            priority = VALUES(priority),
+            title = VALUES(title),
+            detail = VALUES(detail),
+            link = VALUES(link),
+            orders = VALUES(orders),
+            modified = VALUES(modified)
+    """, values)
+
+
+def get_active_alerts(company):
+    """Raised alerts of a company, most urgent first."""
+    alerts = frappe.db.sql("""
+        SELECT
+            name as id, rule, type, category, priority, title, detail, link, orders, raised_at
+        FROM `tabDashboard Alert`
+        WHERE company = %s
+            AND status = 'Raised'
+        ORDER BY raised_at DESC
+    """, (company,), as_dict=True)
+
+    for alert in alerts:
+        alert.orders = json.loads(alert.orders) if alert.orders else None
+    return sorted(alerts, key=lambda x: PRIORITY_ORDER.get(x.priority, 4))
+
+
+def _seeded_key(company):
+    return f"alerts_seeded:{company}"
+
+
+def _mark_seeded(company):
+    cache = frappe.cache()
+    cache.set(cache.make_key(_seeded_key(company)), 1)
+
+
+# --- Realtime ---
+# Every alert event of a company carries the next number of a per-company
+# sequence. A client that sees a gap (it missed an event) refetches the
+# dashboard, whose payload carries the sequence it is current to.
+
+def _sequence_key(company):
+    return f"alert_seq:{company}"
+
+
+def get_alert_sequence(company):
+    """Sequence number of the last alert event pushed for a company."""
+    cache = frappe.cache()
+    return int(cache.get(cache.make_key(_sequence_key(company))) or 0)
+
+
+def _push_alert(event_type, company, data):
+    """Number and push an alert event once the evaluation's writes are committed.
+
+    The sequence only moves after commit, so a dashboard read that returns
+    seq N always sees the alert rows of events up to N.
+    """
+    frappe.db.after_commit.add(partial(_publish_alert, event_type, company, data))
+
+
+def _publish_alert(event_type, company, data):
+    cache = frappe.cache()
+    seq = cache.incr(cache.make_key(_sequence_key(company)))
+    push_dashboard_update(event_type, dict(data, seq=seq), company=company)
+
+
+# --- Triggers ---
+
+def _marker_key(company, doctype):
+    return f"alert_evaluate:{company}:{doctype}"
+
+
+def _dirty_key(company, doctype):
+    return f"alert_evaluate_dirty:{company}:{doctype}"
+
+
+def on_doc_change(doc, method=None):
+    """doc_events hook: queue re-evaluation of the rules this doctype can trigger.
+
+    The evaluation is queued once the save commits, so a rolled back save
+    queues nothing. Changes committed while an evaluation is queued are
+    absorbed by it, so a burst of saves costs one evaluation.
+    """
+    doctype = DOCTYPE_ALIASES.get(doc.doctype, doc.doctype)
+    rules = [rule for rule, spec in ALERT_RULES.items() if doctype in spec["doctypes"]]
+    if not rules:
+        return
+
+    company = get_doc_company(doc)
+    if not company:
+        return
+
+    frappe.db.after_commit.add(partial(_queue_evaluation, company, doctype, rules))
+
+
+def _queue_evaluation(company, doctype, rules):
+    """Enqueue an evaluation, or flag the one already queued or running to run again.
+
+    An evaluation that is still queued reads this change anyway; one that
+    is running may have read past it, so it re-queues itself when it finds
+    the flag set.
+    """
+    cache = frappe.cache()
+    if not cache.set(cache.make_key(_marker_key(company, doctype)), 1, nx=True, ex=EVALUATE_MARKER_TTL):
+        cache.set(cache.make_key(_dirty_key(company, doctype)), 1, ex=EVALUATE_MARKER_TTL)
+        return
+
+    frappe.enqueue(
+        "justyol_dashboard.services.alert_service.evaluate_queued",
+        queue="short",
+        company=company,
+        doctype=doctype,
+        rules=rules,
+    )
+
+
+def evaluate_queued(company, doctype, rules):
+    """Background job: re-evaluate rules after changes to one of their doctypes.
+
+    The marker is held until the evaluation is committed. A change that
+    committed during the run set the dirty flag, which queues another run.
+    """
+    cache = frappe.cache()
+    cache.delete(cache.make_key(_dirty_key(company, doctype)))
+    evaluate_rules(company, rules)
+    frappe.db.commit()
+
+    cache.delete(cache.make_key(_marker_key(company, doctype)))
+    if cache.delete(cache.make_key(_dirty_key(company, doctype))):
+        _queue_evaluation(company, doctype, rules)
+
+
+def evaluate_timed_rules():
+    """Scheduled task: re-evaluate rules that change with the passage of time alone.
+
+    A company evaluated here for the first time (a new install or company,
+    or a flushed cache) gets every rule, so alerts of doctypes that have not
+    changed since are raised too. It is marked seeded once the rows commit.
+    """
+    timed = [rule for rule, spec in ALERT_RULES.items() if spec.get("timed")]
+    cache = frappe.cache()
+    for company in frappe.get_all("Company", pluck="name"):
+        if cache.get(cache.make_key(_seeded_key(company))):
+            evaluate_rules(company, timed)
+        else:
+            evaluate_rules(company)
+            frappe.db.after_commit.add(partial(_mark_seeded, company))
+    frappe.db.commit()
+
+
+def purge_resolved_alerts():
+    """Scheduled task: drop alerts resolved more than RESOLVED_RETENTION_DAYS ago."""
+    frappe.db.sql("""
+        DELETE FROM `tabDashboard Alert`
+        WHERE status = 'Resolved'
+            AND resolved_at < %s
+    """, (add_days(now_datetime(), -RESOLVED_RETENTION_DAYS),))
+    frappe.db.commit()
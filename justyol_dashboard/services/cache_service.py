@@ -1,46 +1,454 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
 import frappe
 import json
+from frappe.utils import getdate
+
+CACHE_TTL = 600  # 10 minutes default; dependent changes evict entries sooner
+STALE_TTL = 600  # how long an expired entry may be served while it recomputes
+
+# Single-flight: one worker recomputes a missing key, the rest wait on it
+LOCK_TIMEOUT = 30  # seconds before a crashed holder's lock frees itself
+LOCK_WAIT = 10  # seconds a waiter blocks before computing on its own
+LOCK_POLL_INTERVAL = 0.05
+METRICS_KEY = "dashboard_cache_metrics"
+METRIC_NAMES = ("hits", "local_hits", "stale_hits", "misses", "computes", "coalesced", "lock_timeouts")
 
-CACHE_TTL = 120  # 2 minutes default
+# Per-worker LRU in front of Redis. Entries are only served while their
+# version matches the freshness marker in Redis, so they never outlive an
+# invalidation or a recompute by another worker.
+LOCAL_CACHE_SIZE = 256
+LOCAL_CACHE_TTL = 60
+_local_cache = OrderedDict()  # site-prefixed key -> (entry, expires_at)
+_local_lock = threading.Lock()
 
+# Cache warming: track which dashboards are requested and recompute the
+# hottest ones shortly before they go stale
+ACCESS_KEY = "dashboard_access"
+ACCESS_TTL = 2 * 24 * 60 * 60
+ACCESS_MAX_SPECS = 500  # lowest-ranked specs beyond this are dropped from a day's ranking
+# Only preset periods are worth warming; custom date ranges are one-offs
+WARM_PERIODS = ("today", "yesterday", "week", "month", "last_month", "quarter", "year")
+WARM_LIMIT = 60  # dashboards warmed per run
+WARM_AHEAD = 180  # recompute entries with less freshness left than this
+WARM_LOCK_KEY = "dashboard_warm_lock"
+WARM_LOCK_TIMEOUT = 100  # shorter than the 2-minute cron so every run can start
 
-def get_cached(key, compute_fn, ttl=CACHE_TTL, **kwargs):
+# Per-company, per-doctype index of cached keys and the date ranges they read
+INDEX_KEY = "dashboard_index"
+INDEX_NAMES_KEY = "dashboard_index_names"
+INDEX_TTL = 24 * 60 * 60
+
+
+def get_cached(
+    key, compute_fn, ttl=CACHE_TTL, stale_ttl=STALE_TTL, revalidate=None,
+    company=None, depends_on=None, **kwargs
+):
     """Generic cache-or-compute helper.
 
+    Entries are fresh for `ttl` seconds. When `revalidate` is given they are
+    kept for a further `stale_ttl` seconds, during which the stale payload is
+    returned immediately and a background job recomputes it. On a hard miss
+    only the worker holding the per-key lock runs compute_fn; concurrent
+    callers for the same key wait for its result. Fresh entries are also kept
+    in a small per-worker LRU, so hot keys skip fetching and unpickling the
+    payload from Redis.
+
     Args:
         key: Redis cache key
         compute_fn: Function to call if cache miss
-        ttl: Cache TTL in seconds
+        ttl: Seconds an entry is served as fresh
+        stale_ttl: Extra seconds a stale entry may be served while revalidating
+        revalidate: Optional (method_path, kwargs) that recomputes this entry in a
+            background job. Dict payloads then carry `computed_at` and `stale`,
+            and requests are counted for the cache warmer.
+        company: Company the entry belongs to
+        depends_on: Dict of doctype -> list of {"from", "to"} date ranges the
+            entry reads from it (a None bound is open-ended), or None when any
+            change to that doctype affects it. Used for scoped invalidation.
         **kwargs: Passed to compute_fn
     """
-    cached = frappe.cache().get_value(key)
-    if cached:
-        return cached
+    revalidating = frappe.flags.dashboard_cache_revalidate == key
+    if revalidate and not revalidating and not frappe.flags.dashboard_cache_warm_ahead:
+        _record_access(revalidate)
+
+    if not revalidating:
+        entry, fresh = _read(key)
+        if fresh and not _expires_soon(entry):
+            _incr_metric("hits")
+            return _unwrap(entry, revalidate)
+        if frappe.flags.dashboard_cache_warm_ahead:
+            # Warming run: recompute now rather than serve it stale later
+            revalidating = True
+        elif entry is not None and revalidate:
+            _incr_metric("stale_hits")
+            _schedule_revalidate(key, revalidate)
+            return _unwrap(entry, revalidate, stale=True)
+
+    _incr_metric("misses")
+    deadline = time.monotonic() + LOCK_WAIT
+    token = _acquire_lock(key)
+
+    while not token:
+        time.sleep(LOCK_POLL_INTERVAL)
+
+        entry = _get_fresh(key)
+        if entry is not None:
+            _incr_metric("coalesced")
+            return _unwrap(entry, revalidate)
+
+        if time.monotonic() >= deadline:
+            # Holder is too slow — compute without the lock rather than fail
+            _incr_metric("lock_timeouts")
+            break
+
+        # Holder may have failed and released the lock without a value
+        token = _acquire_lock(key)
+
+    try:
+        if token and not revalidating:
+            # Another worker may have filled the key between our miss and the lock
+            entry = _get_fresh(key)
+            if entry is not None:
+                _incr_metric("coalesced")
+                return _unwrap(entry, revalidate)
+
+        _incr_metric("computes")
+        entry = {
+            "data": compute_fn(**kwargs),
+            "computed_at": frappe.utils.now(),
+            "fresh_until": time.time() + ttl,
+            "version": uuid.uuid4().hex,
+        }
+        hard_ttl = ttl + stale_ttl if revalidate else ttl
+        frappe.cache().set_value(key, entry, expires_in_sec=hard_ttl)
+        frappe.cache().set(_fresh_key(key), entry["version"], ex=ttl)
+        _local_put(key, entry, ttl)
+        if company and depends_on:
+            _index_key(company, key, depends_on, hard_ttl)
+        return _unwrap(entry, revalidate)
+    finally:
+        if token:
+            _release_lock(key, token)
+
+
+def _unwrap(entry, revalidate, stale=False):
+    """Return the cached payload, annotated with its age for dashboard endpoints.
+
+    The entry may be shared through the per-worker LRU, so callers get a
+    shallow copy: top-level keys can be set freely, nested values are
+    read-only.
+    """
+    data = entry["data"]
+    if isinstance(data, dict):
+        if revalidate:
+            return dict(data, computed_at=entry["computed_at"], stale=stale)
+        return dict(data)
+    if isinstance(data, list):
+        return list(data)
+    return data
+
+
+def _expires_soon(entry):
+    warm_ahead = frappe.flags.dashboard_cache_warm_ahead
+    return bool(warm_ahead) and entry.get("fresh_until", 0) - time.time() < warm_ahead
+
+
+def _fresh_key(key):
+    return frappe.cache().make_key(f"dashboard_fresh:{key}")
+
+
+def _fresh_version(key):
+    """Version of the current fresh entry, or None when the key is stale or missing."""
+    version = frappe.cache().get(_fresh_key(key))
+    return version.decode() if version else None
+
+
+def _read(key):
+    """Return (entry, fresh) for key, from the local LRU when its version is current."""
+    version = _fresh_version(key)
+
+    if version:
+        entry = _local_get(key, version)
+        if entry is not None:
+            _incr_metric("local_hits")
+            return entry, True
+
+    entry = frappe.cache().get_value(key)
+    if entry is None:
+        return None, False
+
+    fresh = bool(version) and entry.get("version") == version
+    if fresh:
+        _local_put(key, entry, LOCAL_CACHE_TTL)
+    return entry, fresh
+
+
+def _get_fresh(key):
+    entry, fresh = _read(key)
+    return entry if fresh else None
+
+
+def _local_get(key, version):
+    local_key = frappe.cache().make_key(key)
+    with _local_lock:
+        item = _local_cache.get(local_key)
+        if item is None:
+            return None
+
+        entry, expires_at = item
+        if expires_at <= time.monotonic() or entry.get("version") != version:
+            del _local_cache[local_key]
+            return None
+
+        _local_cache.move_to_end(local_key)
+        return entry
+
+
+def _local_put(key, entry, ttl):
+    local_key = frappe.cache().make_key(key)
+    expires_at = time.monotonic() + min(ttl, LOCAL_CACHE_TTL)
+    with _local_lock:
+        _local_cache[local_key] = (entry, expires_at)
+        _local_cache.move_to_end(local_key)
+        while len(_local_cache) > LOCAL_CACHE_SIZE:
+            _local_cache.popitem(last=False)
+
+
+def _local_evict(keys):
+    with _local_lock:
+        for key in keys:
+            _local_cache.pop(frappe.cache().make_key(key), None)
+
+
+def _schedule_revalidate(key, revalidate):
+    """Enqueue one background recompute per stale key."""
+    marker = frappe.cache().make_key(f"dashboard_revalidate:{key}")
+    if not frappe.cache().set(marker, 1, nx=True, ex=LOCK_TIMEOUT):
+        return  # already queued
+
+    method, method_kwargs = revalidate
+    frappe.enqueue(
+        "justyol_dashboard.services.cache_service.revalidate_cached",
+        queue="short",
+        enqueue_after_commit=True,
+        key=key,
+        dashboard_method=method,
+        method_kwargs=method_kwargs,
+    )
+
+
+def revalidate_cached(key, dashboard_method, method_kwargs):
+    """Background job: recompute a dashboard entry by re-calling its endpoint."""
+    frappe.flags.dashboard_cache_revalidate = key
+    try:
+        frappe.get_attr(dashboard_method)(**method_kwargs)
+    finally:
+        frappe.flags.dashboard_cache_revalidate = None
+        frappe.cache().delete(frappe.cache().make_key(f"dashboard_revalidate:{key}"))
+
+
+def _lock_key(key):
+    return frappe.cache().make_key(f"dashboard_lock:{key}")
+
+
+def _acquire_lock(key):
+    """Try to take the recompute lock for key. Returns the owner token or None."""
+    token = uuid.uuid4().hex
+    if frappe.cache().set(_lock_key(key), token, nx=True, ex=LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def _release_lock(key, token):
+    """Release the lock only if it still belongs to us (it may have timed out)."""
+    lock_key = _lock_key(key)
+    current = frappe.cache().get(lock_key)
+    if current and current.decode() == token:
+        frappe.cache().delete(lock_key)
+
+
+def _metric_key(name):
+    return frappe.cache().make_key(f"{METRICS_KEY}:{name}")
+
+
+def _incr_metric(name, amount=1):
+    try:
+        frappe.cache().incrby(_metric_key(name), amount)
+    except Exception:
+        # Metrics must never break a dashboard request
+        pass
+
+
+def get_cache_metrics():
+    """Cache counters: hits (local LRU hits included), stale hits, misses, computes,
+    coalesced waiters, lock timeouts."""
+    values = frappe.cache().mget([_metric_key(name) for name in METRIC_NAMES])
+    return {name: int(value or 0) for name, value in zip(METRIC_NAMES, values)}
+
+
+def _index_name(company, doctype):
+    return f"{INDEX_KEY}:{company}:{doctype}"
+
+
+def _index_key(company, key, depends_on, hard_ttl):
+    """Record which doctypes and date ranges a cached key reads."""
+    expires = time.time() + hard_ttl
+
+    for doctype, covers in depends_on.items():
+        ranges = None
+        if covers is not None:
+            ranges = [
+                (str(r["from"]) if r.get("from") else None, str(r["to"]) if r.get("to") else None)
+                for r in covers
+            ]
+
+        name = _index_name(company, doctype)
+        frappe.cache().hset(name, key, {"ranges": ranges, "expires": expires})
+        frappe.cache().expire(frappe.cache().make_key(name), INDEX_TTL)
+        frappe.cache().sadd(INDEX_NAMES_KEY, name)
+
+
+def _covers_any(ranges, dates):
+    if ranges is None or dates is None:
+        return True
+    return any(
+        (start is None or start <= d) and (end is None or d <= end)
+        for start, end in ranges
+        for d in dates
+    )
+
+
+def invalidate_dashboard_cache(company=None, doctype=None, dates=None):
+    """Invalidate dashboard caches that depend on a changed document.
+
+    Keys are looked up in the per-company, per-doctype index (no KEYS scan).
+    Only their freshness markers are dropped: payloads stay behind so
+    endpoints with a revalidate spec can keep serving them as stale while
+    they recompute.
+
+    Args:
+        company: Company to invalidate; all indexed companies if omitted
+        doctype: Doctype that changed; every indexed doctype if omitted
+        dates: Dates touched by the change; every matching key if omitted
+    """
+    prefix = f"{INDEX_KEY}:{company}:" if company else f"{INDEX_KEY}:"
+    names = [
+        name for name in (
+            n.decode() if isinstance(n, bytes) else n
+            for n in frappe.cache().smembers(INDEX_NAMES_KEY)
+        )
+        if name.startswith(prefix) and (not doctype or name.endswith(f":{doctype}"))
+    ]
+
+    if dates is not None:
+        dates = {str(getdate(d)) for d in dates if d}
+
+    now = time.time()
+    affected = set()
+    for name in names:
+        index = frappe.cache().hgetall(name) or {}
+
+        for key, meta in index.items():
+            if meta["expires"] <= now:
+                frappe.cache().hdel(name, key)
+            elif _covers_any(meta["ranges"], dates):
+                affected.add(key.decode() if isinstance(key, bytes) else key)
+
+    if affected:
+        frappe.cache().delete(*[_fresh_key(key) for key in affected])
+        _local_evict(affected)
+
+
+def _access_key(day):
+    return frappe.cache().make_key(f"{ACCESS_KEY}:{day}")
+
+
+def _record_access(revalidate):
+    """Count a request for a (dashboard, args) pair in today's access ranking.
+
+    Only requests for an existing company over a preset period are counted,
+    so client-supplied arguments cannot fill the ranking with specs the
+    warmer would recompute for nothing. The ranking is capped at
+    ACCESS_MAX_SPECS.
+    """
+    try:
+        method, method_kwargs = revalidate
+        if method_kwargs.get("from_date") or method_kwargs.get("to_date"):
+            return
+        if "period" in method_kwargs and method_kwargs["period"] not in WARM_PERIODS:
+            return
+        if not frappe.db.exists("Company", method_kwargs.get("company")):
+            return
 
-    result = compute_fn(**kwargs)
-    frappe.cache().set_value(key, result, expires_in_sec=ttl)
-    return result
+        spec = json.dumps([method, method_kwargs], sort_keys=True, default=str)
+        access_key = _access_key(frappe.utils.nowdate())
+        pipe = frappe.cache().pipeline()
+        pipe.zincrby(access_key, 1, spec)
+        pipe.zremrangebyrank(access_key, 0, -ACCESS_MAX_SPECS - 1)
+        pipe.expire(access_key, ACCESS_TTL)
+        pipe.execute()
+    except Exception:
+        # Tracking must never break a dashboard request
+        pass
 
 
-def invalidate_dashboard_cache(company=None):
-    """Invalidate all dashboard caches, optionally for a specific company."""
-    if company:
-        keys = frappe.cache().get_keys(f"dashboard:*:{company}:*")
-    else:
-        keys = frappe.cache().get_keys("dashboard:*")
+def get_hot_dashboards(limit=WARM_LIMIT):
+    """Most requested (method, kwargs) pairs over today and yesterday."""
+    today = getdate(frappe.utils.nowdate())
+    scores = {}
+    for day in (today, frappe.utils.add_days(today, -1)):
+        for spec, score in frappe.cache().zrevrange(_access_key(day), 0, limit - 1, withscores=True):
+            spec = spec.decode() if isinstance(spec, bytes) else spec
+            scores[spec] = scores.get(spec, 0) + score
 
-    for key in keys:
-        frappe.cache().delete_value(key)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [tuple(json.loads(spec)) for spec in ranked]
 
 
 def refresh_dashboard_cache():
-    """Scheduled task: pre-compute and cache dashboard data for all companies."""
-    companies = ["Justyol Morocco", "Justyol China", "Justyol Holding", "Maslak LTD"]
-
-    for company in companies:
-        try:
-            # Import here to avoid circular imports
-            from justyol_dashboard.api.executive import get_executive_dashboard
-            get_executive_dashboard(company=company, period="today")
-        except Exception as e:
-            frappe.log_error(f"Cache refresh failed for {company}: {str(e)}")
+    """Scheduled task: warm the most requested dashboards before they go stale.
+
+    Each dashboard is warmed by its own background job so they run in parallel
+    across workers. A short Redis lock keeps overlapping cron runs from
+    enqueueing the same work twice.
+    """
+    if not frappe.cache().set(frappe.cache().make_key(WARM_LOCK_KEY), 1, nx=True, ex=WARM_LOCK_TIMEOUT):
+        return
+
+    specs = get_hot_dashboards()
+
+    # Always keep every company's executive "today" view warm
+    for company in frappe.get_all("Company", pluck="name"):
+        spec = ("justyol_dashboard.api.executive.get_executive_dashboard", {"company": company, "period": "today"})
+        if spec not in specs:
+            specs.append(spec)
+
+    for method, method_kwargs in specs:
+        spec = json.dumps([method, method_kwargs], sort_keys=True, default=str)
+        marker = frappe.cache().make_key(f"dashboard_warm:{spec}")
+        if not frappe.cache().set(marker, 1, nx=True, ex=WARM_LOCK_TIMEOUT):
+            continue  # previous warm job for it still queued or running
+
+        frappe.enqueue(
+            "justyol_dashboard.services.cache_service.warm_dashboard",
+            queue="short",
+            dashboard_method=method,
+            method_kwargs=method_kwargs,
+        )
+
+
+def warm_dashboard(dashboard_method, method_kwargs):
+    """Background job: recompute one dashboard if its entry is stale or nearly so."""
+    spec = json.dumps([dashboard_method, method_kwargs], sort_keys=True, default=str)
+    frappe.flags.dashboard_cache_warm_ahead = WARM_AHEAD
+    try:
+        frappe.get_attr(dashboard_method)(**method_kwargs)
+    except Exception as e:
+        frappe.log_error(f"Cache warm failed for {dashboard_method} {method_kwargs}: {str(e)}")
+    finally:
+        frappe.flags.dashboard_cache_warm_ahead = None
+        frappe.cache().delete(frappe.cache().make_key(f"dashboard_warm:{spec}"))
@@ -0,0 +1,280 @@
+import hashlib
+
+import frappe
+from justyol_dashboard.services.cache_service import invalidate_dashboard_cache
+
+STATS_DOCTYPE = "Dashboard Customer Stats"
+
+# Sales Order fields whose change alters the customer's stats
+TRACKED_FIELDS = ("customer", "company", "grand_total", "custom_sales_status", "custom_track_shipment_status")
+
+# Lifetime stats per customer, straight from Sales Orders
+STATS_QUERY = """
+    SELECT
+        company,
+        customer,
+        MAX(customer_name) as customer_name,
+        MIN(creation) as first_order,
+        MAX(creation) as last_order,
+        COUNT(name) as order_count,
+        COALESCE(SUM(grand_total), 0) as total_spend,
+        SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN 1 ELSE 0 END) as delivered,
+        SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns,
+        SUM(CASE WHEN custom_sales_status = 'Cancelled' THEN 1 ELSE 0 END) as cancelled
+    FROM `tabSales Order`
+    WHERE {conditions}
+        AND customer IS NOT NULL
+    GROUP BY company, customer
+"""
+
+
+def on_sales_order_change(doc, method=None):
+    """doc_events hook: keep the customer's lifetime stats in step with the order.
+
+    A new order is folded in with a single upsert. Edits to a tracked field
+    and deletes re-read the affected customers' orders, since first/last
+    order dates cannot be decremented.
+    """
+    if not doc.customer:
+        return
+
+    if method == "on_trash":
+        _refresh_customer(doc.company, doc.customer, exclude=doc.name)
+        return
+
+    before = doc.get_doc_before_save()
+    if not before:
+        _add_order(doc)
+        return
+
+    if not any(before.get(field) != doc.get(field) for field in TRACKED_FIELDS):
+        return
+
+    if before.customer and (before.customer, before.company) != (doc.customer, doc.company):
+        _refresh_customer(before.company, before.customer)
+    _refresh_customer(doc.company, doc.customer)
+
+
+def _stats_name(company, customer):
+    """Deterministic row name, so upserts for the same customer hit one row."""
+    return hashlib.md5(f"{company}\x1f{customer}".encode("utf-8")).hexdigest()[:20]
+
+
+def rto_rate(delivered, returns):
+    """Share of completed shipments that came back, in percent."""
+    return round(returns * 100 / max(delivered + returns, 1), 1)
+
+
+def risk_score(order_count, returns, cancelled):
+    """0-100 risk of an order from this customer not being collected."""
+    return min(100, round((returns * 30 + cancelled * 15) / max(order_count, 1) * 100))
+
+
+def _add_order(doc):
+    now = frappe.utils.now()
+    delivered = int(doc.custom_track_shipment_status == "Delivered")
+    returns = int(doc.custom_track_shipment_status == "Return")
+    cancelled = int(doc.custom_sales_status == "Cancelled")
+
+    # ON DUPLICATE KEY UPDATE assigns left to right, so the ratios at the end
+    # see the already incremented counts
+    frappe.db.sql("""
+        INSERT INTO `tabDashboard Customer Stats`
+            (name, creation, modified, modified_by, owner, docstatus,
+             company, customer, customer_name, first_order, last_order, order_count, total_spend,
+             delivered, returns, cancelled, rto_rate, risk_score)
+        VALUES
+            (%(name)s, %(now)s, %(now)s, %(user)s, %(user)s, 0,
+             %(company)s, %(customer)s, %(customer_name)s, %(created)s, %(created)s, 1, %(spend)s,
+             %(delivered)s, %(returns)s, %(cancelled)s, %(rto_rate)s, %(risk_score)s)
+        ON DUPLICATE KEY UPDATE
+            customer_name = VALUES(customer_name),
+            first_order = LEAST(first_order, VALUES(first_order)),
+            last_order = GREATEST(last_order, VALUES(last_order)),
+            order_count = order_count + 1,
+            total_spend = total_spend + VALUES(total_spend),
+            delivered = delivered + VALUES(delivered),
+            returns = returns + VALUES(returns),
+            cancelled = cancelled + VALUES(cancelled),
+            rto_rate = ROUND(returns * 100 / GREATEST(delivered + returns, 1), 1),
+            risk_score = LEAST(100, ROUND((returns * 30 + cancelled * 15) * 100 / GREATEST(order_count, 1))),
+            modified = VALUES(modified)
+    """, {
+        "name": _stats_name(doc.company, doc.customer),
+        "now": now,
+        "user": frappe.session.user,
+        "company": doc.company,
+        "customer": doc.customer,
+        "customer_name": doc.customer_name,
+        "created": doc.creation,
+        "spend": float(doc.grand_total or 0),
+        "delivered": delivered,
+        "returns": returns,
+        "cancelled": cancelled,
+        "rto_rate": rto_rate(delivered, returns),
+        "risk_score": risk_score(1, returns, cancelled),
+    })
+
+
+def _refresh_customer(company, customer, exclude=None):
+    """Recompute one customer's row from their Sales Orders.
+
+    The counters are overwritten in place, so the RFM scores and segment
+    written by segment_customers survive until its next run. The row is
+    dropped once the customer has no orders left.
+    """
+    conditions = "company = %(company)s AND customer = %(customer)s AND name != %(exclude)s"
+    rows = frappe.db.sql(
+        STATS_QUERY.format(conditions=conditions),
+        {"company": company, "customer": customer, "exclude": exclude or ""},
+        as_dict=True,
+    )
+
+    if not rows:
+        frappe.db.sql("""
+            DELETE FROM `tabDashboard Customer Stats`
+            WHERE company = %s AND customer = %s
+        """, (company, customer))
+        return
+
+    row = rows[0]
+    now = frappe.utils.now()
+    frappe.db.sql("""
+        INSERT INTO `tabDashboard Customer Stats`
+            (name, creation, modified, modified_by, owner, docstatus,
+             company, customer, customer_name, first_order, last_order, order_count, total_spend,
+             delivered, returns, cancelled, rto_rate, risk_score)
+        VALUES
+            (%(name)s, %(now)s, %(now)s, %(user)s, %(user)s, 0,
+             %(company)s, %(customer)s, %(customer_name)s, %(first_order)s, %(last_order)s,
+             %(order_count)s, %(spend)s,
+             %(delivered)s, %(returns)s, %(cancelled)s, %(rto_rate)s, %(risk_score)s)
+        ON DUPLICATE KEY UPDATE
+            customer_name = VALUES(customer_name),
+            first_order = VALUES(first_order),
+            last_order = VALUES(last_order),
+            order_count = VALUES(order_count),
+            total_spend = VALUES(total_spend),
+            delivered = VALUES(delivered),
+            returns = VALUES(returns),
+            cancelled = VALUES(cancelled),
+            rto_rate = VALUES(rto_rate),
+            risk_score = VALUES(risk_score),
+            modified = VALUES(modified)
+    """, {
+        "name": _stats_name(company, customer),
+        "now": now,
+        "user": frappe.session.user,
+        "company": company,
+        "customer": customer,
+        "customer_name": row.customer_name,
+        "first_order": row.first_order,
+        "last_order": row.last_order,
+        "order_count": row.order_count,
+        "spend": float(row.total_spend),
+        "delivered": row.delivered,
+        "returns": row.returns,
+        "cancelled": row.cancelled,
+        "rto_rate": rto_rate(row.delivered, row.returns),
+        "risk_score": risk_score(row.order_count, row.returns, row.cancelled),
+    })
+
+
+def _insert_rows(rows):
+    now = frappe.utils.now()
+    fields = [
+        "name", "creation", "modified", "modified_by", "owner",
+        "company", "customer", "customer_name", "first_order", "last_order", "order_count", "total_spend",
+        "delivered", "returns", "cancelled", "rto_rate", "risk_score",
+    ]
+    records = [
+        [
+            _stats_name(row.company, row.customer), now, now, "Administrator", "Administrator",
+            row.company, row.customer, row.customer_name, row.first_order, row.last_order,
+            row.order_count, float(row.total_spend),
+            row.delivered, row.returns, row.cancelled,
+            rto_rate(row.delivered, row.returns), risk_score(row.order_count, row.returns, row.cancelled),
+        ]
+        for row in rows
+    ]
+    if records:
+        frappe.db.bulk_insert(STATS_DOCTYPE, fields, records)
+    return len(records)
+
+
+def rebuild_customer_index(company=None):
+    """Recompute every customer's row from raw Sales Orders.
+
+    Args:
+        company: Limit to one company (all companies if omitted)
+    """
+    condition = "company = %(company)s" if company else "1 = 1"
+    rows = frappe.db.sql(STATS_QUERY.format(conditions=condition), {"company": company}, as_dict=True)
+
+    frappe.db.sql(f"DELETE FROM `tabDashboard Customer Stats` WHERE {condition}", {"company": company})
+    count = _insert_rows(rows)
+    segment_customers(company)
+
+    invalidate_dashboard_cache(company=company, doctype="Sales Order")
+    return count
+
+
+def reconcile_customer_index():
+    """Scheduled task: repair drift from updates that bypassed doc events (db_set, imports)."""
+    rebuild_customer_index()
+    frappe.db.commit()
+
+
+# --- RFM segmentation ---
+# Recency (r), frequency (f) and monetary (m) scores are 1-5 quintiles within
+# a company. Segments are checked in order; the first matching rule wins.
+RFM_SEGMENTS = [
+    ("Champions", "r >= 4 AND f >= 4 AND m >= 4"),
+    ("Loyal", "r >= 3 AND f >= 4"),
+    ("Big Spenders", "m >= 5"),
+    ("New", "r >= 4 AND f <= 2"),
+    ("Promising", "r >= 3"),
+    ("At Risk", "r <= 2 AND f >= 3"),
+    ("Lost", "r <= 1"),
+]
+DEFAULT_SEGMENT = "Hibernating"
+
+
+def _quintile(column):
+    # PERCENT_RANK gives tied customers the same score, unlike NTILE
+    return f"LEAST(5, FLOOR(PERCENT_RANK() OVER (PARTITION BY company ORDER BY {column}) * 5) + 1)"
+
+
+def segment_customers(company=None):
+    """Scheduled task: assign RFM scores and segments to every customer in one statement.
+
+    Quintiles are relative to all of a company's customers, so they cannot be
+    maintained per order; the whole table is ranked with window functions and
+    written back in a single set-based UPDATE instead.
+
+    Args:
+        company: Limit to one company (all companies if omitted)
+    """
+    condition = "company = %(company)s" if company else "1 = 1"
+    rules = " ".join(f"WHEN {rule} THEN '{label}'" for label, rule in RFM_SEGMENTS)
+
+    frappe.db.sql(f"""
+        UPDATE `tabDashboard Customer Stats` cs
+        INNER JOIN (
+            SELECT name, r, f, m, CASE {rules} ELSE '{DEFAULT_SEGMENT}' END as segment
+            FROM (
+                SELECT
+                    name,
+                    {_quintile("last_order")} as r,
+                    {_quintile("order_count")} as f,
+                    {_quintile("total_spend")} as m
+                FROM `tabDashboard Customer Stats`
+                WHERE {condition}
+            ) scores
+        ) ranked ON ranked.name = cs.name
+        SET
+            cs.r_score = ranked.r,
+            cs.f_score = ranked.f,
+            cs.m_score = ranked.m,
+            cs.rfm_segment = ranked.segment
+    """, {"company": company})
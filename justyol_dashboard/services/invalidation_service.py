@@ -0,0 +1,65 @@
+import frappe
+from justyol_dashboard.services.cache_service import invalidate_dashboard_cache
+
+# Date fields each doctype is bucketed by in the dashboards. A change only
+# evicts entries whose date ranges include one of these dates; doctypes with
+# no fields evict every entry that depends on them.
+DOCTYPE_DATE_FIELDS = {
+    "Sales Order": ("creation", "transaction_date"),
+    "Sales Invoice": ("posting_date",),
+    "Purchase Invoice": ("posting_date",),
+    "Payment Entry": ("posting_date",),
+    "Delivery Note": ("posting_date",),
+    "Stock Entry": ("posting_date",),
+    "Purchase Order": (),
+    "Bin": (),
+}
+
+# Doctypes whose changes stand in for one the dashboards read. ERPNext
+# updates Bin quantities without running its doc events, so stock
+# movements are picked up from the ledger instead.
+DOCTYPE_ALIASES = {
+    "Stock Ledger Entry": "Bin",
+}
+
+
+def on_doc_change(doc, method=None):
+    """doc_events hook: evict cached dashboard entries that read this document."""
+    invalidate_for_doc(doc)
+
+
+def invalidate_for_doc(doc):
+    """Route a changed document to the dashboard entries that depend on it."""
+    target = get_doc_target(doc)
+    if target:
+        invalidate_dashboard_cache(**target)
+
+
+def get_doc_target(doc):
+    """{"company", "doctype", "dates"} of the dashboard entries a document feeds,
+    or None if no dashboard reads it."""
+    doctype = DOCTYPE_ALIASES.get(doc.doctype, doc.doctype)
+    if doctype not in DOCTYPE_DATE_FIELDS:
+        return None
+
+    company = get_doc_company(doc)
+    if not company:
+        return None
+
+    fields = DOCTYPE_DATE_FIELDS[doctype]
+    dates = None
+    if fields:
+        # Include the previous values so moving a document out of a range evicts it too
+        before = doc.get_doc_before_save()
+        dates = [d.get(field) for d in (doc, before) if d for field in fields]
+
+    return {"company": company, "doctype": doctype, "dates": dates}
+
+
+def get_doc_company(doc):
+    """Company a document belongs to (Bin only knows its warehouse)."""
+    if doc.get("company"):
+        return doc.company
+    if doc.get("warehouse"):
+        return frappe.get_cached_value("Warehouse", doc.warehouse, "company")
+    return None
@@ -0,0 +1,193 @@
+import hashlib
+from collections import defaultdict
+
+import frappe
+from frappe.utils import getdate, add_days, nowdate
+from justyol_dashboard.services.cache_service import invalidate_dashboard_cache
+
+FACT_DOCTYPE = "Dashboard Item Fact"
+MEASURES = ("orders", "supplier_orders", "qty", "revenue")
+
+RECONCILE_DAYS = 60  # nightly rebuild window; older orders rarely change
+
+
+def on_sales_order_change(doc, method=None):
+    """doc_events hook: move the order's item lines from their old fact rows to the new ones.
+
+    Only rows whose totals actually change are written, so a save that
+    touches neither the items nor the shipment status costs no queries.
+    """
+    if method == "on_trash":
+        old, new = _facts_of(doc), {}
+    else:
+        before = doc.get_doc_before_save()
+        old = _facts_of(before) if before else {}
+        new = _facts_of(doc)
+
+    for key in set(old) | set(new):
+        old_row, new_row = old.get(key), new.get(key)
+        delta = {
+            measure: (new_row or {}).get(measure, 0) - (old_row or {}).get(measure, 0)
+            for measure in MEASURES
+        }
+        if any(delta.values()):
+            item_name = (new_row or old_row)["item_name"]
+            _apply_delta(key, item_name, delta)
+
+
+def _facts_of(doc):
+    """{(company, day, item_code, supplier, shipment_status): measures} the order contributes.
+
+    An order counts once per item row key. supplier_orders splits that one
+    order evenly over the supplier's item keys, so summing it per supplier
+    gives distinct orders.
+    """
+    day = str(getdate(doc.creation))
+    facts = {}
+    for item in doc.get("items") or []:
+        key = (doc.company, day, item.item_code, item.get("supplier"), doc.custom_track_shipment_status)
+        row = facts.get(key)
+        if row is None:
+            row = facts[key] = {"item_name": item.item_name, "orders": 1, "supplier_orders": 0, "qty": 0, "revenue": 0}
+        row["qty"] += float(item.qty or 0)
+        row["revenue"] += float(item.amount or 0)
+
+    per_supplier = defaultdict(int)
+    for key in facts:
+        per_supplier[key[3]] += 1
+    for key, row in facts.items():
+        row["supplier_orders"] = 1 / per_supplier[key[3]]
+
+    return facts
+
+
+def _fact_name(key):
+    """Deterministic row name, so upserts for the same combination hit one row."""
+    parts = ["\0" if part is None else str(part) for part in key]
+    return hashlib.md5("\x1f".join(parts).encode("utf-8")).hexdigest()[:20]
+
+
+def _apply_delta(key, item_name, delta):
+    company, day, item_code, supplier, shipment_status = key
+    now = frappe.utils.now()
+    values = dict(
+        delta,
+        name=_fact_name(key),
+        company=company,
+        day=day,
+        item_code=item_code,
+        item_name=item_name,
+        supplier=supplier,
+        shipment_status=shipment_status,
+        now=now,
+        user=frappe.session.user,
+    )
+
+    frappe.db.sql("""
+        INSERT INTO `tabDashboard Item Fact`
+            (name, creation, modified, modified_by, owner, docstatus,
+             company, day, item_code, item_name, supplier, shipment_status,
+             orders, supplier_orders, qty, revenue)
+        VALUES
+            (%(name)s, %(now)s, %(now)s, %(user)s, %(user)s, 0,
+             %(company)s, %(day)s, %(item_code)s, %(item_name)s, %(supplier)s, %(shipment_status)s,
+             %(orders)s, %(supplier_orders)s, %(qty)s, %(revenue)s)
+        ON DUPLICATE KEY UPDATE
+            item_name = VALUES(item_name),
+            orders = orders + VALUES(orders),
+            supplier_orders = supplier_orders + VALUES(supplier_orders),
+            qty = qty + VALUES(qty),
+            revenue = revenue + VALUES(revenue),
+            modified = VALUES(modified)
+    """, values)
+
+
+def rebuild_item_facts(company=None, from_date=None, to_date=None):
+    """Recompute item fact rows from raw Sales Order Items, replacing what is stored.
+
+    Args:
+        company: Limit to one company (all companies if omitted)
+        from_date: First day to rebuild (from the first order if omitted)
+        to_date: Last day to rebuild (up to today if omitted)
+    """
+    values = {
+        "company": company,
+        "from_date": str(getdate(from_date)) if from_date else None,
+        "to_date": str(getdate(to_date)) if to_date else None,
+    }
+
+    conditions = ["1 = 1"]
+    fact_conditions = ["1 = 1"]
+    if company:
+        conditions.append("so.company = %(company)s")
+        fact_conditions.append("company = %(company)s")
+    if from_date:
+        conditions.append("so.creation >= %(from_date)s")
+        fact_conditions.append("day >= %(from_date)s")
+    if to_date:
+        conditions.append("so.creation <= CONCAT(%(to_date)s, ' 23:59:59')")
+        fact_conditions.append("day <= %(to_date)s")
+
+    # One row per order and item key first, so supplier_orders can be split
+    # the same way the doc event does
+    lines = frappe.db.sql(f"""
+        SELECT
+            so.name as sales_order,
+            so.company,
+            DATE(so.creation) as day,
+            soi.item_code,
+            MAX(soi.item_name) as item_name,
+            soi.supplier,
+            so.custom_track_shipment_status as shipment_status,
+            SUM(soi.qty) as qty,
+            COALESCE(SUM(soi.amount), 0) as revenue
+        FROM `tabSales Order Item` soi
+        INNER JOIN `tabSales Order` so ON so.name = soi.parent
+        WHERE {" AND ".join(conditions)}
+        GROUP BY so.name, soi.item_code, soi.supplier
+    """, values, as_dict=True)
+
+    per_supplier = defaultdict(int)
+    for line in lines:
+        per_supplier[(line.sales_order, line.supplier)] += 1
+
+    facts = {}
+    for line in lines:
+        key = (line.company, str(line.day), line.item_code, line.supplier, line.shipment_status)
+        row = facts.get(key)
+        if row is None:
+            row = facts[key] = {"item_name": line.item_name, "orders": 0, "supplier_orders": 0, "qty": 0, "revenue": 0}
+        row["orders"] += 1
+        row["supplier_orders"] += 1 / per_supplier[(line.sales_order, line.supplier)]
+        row["qty"] += float(line.qty or 0)
+        row["revenue"] += float(line.revenue)
+
+    frappe.db.sql(f"""
+        DELETE FROM `tabDashboard Item Fact`
+        WHERE {" AND ".join(fact_conditions)}
+    """, values)
+
+    now = frappe.utils.now()
+    fields = [
+        "name", "creation", "modified", "modified_by", "owner",
+        "company", "day", "item_code", "item_name", "supplier", "shipment_status",
+    ] + list(MEASURES)
+    records = [
+        [_fact_name(key), now, now, "Administrator", "Administrator"]
+        + [key[0], key[1], key[2], row["item_name"], key[3], key[4]]
+        + [row[measure] for measure in MEASURES]
+        for key, row in facts.items()
+    ]
+
+    if records:
+        frappe.db.bulk_insert(FACT_DOCTYPE, fields, records)
+
+    invalidate_dashboard_cache(company=company, doctype="Sales Order")
+    return len(records)
+
+
+def reconcile_item_facts():
+    """Scheduled task: repair drift from updates that bypassed doc events (db_set, imports)."""
+    today = getdate(nowdate())
+    rebuild_item_facts(from_date=add_days(today, -RECONCILE_DAYS), to_date=today)
+    frappe.db.commit()
@@ -1,5 +1,14 @@
+import functools
+import inspect
+
 import frappe
-from frappe.utils import getdate, add_days, get_first_day, get_last_day, nowdate
+from frappe.utils import getdate, add_days, add_years, get_first_day, get_last_day, nowdate
+from justyol_dashboard.services.cache_service import get_cached
+from justyol_dashboard.services.sketch_service import count_customers, order_value_percentiles
+from justyol_dashboard.services.live_counter_service import scan_live_orders
+
+SECTION_TTL = 600
+SECTION_LIMIT = 10  # top-N sections are cached at least this long and sliced
 
 
 def get_period_dates(period="today"):
@@ -45,191 +54,466 @@ def get_previous_period_dates(dates, period="today"):
     return {"from": str(prev_from), "to": str(prev_to)}
 
 
-def compute_sales_kpis(company, dates):
-    """Compute all sales KPIs in a single efficient query batch."""
-    from_date = dates["from"]
-    to_date = dates["to"] + " 23:59:59"
+def get_last_week_dates(dates, period="today"):
+    """The same range shifted back 7 days (week-over-week)."""
+    return {"from": str(add_days(dates["from"], -7)), "to": str(add_days(dates["to"], -7))}
+
+
+def get_last_year_dates(dates, period="today"):
+    """The same range one year earlier (year-over-year)."""
+    return {"from": str(add_years(dates["from"], -1)), "to": str(add_years(dates["to"], -1))}
+
+
+COMPARISONS = {
+    "previous": get_previous_period_dates,
+    "last_week": get_last_week_dates,
+    "last_year": get_last_year_dates,
+}
+
+
+def get_comparison_windows(dates, period="today", compare=("previous", "last_year")):
+    """Named date windows for a dashboard: "current" plus each comparison.
+
+    Args:
+        dates: The current {"from", "to"} range
+        period: Period name, passed on to the comparison functions
+        compare: Names from COMPARISONS to include
+    """
+    current = {"from": str(getdate(dates["from"])), "to": str(getdate(dates["to"]))}
+    windows = {"current": current}
+    for name in compare:
+        windows[name] = COMPARISONS[name](current, period)
+    return windows
+
+
+def cached_section(fn):
+    """Cache a compute_* section per company and date range.
+
+    Sections are shared by every dashboard that uses them, so opening the
+    executive and then the sales dashboard for the same period computes the
+    funnel, trend, etc. once. Sections taking a `limit` are cached at
+    max(limit, SECTION_LIMIT) rows and sliced, so limit=5 reuses limit=10.
+    """
+    limit_param = inspect.signature(fn).parameters.get("limit")
+
+    @functools.wraps(fn)
+    def wrapper(company, dates, limit=None):
+        dates = {"from": str(getdate(dates["from"])), "to": str(getdate(dates["to"]))}
+        key = f"dashboard:section:{fn.__name__}:{company}:{dates['from']}:{dates['to']}"
+
+        if limit_param is None:
+            compute = functools.partial(fn, company, dates)
+        else:
+            limit = limit_param.default if limit is None else limit
+            size = max(int(limit), SECTION_LIMIT)
+            key = f"{key}:{size}"
+            compute = functools.partial(fn, company, dates, limit=size)
+
+        result = get_cached(
+            key,
+            compute,
+            ttl=SECTION_TTL,
+            company=company,
+            depends_on={"Sales Order": [dates]},
+        )
+        return result if limit_param is None else result[:int(limit)]
+
+    return wrapper
+
+
+# --- Single-scan aggregation engine ---
+# Dashboards read the Sales Orders of a (company, range) once and compute
+# every count, sum and grouping in memory. Rows carry an "orders" weight and
+# a "gmv" sum, so the same aggregations also work over pre-aggregated rows.
+
+ORDER_SCAN_QUERY = """
+    SELECT
+        name,
+        customer,
+        customer_name,
+        owner,
+        modified_by,
+        source,
+        custom_sales_status,
+        custom_logistics_status,
+        custom_track_shipment_status,
+        custom_cancellation_reason,
+        COALESCE(shipping_address_name, customer_address) as zone,
+        DATE(creation) as day,
+        HOUR(creation) as hour,
+        1 as orders,
+        COALESCE(grand_total, 0) as gmv
+    FROM `tabSales Order`
+    WHERE company = %s
+        AND creation >= %s
+        AND creation <= %s
+"""
+
+# Pre-aggregated counterpart of ORDER_SCAN_QUERY, kept up to date by
+# order_fact_service; columns are aliased back to their Sales Order names
+FACT_SCAN_QUERY = """
+    SELECT
+        sales_status as custom_sales_status,
+        logistics_status as custom_logistics_status,
+        shipment_status as custom_track_shipment_status,
+        source,
+        agent as owner,
+        cancellation_reason as custom_cancellation_reason,
+        day,
+        orders,
+        gmv
+    FROM `tabDashboard Order Fact`
+    WHERE company = %s
+        AND day BETWEEN %s AND %s
+        AND orders != 0
+"""
+
+# Same, for several date windows at once; {ranges} is one BETWEEN per window
+FACT_WINDOWS_QUERY = """
+    SELECT
+        sales_status as custom_sales_status,
+        logistics_status as custom_logistics_status,
+        shipment_status as custom_track_shipment_status,
+        source,
+        agent as owner,
+        cancellation_reason as custom_cancellation_reason,
+        day,
+        orders,
+        gmv
+    FROM `tabDashboard Order Fact`
+    WHERE company = %s
+        AND ({ranges})
+        AND orders != 0
+"""
+
+# Common conditions for aggregate_orders metrics
+DRAFT = {"custom_sales_status": "Draft"}
+PENDING = {"custom_sales_status": "Pending"}
+CONFIRMED = {"custom_sales_status": "Confirmed"}
+CANCELLED = {"custom_sales_status": "Cancelled"}
+NO_RESPONSE = {"custom_sales_status": "No Response"}
+READY_TO_SHIP = {"custom_logistics_status": "Ready to Ship"}
+SHIPPED = {"custom_logistics_status": "Shipped"}
+DELIVERED = {"custom_track_shipment_status": "Delivered"}
+RETURNED = {"custom_track_shipment_status": "Return"}
+
+
+def scan_orders(company, dates):
+    """All Sales Orders of a company in a date range, read with one range scan.
+
+    The result is memoized for the rest of the request, so every section
+    computed for the same range shares a single query.
+    """
+    from_date = str(dates["from"])
+    to_date = str(dates["to"]) + " 23:59:59"
+
+    def load():
+        rows = frappe.db.sql(ORDER_SCAN_QUERY, (company, from_date, to_date), as_dict=True)
+        for row in rows:
+            row.gmv = float(row.gmv)
+        return rows
+
+    return frappe.local_cache("dashboard_order_scan", (company, from_date, to_date), load)
+
+
+def is_today(dates):
+    """Whether the range is exactly today, which the live counters can serve."""
+    return str(getdate(dates["from"])) == str(getdate(dates["to"])) == nowdate()
+
+
+def scan_order_facts(company, dates):
+    """Daily Sales Order facts of a company in a date range.
+
+    Same columns as scan_orders for the fields the fact table keeps, one row
+    per (day, status, source, agent, reason) combination instead of per order.
+    Use it for sections that never look at the customer, zone or hour.
+    Today alone is read from the live Redis counters instead, whose rows
+    also carry the hour.
+    """
+    if is_today(dates):
+        return scan_live_orders(company)
+
+    from_date = str(dates["from"])
+    to_date = str(dates["to"])
+
+    def load():
+        rows = frappe.db.sql(FACT_SCAN_QUERY, (company, from_date, to_date), as_dict=True)
+        for row in rows:
+            row.gmv = float(row.gmv)
+        return rows
+
+    return frappe.local_cache("dashboard_order_fact_scan", (company, from_date, to_date), load)
+
+
+def scan_order_fact_windows(company, windows):
+    """Daily Sales Order facts covering several date windows, read with one query.
+
+    Windows may overlap or lie far apart (e.g. this month and the same month
+    last year); only the days inside some window are read. A window of just
+    today is read from the live counters.
+    """
+    ranges = {(str(getdate(w["from"])), str(getdate(w["to"]))) for w in windows.values()}
+    live = (nowdate(), nowdate()) in ranges
+    ranges = tuple(sorted(ranges - {(nowdate(), nowdate())}))
+
+    def load():
+        rows = []
+        if ranges:
+            covered = " OR ".join(["day BETWEEN %s AND %s"] * len(ranges))
+            query = FACT_WINDOWS_QUERY.format(ranges=covered)
+            values = [company] + [date for window in ranges for date in window]
+            rows = frappe.db.sql(query, values, as_dict=True)
+            for row in rows:
+                row.gmv = float(row.gmv)
+        if live:
+            # Days inside another window as well are counted by both; drop the fact copy
+            rows = [row for row in rows if str(row.day) != nowdate()] + scan_live_orders(company)
+        return rows
+
+    return frappe.local_cache("dashboard_order_fact_windows", (company, ranges, live), load)
+
+
+def _matches(row, conditions):
+    for field, value in conditions.items():
+        if isinstance(value, tuple):
+            if row[field] not in value:
+                return False
+        elif row[field] != value:
+            return False
+    return True
+
+
+def _key_fn(key):
+    if key is None:
+        return lambda row: None
+    if callable(key):
+        return key
+    if isinstance(key, tuple):
+        field, default = key
+        return lambda row: default if row[field] is None else row[field]
+    return lambda row: row[key]
+
+
+def aggregate_orders(rows, metrics, key=None, where=None):
+    """Conditional aggregation over scanned rows — the in-memory SUM(CASE ...).
+
+    Args:
+        rows: Rows from scan_orders (or any rows with "orders"/"gmv" weights)
+        metrics: Dict of name -> (measure, conditions); measure is "orders" or
+            "gmv", conditions a dict of field -> value (or tuple of values), or
+            None to count every row
+        key: GROUP BY — a field name, (field, label for NULL), or a callable
+        where: Conditions a row must match to be aggregated at all
+
+    Returns:
+        Dict of metric totals, or {group: metric totals} when key is given.
+    """
+    group_of = _key_fn(key)
+    specs = list(metrics.items())
+    groups = {}
+
+    for row in rows:
+        if where and not _matches(row, where):
+            continue
+
+        group = group_of(row)
+        acc = groups.get(group)
+        if acc is None:
+            acc = groups[group] = dict.fromkeys(metrics, 0)
+
+        for name, (measure, conditions) in specs:
+            if not conditions or _matches(row, conditions):
+                acc[name] += row[measure]
+
+    if key is None:
+        return groups.get(None) or dict.fromkeys(metrics, 0)
+    return groups
+
+
+def aggregate_windows(rows, windows, metrics, key=None, where=None):
+    """aggregate_orders for each named date window over rows spanning all of them.
+
+    Returns:
+        Dict of window name -> what aggregate_orders returns for that window.
+    """
+    bounds = {name: (getdate(w["from"]), getdate(w["to"])) for name, w in windows.items()}
+    return {
+        name: aggregate_orders([row for row in rows if start <= row.day <= end], metrics, key, where)
+        for name, (start, end) in bounds.items()
+    }
 
-    # Single query for main metrics
-    main = frappe.db.sql("""
-        SELECT
-            COUNT(name) as total_orders,
-            COALESCE(SUM(grand_total), 0) as gmv,
-            COALESCE(AVG(grand_total), 0) as aov,
-            SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed,
-            SUM(CASE WHEN custom_sales_status = 'Cancelled' THEN 1 ELSE 0 END) as cancelled,
-            SUM(CASE WHEN custom_sales_status = 'Pending' THEN 1 ELSE 0 END) as pending,
-            SUM(CASE WHEN custom_sales_status = 'Draft' THEN 1 ELSE 0 END) as draft,
-            SUM(CASE WHEN custom_logistics_status = 'Shipped' THEN 1 ELSE 0 END) as shipped,
-            SUM(CASE WHEN custom_logistics_status = 'Ready to Ship' THEN 1 ELSE 0 END) as ready_to_ship,
-            SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN 1 ELSE 0 END) as delivered,
-            SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns
-        FROM `tabSales Order`
-        WHERE company = %s
-            AND creation >= %s
-            AND creation <= %s
-    """, (company, from_date, to_date), as_dict=True)[0]
 
-    total = main.total_orders or 0
-    confirmed = main.confirmed or 0
-    delivered = main.delivered or 0
+def rank_groups(groups, by, limit=None, reverse=True):
+    """Sort aggregate_orders groups into [(group, totals)], like ORDER BY ... LIMIT."""
+    ranked = sorted(groups.items(), key=lambda item: item[1][by], reverse=reverse)
+    return ranked[:limit] if limit else ranked
+
+
+def rate(part, whole):
+    """Percentage rounded to one decimal, 0 when the base is empty."""
+    return round(part / whole * 100, 1) if whole > 0 else 0
+
+
+SALES_KPI_METRICS = {
+    "total_orders": ("orders", None),
+    "gmv": ("gmv", None),
+    "confirmed": ("orders", CONFIRMED),
+    "cancelled": ("orders", CANCELLED),
+    "pending": ("orders", PENDING),
+    "draft": ("orders", DRAFT),
+    "shipped": ("orders", SHIPPED),
+    "ready_to_ship": ("orders", READY_TO_SHIP),
+    "delivered": ("orders", DELIVERED),
+    "returns": ("orders", RETURNED),
+}
+
+
+def _sales_kpis(main, order_values):
+    total = main["total_orders"]
+    confirmed = main["confirmed"]
+    delivered = main["delivered"]
 
     return {
         "total_orders": total,
-        "gmv": float(main.gmv or 0),
-        "aov": float(main.aov or 0),
+        "gmv": main["gmv"],
+        "aov": main["gmv"] / total if total > 0 else 0,
+        # AOV is skewed by a few very large COD orders; percentiles are not
+        "order_value_p50": order_values["p50"],
+        "order_value_p90": order_values["p90"],
+        "order_value_p99": order_values["p99"],
         "confirmed": confirmed,
-        "cancelled": main.cancelled or 0,
-        "pending": main.pending or 0,
-        "draft": main.draft or 0,
-        "shipped": main.shipped or 0,
-        "ready_to_ship": main.ready_to_ship or 0,
+        "cancelled": main["cancelled"],
+        "pending": main["pending"],
+        "draft": main["draft"],
+        "shipped": main["shipped"],
+        "ready_to_ship": main["ready_to_ship"],
         "delivered": delivered,
-        "returns": main.returns or 0,
-        "confirmation_rate": round((confirmed / total * 100), 1) if total > 0 else 0,
-        "cancellation_rate": round(((main.cancelled or 0) / total * 100), 1) if total > 0 else 0,
-        "delivery_rate": round((delivered / confirmed * 100), 1) if confirmed > 0 else 0,
-        "return_rate": round(((main.returns or 0) / confirmed * 100), 1) if confirmed > 0 else 0,
+        "returns": main["returns"],
+        "confirmation_rate": rate(confirmed, total),
+        "cancellation_rate": rate(main["cancelled"], total),
+        "delivery_rate": rate(delivered, confirmed),
+        "return_rate": rate(main["returns"], confirmed),
     }
 
 
+@cached_section
+def compute_sales_kpis(company, dates):
+    """Compute all sales KPIs from a single scan of the range."""
+    main = aggregate_orders(scan_order_facts(company, dates), SALES_KPI_METRICS)
+    return _sales_kpis(main, order_value_percentiles(company, dates))
+
+
+def compute_sales_kpi_windows(company, windows):
+    """Sales KPIs for several named date windows from a single scan.
+
+    Args:
+        company: Company name
+        windows: Dict of name -> {"from", "to"}, e.g. from get_comparison_windows
+
+    Returns:
+        Dict of window name -> the same KPIs compute_sales_kpis returns.
+    """
+    spec = ":".join(f"{name}={w['from']}:{w['to']}" for name, w in sorted(windows.items()))
+
+    def compute():
+        rows = scan_order_fact_windows(company, windows)
+        totals = aggregate_windows(rows, windows, SALES_KPI_METRICS)
+        return {
+            name: _sales_kpis(main, order_value_percentiles(company, windows[name]))
+            for name, main in totals.items()
+        }
+
+    return get_cached(
+        f"dashboard:section:compute_sales_kpi_windows:{company}:{spec}",
+        compute,
+        ttl=SECTION_TTL,
+        company=company,
+        depends_on={"Sales Order": list(windows.values())},
+    )
+
+
+@cached_section
 def compute_revenue_trend(company, dates):
     """Daily revenue trend data for charts."""
-    from_date = dates["from"]
-    to_date = dates["to"] + " 23:59:59"
-
-    data = frappe.db.sql("""
-        SELECT
-            DATE(creation) as date,
-            COALESCE(SUM(grand_total), 0) as gmv,
-            COUNT(name) as orders,
-            SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed
-        FROM `tabSales Order`
-        WHERE company = %s
-            AND creation >= %s
-            AND creation <= %s
-        GROUP BY DATE(creation)
-        ORDER BY DATE(creation) ASC
-    """, (company, from_date, to_date), as_dict=True)
+    days = aggregate_orders(scan_order_facts(company, dates), {
+        "gmv": ("gmv", None),
+        "orders": ("orders", None),
+        "confirmed": ("orders", CONFIRMED),
+    }, key="day")
 
     return [
         {
-            "date": str(row.date),
-            "gmv": float(row.gmv),
-            "orders": row.orders,
-            "confirmed": row.confirmed,
+            "date": str(day),
+            "gmv": row["gmv"],
+            "orders": row["orders"],
+            "confirmed": row["confirmed"],
         }
-        for row in data
+        for day, row in sorted(days.items())
     ]
 
 
+@cached_section
 def compute_status_distribution(company, dates):
     """Sales status breakdown for pie/donut charts."""
-    from_date = dates["from"]
-    to_date = dates["to"] + " 23:59:59"
-
-    data = frappe.db.sql("""
-        SELECT
-            COALESCE(custom_sales_status, 'Unknown') as status,
-            COUNT(name) as count,
-            COALESCE(SUM(grand_total), 0) as gmv
-        FROM `tabSales Order`
-        WHERE company = %s
-            AND creation >= %s
-            AND creation <= %s
-        GROUP BY custom_sales_status
-        ORDER BY count DESC
-    """, (company, from_date, to_date), as_dict=True)
+    groups = aggregate_orders(scan_order_facts(company, dates), {
+        "count": ("orders", None),
+        "gmv": ("gmv", None),
+    }, key=("custom_sales_status", "Unknown"))
 
     return [
-        {"status": row.status, "count": row.count, "gmv": float(row.gmv)}
-        for row in data
+        {"status": status, "count": row["count"], "gmv": row["gmv"]}
+        for status, row in rank_groups(groups, "count")
     ]
 
 
+@cached_section
 def compute_logistics_pipeline(company, dates):
     """Logistics status breakdown."""
-    from_date = dates["from"]
-    to_date = dates["to"] + " 23:59:59"
-
-    data = frappe.db.sql("""
-        SELECT
-            COALESCE(custom_logistics_status, 'Unknown') as status,
-            COUNT(name) as count
-        FROM `tabSales Order`
-        WHERE company = %s
-            AND creation >= %s
-            AND creation <= %s
-        GROUP BY custom_logistics_status
-        ORDER BY count DESC
-    """, (company, from_date, to_date), as_dict=True)
+    groups = aggregate_orders(scan_order_facts(company, dates), {
+        "count": ("orders", None),
+    }, key=("custom_logistics_status", "Unknown"))
 
-    return [{"status": row.status, "count": row.count} for row in data]
+    return [{"status": status, "count": row["count"]} for status, row in rank_groups(groups, "count")]
 
 
+@cached_section
 def compute_shipment_tracking(company, dates):
     """Shipment tracking status breakdown."""
-    from_date = dates["from"]
-    to_date = dates["to"] + " 23:59:59"
+    groups = aggregate_orders(scan_order_facts(company, dates), {
+        "count": ("orders", None),
+    }, key=("custom_track_shipment_status", "Pending"))
 
-    data = frappe.db.sql("""
-        SELECT
-            COALESCE(custom_track_shipment_status, 'Pending') as status,
-            COUNT(name) as count
-        FROM `tabSales Order`
-        WHERE company = %s
-            AND creation >= %s
-            AND creation <= %s
-        GROUP BY custom_track_shipment_status
-        ORDER BY count DESC
-    """, (company, from_date, to_date), as_dict=True)
-
-    return [{"status": row.status, "count": row.count} for row in data]
+    return [{"status": status, "count": row["count"]} for status, row in rank_groups(groups, "count")]
 
 
+@cached_section
 def compute_cancellation_reasons(company, dates, limit=10):
     """Top cancellation reasons."""
-    from_date = dates["from"]
-    to_date = dates["to"] + " 23:59:59"
+    groups = aggregate_orders(scan_order_facts(company, dates), {
+        "count": ("orders", None),
+    }, key=("custom_cancellation_reason", "Unknown"), where=CANCELLED)
 
-    data = frappe.db.sql("""
-        SELECT
-            COALESCE(custom_cancellation_reason, 'Unknown') as reason,
-            COUNT(name) as count
-        FROM `tabSales Order`
-        WHERE company = %s
-            AND custom_sales_status = 'Cancelled'
-            AND creation >= %s
-            AND creation <= %s
-        GROUP BY custom_cancellation_reason
-        ORDER BY count DESC
-        LIMIT %s
-    """, (company, from_date, to_date, limit), as_dict=True)
-
-    return [{"reason": row.reason, "count": row.count} for row in data]
+    return [{"reason": reason, "count": row["count"]} for reason, row in rank_groups(groups, "count", limit)]
 
 
+@cached_section
 def compute_top_products(company, dates, limit=10):
     """Top selling products by revenue (from delivered orders)."""
-    from_date = dates["from"]
-    to_date = dates["to"] + " 23:59:59"
-
     data = frappe.db.sql("""
         SELECT
-            soi.item_code,
-            soi.item_name,
-            SUM(soi.qty) as qty,
-            SUM(soi.amount) as revenue
-        FROM `tabSales Order Item` soi
-        INNER JOIN `tabSales Order` so ON so.name = soi.parent
-        WHERE so.company = %s
-            AND so.creation >= %s
-            AND so.creation <= %s
-            AND so.custom_track_shipment_status = 'Delivered'
-        GROUP BY soi.item_code, soi.item_name
+            item_code,
+            MAX(item_name) as item_name,
+            SUM(qty) as qty,
+            SUM(revenue) as revenue
+        FROM `tabDashboard Item Fact`
+        WHERE company = %s
+            AND day BETWEEN %s AND %s
+            AND shipment_status = 'Delivered'
+        GROUP BY item_code
+        HAVING SUM(orders) > 0
         ORDER BY revenue DESC
         LIMIT %s
-    """, (company, from_date, to_date, limit), as_dict=True)
+    """, (company, dates["from"], dates["to"], limit), as_dict=True)
 
     return [
         {
@@ -242,59 +526,60 @@ def compute_top_products(company, dates, limit=10):
     ]
 
 
+@cached_section
 def compute_top_suppliers(company, dates, limit=10):
     """Top suppliers by revenue."""
-    from_date = dates["from"]
-    to_date = dates["to"] + " 23:59:59"
-
     data = frappe.db.sql("""
         SELECT
-            COALESCE(soi.supplier, 'Unknown') as supplier,
-            SUM(soi.qty) as qty,
-            SUM(soi.amount) as revenue,
-            COUNT(DISTINCT soi.parent) as orders
-        FROM `tabSales Order Item` soi
-        INNER JOIN `tabSales Order` so ON so.name = soi.parent
-        WHERE so.company = %s
-            AND so.creation >= %s
-            AND so.creation <= %s
-            AND so.custom_track_shipment_status = 'Delivered'
-        GROUP BY soi.supplier
+            COALESCE(supplier, 'Unknown') as supplier,
+            SUM(qty) as qty,
+            SUM(revenue) as revenue,
+            ROUND(SUM(supplier_orders)) as orders
+        FROM `tabDashboard Item Fact`
+        WHERE company = %s
+            AND day BETWEEN %s AND %s
+            AND shipment_status = 'Delivered'
+        GROUP BY supplier
+        HAVING SUM(orders) > 0
         ORDER BY revenue DESC
         LIMIT %s
-    """, (company, from_date, to_date, limit), as_dict=True)
+    """, (company, dates["from"], dates["to"], limit), as_dict=True)
 
     return [
         {
             "supplier": row.supplier,
             "qty": row.qty or 0,
             "revenue": float(row.revenue or 0),
-            "orders": row.orders or 0,
+            "orders": int(row.orders or 0),
         }
         for row in data
     ]
 
 
+@cached_section
 def compute_customer_insights(company, dates):
-    """Customer analytics: unique, new, repeat, frequency."""
-    from_date = dates["from"]
-    to_date = dates["to"] + " 23:59:59"
-
-    data = frappe.db.sql("""
-        SELECT
-            customer,
-            COUNT(name) as order_count
-        FROM `tabSales Order`
+    """Customer analytics: unique, new, repeat, frequency.
+
+    Unique customers come from the per-day sketches. New customers placed
+    their first order in the range, read from the customer index; the rest
+    of the range's customers are repeat customers, as on the customers
+    dashboard. No per-customer rows are pulled into Python.
+    """
+    unique_customers = count_customers(company, dates)
+    total_orders = aggregate_orders(scan_order_facts(company, dates), {
+        "orders": ("orders", None),
+    })["orders"]
+    new_customers = frappe.db.sql("""
+        SELECT COUNT(*)
+        FROM `tabDashboard Customer Stats`
         WHERE company = %s
-            AND creation >= %s
-            AND creation <= %s
-        GROUP BY customer
-    """, (company, from_date, to_date), as_dict=True)
-
-    unique_customers = len(data)
-    repeat_customers = sum(1 for c in data if c.order_count > 1)
-    new_customers = unique_customers - repeat_customers
-    total_orders = sum(c.order_count for c in data)
+            AND first_order >= %s
+            AND first_order <= %s
+    """, (company, dates["from"], dates["to"] + " 23:59:59"))[0][0] or 0
+
+    # Beyond EXACT_MAX_DAYS the unique count is an estimate and can land a
+    # hair under the exact new count
+    repeat_customers = max(unique_customers - new_customers, 0)
     avg_frequency = round(total_orders / unique_customers, 1) if unique_customers > 0 else 0
 
     return {
@@ -306,35 +591,27 @@ def compute_customer_insights(company, dates):
     }
 
 
+@cached_section
 def compute_operations_funnel(company, dates):
     """Full operations funnel data."""
-    from_date = dates["from"]
-    to_date = dates["to"] + " 23:59:59"
-
-    data = frappe.db.sql("""
-        SELECT
-            COUNT(name) as total,
-            SUM(CASE WHEN custom_sales_status = 'Draft' THEN 1 ELSE 0 END) as draft,
-            SUM(CASE WHEN custom_sales_status = 'Pending' THEN 1 ELSE 0 END) as pending,
-            SUM(CASE WHEN custom_sales_status = 'Confirmed' THEN 1 ELSE 0 END) as confirmed,
-            SUM(CASE WHEN custom_logistics_status = 'Ready to Ship' THEN 1 ELSE 0 END) as ready_to_ship,
-            SUM(CASE WHEN custom_logistics_status = 'Shipped' THEN 1 ELSE 0 END) as shipped,
-            SUM(CASE WHEN custom_track_shipment_status = 'Delivered' THEN 1 ELSE 0 END) as delivered,
-            SUM(CASE WHEN custom_track_shipment_status = 'Return' THEN 1 ELSE 0 END) as returns,
-            SUM(CASE WHEN custom_sales_status = 'Cancelled' THEN 1 ELSE 0 END) as cancelled
-        FROM `tabSales Order`
-        WHERE company = %s
-            AND creation >= %s
-            AND creation <= %s
-    """, (company, from_date, to_date), as_dict=True)[0]
+    data = aggregate_orders(scan_order_facts(company, dates), {
+        "draft": ("orders", DRAFT),
+        "pending": ("orders", PENDING),
+        "confirmed": ("orders", CONFIRMED),
+        "ready_to_ship": ("orders", READY_TO_SHIP),
+        "shipped": ("orders", SHIPPED),
+        "delivered": ("orders", DELIVERED),
+        "returns": ("orders", RETURNED),
+        "cancelled": ("orders", CANCELLED),
+    })
 
     return [
-        {"stage": "Draft", "count": data.draft or 0, "color": "#64748b"},
-        {"stage": "Pending", "count": data.pending or 0, "color": "#a855f7"},
-        {"stage": "Confirmed", "count": data.confirmed or 0, "color": "#3b82f6"},
-        {"stage": "Ready to Ship", "count": data.ready_to_ship or 0, "color": "#06b6d4"},
-        {"stage": "Shipped", "count": data.shipped or 0, "color": "#14b8a6"},
-        {"stage": "Delivered", "count": data.delivered or 0, "color": "#22c55e"},
-        {"stage": "Returns", "count": data.returns or 0, "color": "#f97316"},
-        {"stage": "Cancelled", "count": data.cancelled or 0, "color": "#ef4444"},
+        {"stage": "Draft", "count": data["draft"], "color": "#64748b"},
+        {"stage": "Pending", "count": data["pending"], "color": "#a855f7"},
+        {"stage": "Confirmed", "count": data["confirmed"], "color": "#3b82f6"},
+        {"stage": "Ready to Ship", "count": data["ready_to_ship"], "color": "#06b6d4"},
+        {"stage": "Shipped", "count": data["shipped"], "color": "#14b8a6"},
+        {"stage": "Delivered", "count": data["delivered"], "color": "#22c55e"},
+        {"stage": "Returns", "count": data["returns"], "color": "#f97316"},
+        {"stage": "Cancelled", "count": data["cancelled"], "color": "#ef4444"},
     ]
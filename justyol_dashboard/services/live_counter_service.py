@@ -0,0 +1,170 @@
+import json
+from functools import partial
+
+import frappe
+from frappe.utils import getdate, get_datetime, nowdate
+
+# --- Live order counters ---
+# Today's Sales Orders as two Redis hashes per company and day, one field
+# per combination of the dimensions below plus the creation hour: the order
+# count in one hash, the GMV in the other. Like the fact table, but with the
+# hour kept and without a SQL round trip: doc events move an order between
+# fields with HINCRBY/HINCRBYFLOAT in one MULTI once the save commits, and
+# scan_live_orders turns the hashes back into scan_orders-shaped rows.
+
+# Row field -> Sales Order field
+LIVE_DIMENSIONS = {
+    "custom_sales_status": "custom_sales_status",
+    "custom_logistics_status": "custom_logistics_status",
+    "custom_track_shipment_status": "custom_track_shipment_status",
+    "source": "source",
+    "owner": "owner",
+    "custom_cancellation_reason": "custom_cancellation_reason",
+}
+
+LIVE_TTL = 2 * 86400  # only today is read; the margin covers late edits around midnight
+
+
+def _orders_key(company, day):
+    return f"live_orders:{company}:{day}"
+
+
+def _gmv_key(company, day):
+    return f"live_gmv:{company}:{day}"
+
+
+def _built_key(company):
+    return f"live_orders_built:{company}"
+
+
+def _live_field(doc):
+    """(company, day, hash field, grand_total) the order counts under."""
+    created = get_datetime(doc.creation)
+    dims = [doc.get(field) for field in LIVE_DIMENSIONS.values()] + [created.hour]
+    return doc.company, str(created.date()), json.dumps(dims), float(doc.grand_total or 0)
+
+
+def on_sales_order_change(doc, method=None):
+    """doc_events hook: move the order between its day's counters once the save commits.
+
+    The move is captured now and applied after commit, so a rolled back
+    save never reaches Redis.
+    """
+    if method == "on_trash":
+        old, new = _live_field(doc), None
+    else:
+        before = doc.get_doc_before_save()
+        old = _live_field(before) if before else None
+        new = _live_field(doc)
+
+    if old == new:
+        return
+    frappe.db.after_commit.add(partial(_apply_move, old, new))
+
+
+def _apply_move(old, new):
+    """Take the order off its old field and add it to the new one, atomically.
+
+    Days whose counters were never built are left alone; they are loaded
+    from Sales Orders, changes included, when first read.
+    """
+    cache = frappe.cache()
+    built = {}
+    pipe = cache.pipeline()
+    for value, sign in ((old, -1), (new, 1)):
+        if not value:
+            continue
+        company, day, field, gmv = value
+        if company not in built:
+            built[company] = _built_days(company)
+        if day not in built[company]:
+            continue
+        pipe.hincrby(cache.make_key(_orders_key(company, day)), field, sign)
+        pipe.hincrbyfloat(cache.make_key(_gmv_key(company, day)), field, sign * gmv)
+    pipe.execute()
+
+
+def _built_days(company):
+    cache = frappe.cache()
+    return {day.decode() if isinstance(day, bytes) else day for day in cache.smembers(_built_key(company))}
+
+
+def rebuild_live_counters(company, day=None):
+    """Load a day's counters (today by default) from Sales Orders, replacing what is stored."""
+    day = str(getdate(day or nowdate()))
+    dimensions = ", ".join(f"{field} as {column}" for column, field in LIVE_DIMENSIONS.items())
+    group_by = ", ".join(LIVE_DIMENSIONS.values())
+    rows = frappe.db.sql(f"""
+        SELECT
+            {dimensions},
+            HOUR(creation) as hour,
+            COUNT(name) as orders,
+            COALESCE(SUM(grand_total), 0) as gmv
+        FROM `tabSales Order`
+        WHERE company = %s
+            AND creation >= %s
+            AND creation <= %s
+        GROUP BY {group_by}, HOUR(creation)
+    """, (company, day, day + " 23:59:59"), as_dict=True)
+
+    orders, gmv = {}, {}
+    for row in rows:
+        field = json.dumps([row[column] for column in LIVE_DIMENSIONS] + [row.hour])
+        orders[field] = row.orders
+        gmv[field] = float(row.gmv)
+
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    for key, values in ((_orders_key(company, day), orders), (_gmv_key(company, day), gmv)):
+        name = cache.make_key(key)
+        pipe.delete(name)
+        if values:
+            pipe.hset(name, mapping=values)
+        pipe.expire(name, LIVE_TTL)
+    pipe.execute()
+
+    cache.sadd(_built_key(company), day)
+    cache.expire(cache.make_key(_built_key(company)), LIVE_TTL)
+
+
+def scan_live_orders(company, day=None):
+    """Orders of one day (today by default) read from the live counters.
+
+    Same columns as scan_order_facts plus "hour", one row per combination of
+    statuses, source, agent, reason and hour. Memoized for the request like
+    the other scans.
+    """
+    day = str(getdate(day or nowdate()))
+
+    def load():
+        if day not in _built_days(company):
+            rebuild_live_counters(company, day)
+
+        cache = frappe.cache()
+        pipe = cache.pipeline()
+        pipe.hgetall(cache.make_key(_orders_key(company, day)))
+        pipe.hgetall(cache.make_key(_gmv_key(company, day)))
+        orders, gmv = pipe.execute()
+
+        rows = []
+        for field, count in orders.items():
+            if not int(count):
+                continue
+            values = json.loads(field)
+            row = frappe._dict(zip(LIVE_DIMENSIONS, values[:-1]))
+            row.update(
+                hour=values[-1],
+                day=getdate(day),
+                orders=int(count),
+                gmv=float(gmv.get(field) or 0),
+            )
+            rows.append(row)
+        return rows
+
+    return frappe.local_cache("dashboard_live_order_scan", (company, day), load)
+
+
+def reconcile_live_counters():
+    """Scheduled task: reload today's counters (db_set updates, events lost around a rebuild)."""
+    for company in frappe.get_all("Company", pluck="name"):
+        rebuild_live_counters(company)
@@ -0,0 +1,144 @@
+import hashlib
+
+import frappe
+from frappe.utils import getdate, add_days, nowdate
+from justyol_dashboard.services.cache_service import invalidate_dashboard_cache
+
+FACT_DOCTYPE = "Dashboard Order Fact"
+
+# Fact column -> Sales Order field it is grouped by
+FACT_DIMENSIONS = {
+    "sales_status": "custom_sales_status",
+    "logistics_status": "custom_logistics_status",
+    "shipment_status": "custom_track_shipment_status",
+    "source": "source",
+    "agent": "owner",
+    "cancellation_reason": "custom_cancellation_reason",
+}
+
+RECONCILE_DAYS = 60  # nightly rebuild window; older orders rarely change
+
+
+def on_sales_order_change(doc, method=None):
+    """doc_events hook: move the order's count and GMV from its old fact row to the new one."""
+    if method == "on_trash":
+        old, new = _fact_of(doc), None
+    else:
+        before = doc.get_doc_before_save()
+        old = _fact_of(before) if before else None
+        new = _fact_of(doc)
+
+    if old == new:
+        return
+    if old:
+        _apply_delta(old[0], -1, -old[1])
+    if new:
+        _apply_delta(new[0], 1, new[1])
+
+
+def _fact_of(doc):
+    """(dimensions, grand_total) the order contributes to the fact table."""
+    dims = {"company": doc.company, "day": str(getdate(doc.creation))}
+    for column, field in FACT_DIMENSIONS.items():
+        dims[column] = doc.get(field)
+    return dims, float(doc.grand_total or 0)
+
+
+def _fact_name(dims):
+    """Deterministic row name, so upserts for the same combination hit one row."""
+    parts = [dims["company"], dims["day"]] + [
+        "\0" if dims[column] is None else str(dims[column]) for column in FACT_DIMENSIONS
+    ]
+    return hashlib.md5("\x1f".join(parts).encode("utf-8")).hexdigest()[:20]
+
+
+def _apply_delta(dims, orders, gmv):
+    now = frappe.utils.now()
+    values = dict(dims, name=_fact_name(dims), orders=orders, gmv=gmv, now=now, user=frappe.session.user)
+
+    frappe.db.sql("""
+        INSERT INTO `tabDashboard Order Fact`
+            (name, creation, modified, modified_by, owner, docstatus,
+             company, day, sales_status, logistics_status, shipment_status,
+             source, agent, cancellation_reason, orders, gmv)
+        VALUES
+            (%(name)s, %(now)s, %(now)s, %(user)s, %(user)s, 0,
+             %(company)s, %(day)s, %(sales_status)s, %(logistics_status)s, %(shipment_status)s,
+             %(source)s, %(agent)s, %(cancellation_reason)s, %(orders)s, %(gmv)s)
+        ON DUPLICATE KEY UPDATE
+            orders = orders + VALUES(orders),
+            gmv = gmv + VALUES(gmv),
+            modified = VALUES(modified)
+    """, values)
+
+
+def rebuild_order_facts(company=None, from_date=None, to_date=None):
+    """Recompute fact rows from raw Sales Orders, replacing what is stored.
+
+    Args:
+        company: Limit to one company (all companies if omitted)
+        from_date: First day to rebuild (from the first order if omitted)
+        to_date: Last day to rebuild (up to today if omitted)
+    """
+    values = {
+        "company": company,
+        "from_date": str(getdate(from_date)) if from_date else None,
+        "to_date": str(getdate(to_date)) if to_date else None,
+    }
+
+    conditions = ["1 = 1"]
+    fact_conditions = ["1 = 1"]
+    if company:
+        conditions.append("company = %(company)s")
+        fact_conditions.append("company = %(company)s")
+    if from_date:
+        conditions.append("creation >= %(from_date)s")
+        fact_conditions.append("day >= %(from_date)s")
+    if to_date:
+        conditions.append("creation <= CONCAT(%(to_date)s, ' 23:59:59')")
+        fact_conditions.append("day <= %(to_date)s")
+
+    dimensions = ", ".join(f"{field} as {column}" for column, field in FACT_DIMENSIONS.items())
+    group_by = ", ".join(FACT_DIMENSIONS.values())
+    rows = frappe.db.sql(f"""
+        SELECT
+            company,
+            DATE(creation) as day,
+            {dimensions},
+            COUNT(name) as orders,
+            COALESCE(SUM(grand_total), 0) as gmv
+        FROM `tabSales Order`
+        WHERE {" AND ".join(conditions)}
+        GROUP BY company, DATE(creation), {group_by}
+    """, values, as_dict=True)
+
+    frappe.db.sql(f"""
+        DELETE FROM `tabDashboard Order Fact`
+        WHERE {" AND ".join(fact_conditions)}
+    """, values)
+
+    now = frappe.utils.now()
+    fields = ["name", "creation", "modified", "modified_by", "owner", "company", "day"]
+    fields += list(FACT_DIMENSIONS) + ["orders", "gmv"]
+    records = []
+    for row in rows:
+        dims = {"company": row.company, "day": str(row.day)}
+        dims.update({column: row[column] for column in FACT_DIMENSIONS})
+        records.append(
+            [_fact_name(dims), now, now, "Administrator", "Administrator", row.company, row.day]
+            + [row[column] for column in FACT_DIMENSIONS]
+            + [row.orders, float(row.gmv)]
+        )
+
+    if records:
+        frappe.db.bulk_insert(FACT_DOCTYPE, fields, records)
+
+    invalidate_dashboard_cache(company=company, doctype="Sales Order")
+    return len(records)
+
+
+def reconcile_order_facts():
+    """Scheduled task: repair drift from updates that bypassed doc events (db_set, imports)."""
+    today = getdate(nowdate())
+    rebuild_order_facts(from_date=add_days(today, -RECONCILE_DAYS), to_date=today)
+    frappe.db.commit()
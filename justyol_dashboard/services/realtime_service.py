@@ -1,14 +1,39 @@
+import json
+import time
+from functools import partial
+
 import frappe
+from frappe.utils import getdate
+from justyol_dashboard.services.cache_service import invalidate_dashboard_cache
+
+# Dashboard clients join the room of the company they are viewing (the
+# Company document's room, which Socket.IO lets any user who can read the
+# company join) and register in a per-company subscription registry with
+# the dashboard they have open. Company events go to that room only, and
+# are not published at all while nobody is viewing the company.
+SUBSCRIPTIONS_KEY = "dashboard_realtime_subscriptions"
+SUBSCRIPTION_TTL = 150  # clients renew every 60 seconds
+
+REALTIME_METRICS_KEY = "dashboard_realtime_metrics"
+REALTIME_METRIC_NAMES = ("published", "recipients", "skipped", "queued", "unchanged")
 
 
-def push_dashboard_update(event_type, data, company=None):
+def push_dashboard_update(event_type, data, company=None, after_commit=False):
     """Push real-time update to dashboard clients.
 
+    Company events are also appended to the company's event stream with the
+    next sequence number, so clients can replay what they missed.
+
     Args:
         event_type: Event name (e.g., 'sales_update', 'inventory_alert')
         data: Dict of event data
-        company: Optional - only push to users viewing this company
+        company: Optional - only push to clients viewing this company
+        after_commit: Hold the event until the current transaction commits
     """
+    if after_commit:
+        frappe.db.after_commit.add(partial(push_dashboard_update, event_type, data, company))
+        return
+
     payload = {
         "type": event_type,
         "company": company,
@@ -16,9 +41,21 @@ def push_dashboard_update(event_type, data, company=None):
         "timestamp": frappe.utils.now(),
     }
 
+    room = {}
+    if company:
+        payload["seq"] = _append_to_stream(company, payload)
+        subscribers = get_subscribers(company)
+        if not subscribers:
+            _incr_metric("skipped")
+            return
+        _incr_metric("recipients", len(subscribers))
+        room = {"doctype": "Company", "docname": company}
+
+    _incr_metric("published")
     frappe.publish_realtime(
         event="dashboard_update",
         message=payload,
+        **room,
     )
 
 
@@ -29,3 +66,329 @@ def push_to_user(user, event_type, data):
         message={"type": event_type, "data": data},
         user=user,
     )
+
+
+def _subscriptions_key(company):
+    return f"{SUBSCRIPTIONS_KEY}:{company}"
+
+
+def subscribe(company, dashboard, client_id):
+    """Register (or renew) a client viewing a company's dashboard."""
+    frappe.cache().hset(_subscriptions_key(company), client_id, {
+        "dashboard": dashboard,
+        "user": frappe.session.user,
+        "seen": frappe.utils.now_datetime().timestamp(),
+    })
+
+
+def unsubscribe(company, client_id):
+    """Drop a client from a company's registry (tab closed or company switched)."""
+    frappe.cache().hdel(_subscriptions_key(company), client_id)
+
+
+def get_subscribers(company):
+    """{client_id: {"dashboard", "user", "seen"}} of clients viewing a company.
+
+    Clients that stopped renewing are pruned on read.
+    """
+    key = _subscriptions_key(company)
+    cutoff = frappe.utils.now_datetime().timestamp() - SUBSCRIPTION_TTL
+    subscribers = {}
+    for client_id, sub in (frappe.cache().hgetall(key) or {}).items():
+        client_id = client_id.decode() if isinstance(client_id, bytes) else client_id
+        if sub["seen"] < cutoff:
+            frappe.cache().hdel(key, client_id)
+        else:
+            subscribers[client_id] = sub
+    return subscribers
+
+
+# --- Coalescing ---
+# Sales Order changes are buffered per company and flushed by one background
+# job as a single summary event (and one cache invalidation), so a bulk
+# import or courier sync touching thousands of orders pushes a handful of
+# events instead of one per save. A company is flushed at most once every
+# MIN_PUSH_INTERVAL seconds: a change arriving sooner is deferred in a sorted
+# set of due times, taken over by the first change after it falls due, or by
+# the per-minute scheduler tick when the burst has ended. No job sleeps.
+MIN_PUSH_INTERVAL = 5
+DUE_KEY = "dashboard_realtime_due"  # sorted set: company -> when its flush is due
+BUFFER_TTL = 300  # safety net should a flush job be lost
+SUMMARY_ORDER_LIMIT = 50  # order names listed in a summary event
+CHANGE_LIMIT = 200  # per-order changes sent for clients to apply; more and they refetch
+
+# Sales Order fields the dashboards read; saves that change none of them
+# neither invalidate nor push
+TRACKED_FIELDS = (
+    "grand_total",
+    "custom_sales_status",
+    "custom_logistics_status",
+    "custom_track_shipment_status",
+    "customer",
+    "owner",
+    "source",
+    "custom_cancellation_reason",
+    "company",
+    "transaction_date",
+)
+
+# Summary field -> Sales Order field whose values are reported
+SUMMARY_STATUS_FIELDS = {
+    "sales_status": "custom_sales_status",
+    "logistics_status": "custom_logistics_status",
+    "shipment_status": "custom_track_shipment_status",
+}
+
+
+def _buffer_key(company, part):
+    return f"dashboard_realtime_buffer:{company}:{part}"
+
+
+def has_tracked_changes(doc):
+    """Whether a save changed anything the dashboards read (new orders always do)."""
+    before = doc.get_doc_before_save()
+    if not before:
+        return True
+    if any(before.get(field) != doc.get(field) for field in TRACKED_FIELDS):
+        return True
+    _incr_metric("unchanged")
+    return False
+
+
+def _order_snapshot(doc):
+    """What clients need to move an order between their KPI buckets."""
+    if not doc:
+        return None
+    snapshot = {field: doc.get(doc_field) for field, doc_field in SUMMARY_STATUS_FIELDS.items()}
+    snapshot.update(
+        date=str(getdate(doc.creation)),
+        grand_total=float(doc.grand_total or 0),
+        cancellation_reason=doc.get("custom_cancellation_reason"),
+    )
+    return snapshot
+
+
+def queue_order_change(doc, dates=None, deleted=False):
+    """Buffer a changed Sales Order for its company's next summary push.
+
+    Meant to run after commit, so nothing is buffered for a save that is
+    rolled back.
+
+    Args:
+        doc: The Sales Order
+        dates: Dates whose cached dashboard entries the change invalidates
+        deleted: The order was deleted rather than saved
+    """
+    cache = frappe.cache()
+    before = doc if deleted else doc.get_doc_before_save()
+    after = None if deleted else doc
+    change = {"name": doc.name, "old": _order_snapshot(before), "new": _order_snapshot(after)}
+
+    statuses = set()
+    for d in (before, after):
+        for field, doc_field in SUMMARY_STATUS_FIELDS.items():
+            if d and d.get(doc_field):
+                statuses.add(f"{field}:{d.get(doc_field)}")
+    dates = [str(getdate(d)) for d in dates or () if d]
+
+    pipe = cache.pipeline()
+    for part, members in (("orders", [doc.name]), ("statuses", list(statuses)), ("dates", dates)):
+        if members:
+            name = cache.make_key(_buffer_key(doc.company, part))
+            pipe.sadd(name, *members)
+            pipe.expire(name, BUFFER_TTL)
+    changes = cache.make_key(_buffer_key(doc.company, "changes"))
+    pipe.rpush(changes, json.dumps(change, default=str))
+    pipe.expire(changes, BUFFER_TTL)
+    pipe.execute()
+    _incr_metric("queued")
+
+    _schedule_flush(doc.company)
+
+
+def _schedule_flush(company):
+    """Queue the company's flush now if its interval has passed, else defer it until due."""
+    cache = frappe.cache()
+    last_push = float(cache.get(cache.make_key(_buffer_key(company, "last_push"))) or 0)
+    due = last_push + MIN_PUSH_INTERVAL
+    is_due = time.time() >= due
+
+    marker = cache.make_key(_buffer_key(company, "scheduled"))
+    if cache.set(marker, 1, nx=True, ex=BUFFER_TTL):
+        if is_due:
+            _enqueue_flush(company)
+        else:
+            cache.zadd(cache.make_key(DUE_KEY), {company: due})
+    elif is_due and cache.zrem(cache.make_key(DUE_KEY), company):
+        # A deferred flush fell due; whoever removes it from the set queues it
+        _enqueue_flush(company)
+
+
+def _enqueue_flush(company):
+    frappe.enqueue(
+        "justyol_dashboard.services.realtime_service.flush_order_changes",
+        queue="short",
+        company=company,
+    )
+
+
+def flush_due_order_changes():
+    """Scheduled task: queue the deferred flushes no later change has picked up."""
+    cache = frappe.cache()
+    for company in cache.zrangebyscore(cache.make_key(DUE_KEY), "-inf", time.time()):
+        company = company.decode() if isinstance(company, bytes) else company
+        if cache.zrem(cache.make_key(DUE_KEY), company):
+            _enqueue_flush(company)
+
+
+def _merge_changes(changes):
+    """One change per order: its first old state and its last new state.
+
+    An order saved several times in a burst (e.g. inserted as submitted)
+    must reach clients as a single move, or they would count it again.
+    Orders that end where they started are dropped.
+    """
+    merged = {}
+    for change in changes:
+        seen = merged.get(change["name"])
+        if seen:
+            seen["new"] = change["new"]
+        else:
+            merged[change["name"]] = change
+    return [change for change in merged.values() if change["old"] != change["new"]]
+
+
+def flush_order_changes(company):
+    """Background job: invalidate and push everything buffered for a company."""
+    cache = frappe.cache()
+
+    # Unmark first: a change arriving from here on queues its own flush
+    # (which finds nothing left if this one already took it)
+    cache.delete(cache.make_key(_buffer_key(company, "scheduled")))
+
+    names = {part: cache.make_key(_buffer_key(company, part)) for part in ("orders", "statuses", "dates", "changes")}
+    pipe = cache.pipeline()
+    pipe.smembers(names["orders"])
+    pipe.smembers(names["statuses"])
+    pipe.smembers(names["dates"])
+    pipe.lrange(names["changes"], 0, -1)
+    pipe.delete(*names.values())
+    results = pipe.execute()
+    orders, statuses, dates = [
+        sorted(member.decode() if isinstance(member, bytes) else member for member in members)
+        for members in results[:3]
+    ]
+    changes = _merge_changes(json.loads(change) for change in results[3])
+    if not orders:
+        return
+
+    # No buffered dates means some change had none to narrow it down
+    invalidate_dashboard_cache(company=company, doctype="Sales Order", dates=dates or None)
+
+    summary = {field: [] for field in SUMMARY_STATUS_FIELDS}
+    for status in statuses:
+        field, value = status.split(":", 1)
+        summary[field].append(value)
+
+    cache.set(cache.make_key(_buffer_key(company, "last_push")), time.time(), ex=BUFFER_TTL)
+    push_dashboard_update(
+        event_type="sales_order_update",
+        data={
+            "orders": len(orders),
+            "order_names": orders[:SUMMARY_ORDER_LIMIT],
+            "statuses": summary,
+            # Old and new state of each change, for clients to apply locally;
+            # None when a burst is too large to be worth applying one by one
+            "changes": changes if len(changes) <= CHANGE_LIMIT else None,
+        },
+        company=company,
+    )
+
+
+# --- Event stream ---
+# Every company event is appended to a capped Redis stream whose entry IDs
+# are the company's event sequence numbers ("<seq>-0"), so replaying from a
+# sequence number is a single XRANGE.
+STREAM_KEY = "dashboard_realtime_stream"
+STREAM_MAXLEN = 1000  # roughly the last 1000 events per company are kept
+
+# Numbers the event and appends it in one step, so concurrent pushes reach
+# the stream in sequence order. XADD only fails when the stream is ahead of
+# the sequence (e.g. the sequence key was evicted); the stream is then
+# restarted, and clients asking to replay are told to refetch.
+APPEND_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+local id = seq .. '-0'
+local ok = redis.pcall('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], id, 'event', ARGV[1])
+if type(ok) == 'table' and ok.err then
+    redis.call('DEL', KEYS[2])
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], id, 'event', ARGV[1])
+end
+return seq
+"""
+
+
+def _stream_key(company):
+    return f"{STREAM_KEY}:{company}"
+
+
+def _sequence_key(company):
+    return f"{STREAM_KEY}_seq:{company}"
+
+
+def _append_to_stream(company, payload):
+    """Number the event and append it to the company's stream; returns its sequence.
+
+    The stored event carries no seq of its own; it is read back from the
+    entry ID.
+    """
+    cache = frappe.cache()
+    append = cache.register_script(APPEND_SCRIPT)
+    return int(append(
+        keys=[cache.make_key(_sequence_key(company)), cache.make_key(_stream_key(company))],
+        args=[json.dumps(payload, default=str), STREAM_MAXLEN],
+    ))
+
+
+def get_events_since(company, since):
+    """Company events after a sequence number, oldest first.
+
+    Returns:
+        {"events", "seq", "complete"}: seq is the latest sequence number;
+        complete is False when events after `since` were already trimmed
+        (or lost), in which case the client must refetch instead.
+    """
+    cache = frappe.cache()
+    since = int(since or 0)
+    seq = int(cache.get(cache.make_key(_sequence_key(company))) or 0)
+    if since >= seq:
+        return {"events": [], "seq": seq, "complete": since == seq}
+
+    entries = cache.xrange(cache.make_key(_stream_key(company)), min=f"{since + 1}-0", max="+")
+    events = []
+    for entry_id, fields in entries:
+        entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        events.append(dict(json.loads(fields[b"event"]), seq=int(entry_id.split("-")[0])))
+    complete = bool(events) and events[0]["seq"] == since + 1
+    return {"events": events, "seq": seq, "complete": complete}
+
+
+def _metric_key(name):
+    return frappe.cache().make_key(f"{REALTIME_METRICS_KEY}:{name}")
+
+
+def _incr_metric(name, amount=1):
+    try:
+        frappe.cache().incrby(_metric_key(name), amount)
+    except Exception:
+        # Metrics must never block a push
+        pass
+
+
+def get_realtime_metrics():
+    """Push counters: events published, total fan-out (clients in the company
+    room per event), company events skipped for lack of viewers, order
+    changes queued for coalescing (queued minus published is what
+    coalescing saved), and saves ignored for touching no tracked field."""
+    values = frappe.cache().mget([_metric_key(name) for name in REALTIME_METRIC_NAMES])
+    return {name: int(value or 0) for name, value in zip(REALTIME_METRIC_NAMES, values)}
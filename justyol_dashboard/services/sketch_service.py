@@ -0,0 +1,379 @@
+import math
+from collections import Counter
+from functools import partial
+
+import frappe
+from frappe.utils import getdate, add_days
+
+# --- Unique customers (HyperLogLog) ---
+# One Redis HyperLogLog per company and day (and per source and day) holding
+# the customers who ordered. PFCOUNT over several keys merges them on the
+# fly, so any range costs one call on ~12 KB sketches with ~0.8% error.
+# Ranges of up to EXACT_MAX_DAYS days are counted exactly in SQL instead.
+
+CUSTOMER_HLL_TTL = 400 * 86400  # a year of history for YoY, plus margin
+EXACT_MAX_DAYS = 7
+RECONCILE_DAYS = 7
+UNKNOWN_SOURCE = "Direct / Unknown"
+
+
+def _source(source):
+    """Source label orders are counted under; empty sources count as UNKNOWN_SOURCE."""
+    return source or UNKNOWN_SOURCE
+
+
+def _hll_key(company, day, source=None):
+    """Sketch of the day's customers; source=None for all sources together."""
+    key = f"customer_hll:{company}:{day}"
+    return key if source is None else f"{key}:{_source(source)}"
+
+
+def _built_key(company):
+    return f"customer_hll_built:{company}"
+
+
+def _sources_key(company):
+    # Every source a per-source sketch was written for, so a rebuild can
+    # delete the sketches by name instead of scanning for them
+    return f"customer_hll_sources:{company}"
+
+
+def _add_customer(doc):
+    """Add the order's customer to its day's sketches.
+
+    Sketches only grow; a customer whose order moves away or is deleted is
+    dropped at the next rebuild of that day.
+    """
+    if not doc.customer:
+        return
+
+    day = str(getdate(doc.creation))
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    for key in (_hll_key(doc.company, day), _hll_key(doc.company, day, doc.source)):
+        name = cache.make_key(key)
+        pipe.pfadd(name, doc.customer)
+        pipe.expire(name, CUSTOMER_HLL_TTL)
+    pipe.sadd(cache.make_key(_sources_key(doc.company)), _source(doc.source))
+    pipe.expire(cache.make_key(_sources_key(doc.company)), CUSTOMER_HLL_TTL)
+    pipe.execute()
+
+
+def _days(dates):
+    start, end = getdate(dates["from"]), getdate(dates["to"])
+    return [str(add_days(start, offset)) for offset in range((end - start).days + 1)]
+
+
+def _ensure_built(company, days):
+    """Build sketches for days that were never built (or evicted) from Sales Orders."""
+    cache = frappe.cache()
+    built = {
+        day.decode() if isinstance(day, bytes) else day
+        for day in cache.smembers(_built_key(company))
+    }
+    missing = [day for day in days if day not in built]
+    if not missing:
+        return
+
+    rows = frappe.db.sql("""
+        SELECT DISTINCT
+            DATE(creation) as day,
+            COALESCE(NULLIF(source, ''), %s) as source,
+            customer
+        FROM `tabSales Order`
+        WHERE company = %s
+            AND creation >= %s
+            AND creation <= %s
+            AND customer IS NOT NULL
+    """, (UNKNOWN_SOURCE, company, min(missing), max(missing) + " 23:59:59"), as_dict=True)
+
+    missing_days = set(missing)
+    names = {cache.make_key(_hll_key(company, day)) for day in missing}
+    sources = set()
+    pipe = cache.pipeline()
+    for row in rows:
+        day = str(row.day)
+        if day not in missing_days:
+            continue
+        for key in (_hll_key(company, day), _hll_key(company, day, row.source)):
+            name = cache.make_key(key)
+            pipe.pfadd(name, row.customer)
+            names.add(name)
+        sources.add(row.source)
+    for name in names:
+        pipe.expire(name, CUSTOMER_HLL_TTL)
+    if sources:
+        pipe.sadd(cache.make_key(_sources_key(company)), *sources)
+        pipe.expire(cache.make_key(_sources_key(company)), CUSTOMER_HLL_TTL)
+    pipe.execute()
+
+    cache.sadd(_built_key(company), *missing)
+    cache.expire(cache.make_key(_built_key(company)), CUSTOMER_HLL_TTL)
+
+
+def count_customers(company, dates, source=None):
+    """Distinct customers who ordered in the range (optionally from one source).
+
+    Exact for ranges of up to EXACT_MAX_DAYS days, approximate beyond.
+
+    Args:
+        company: Company name
+        dates: {"from", "to"} range
+        source: Sales Order source; UNKNOWN_SOURCE (or "") for orders without one
+    """
+    days = _days(dates)
+    if len(days) <= EXACT_MAX_DAYS:
+        return _count_exact(company, dates, source)
+
+    _ensure_built(company, days)
+    cache = frappe.cache()
+    return cache.pfcount(*[cache.make_key(_hll_key(company, day, source)) for day in days])
+
+
+def count_customers_by_source(company, dates, sources):
+    """{source: distinct customers} for each of the given sources."""
+    days = _days(dates)
+    if len(days) <= EXACT_MAX_DAYS:
+        rows = frappe.db.sql("""
+            SELECT
+                COALESCE(NULLIF(source, ''), %s) as source,
+                COUNT(DISTINCT customer) as customers
+            FROM `tabSales Order`
+            WHERE company = %s
+                AND creation >= %s
+                AND creation <= %s
+            GROUP BY COALESCE(NULLIF(source, ''), %s)
+        """, (UNKNOWN_SOURCE, company, dates["from"], dates["to"] + " 23:59:59", UNKNOWN_SOURCE), as_dict=True)
+        counts = {row.source: row.customers for row in rows}
+        return {source: counts.get(_source(source), 0) for source in sources}
+
+    _ensure_built(company, days)
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    for source in sources:
+        pipe.pfcount(*[cache.make_key(_hll_key(company, day, source)) for day in days])
+    return dict(zip(sources, pipe.execute()))
+
+
+def _count_exact(company, dates, source=None):
+    conditions = ""
+    values = [company, dates["from"], dates["to"] + " 23:59:59"]
+    if source is not None and _source(source) == UNKNOWN_SOURCE:
+        conditions = "AND (source IS NULL OR source = '')"
+    elif source is not None:
+        conditions = "AND source = %s"
+        values.append(source)
+
+    return frappe.db.sql(f"""
+        SELECT COUNT(DISTINCT customer)
+        FROM `tabSales Order`
+        WHERE company = %s
+            AND creation >= %s
+            AND creation <= %s
+            {conditions}
+    """, values)[0][0] or 0
+
+
+def rebuild_customer_sketches(company, from_date, to_date):
+    """Drop and rebuild the sketches of a range, e.g. after bulk edits or deletes."""
+    days = _days({"from": from_date, "to": to_date})
+    cache = frappe.cache()
+    cache.srem(_built_key(company), *days)
+
+    sources = {
+        source.decode() if isinstance(source, bytes) else source
+        for source in cache.smembers(_sources_key(company))
+    }
+    sources.add(UNKNOWN_SOURCE)
+    names = [
+        cache.make_key(_hll_key(company, day, source))
+        for day in days
+        for source in [None, *sources]
+    ]
+    cache.delete(*names)
+    _ensure_built(company, days)
+
+
+# --- Percentiles (log-bucket quantile sketches) ---
+# Values are counted in buckets whose bounds grow by a factor GAMMA, as in
+# DDSketch: any quantile read back is within QUANTILE_ACCURACY of the true
+# value. A sketch is a Redis hash of bucket -> count per metric, company and
+# day (and per source and day). Merging days is summing counts, and an
+# order changing value simply moves one count between buckets, so unlike
+# t-digest the sketches stay exact under edits and deletes.
+
+QUANTILE_ACCURACY = 0.01
+GAMMA = (1 + QUANTILE_ACCURACY) / (1 - QUANTILE_ACCURACY)
+QUANTILE_TTL = CUSTOMER_HLL_TTL
+ZERO_BUCKET = 0  # values below 1 (free or zero-value orders)
+PERCENTILES = (50, 90, 99)
+
+
+def _bucket(value):
+    value = float(value or 0)
+    if value < 1:
+        return ZERO_BUCKET
+    return max(math.ceil(math.log(value, GAMMA)), 1)
+
+
+def _bucket_value(bucket):
+    if bucket == ZERO_BUCKET:
+        return 0.0
+    # Midpoint of the bucket's bounds in relative terms
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+
+def _quantile_key(metric, company, day, source=None):
+    key = f"quantile:{metric}:{company}:{day}"
+    return key if source is None else f"{key}:{_source(source)}"
+
+
+def _quantile_built_key(metric, company):
+    return f"quantile_built:{metric}:{company}"
+
+
+def _order_value(doc):
+    """(day, source, bucket) an order contributes to the order value sketches."""
+    return str(getdate(doc.creation)), doc.source or UNKNOWN_SOURCE, _bucket(doc.grand_total)
+
+
+def _move_order_value(company, old, new):
+    """Move the order's count from its old order value bucket to the new one."""
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    for value, delta in ((old, -1), (new, 1)):
+        if not value:
+            continue
+        day, source, bucket = value
+        for key in (_quantile_key("order_value", company, day), _quantile_key("order_value", company, day, source)):
+            name = cache.make_key(key)
+            pipe.hincrby(name, bucket, delta)
+            pipe.expire(name, QUANTILE_TTL)
+    pipe.execute()
+
+
+def _ensure_order_values_built(company, days):
+    """Build order value sketches for days that were never built (or evicted)."""
+    cache = frappe.cache()
+    built_key = _quantile_built_key("order_value", company)
+    built = {day.decode() if isinstance(day, bytes) else day for day in cache.smembers(built_key)}
+    missing = [day for day in days if day not in built]
+    if not missing:
+        return
+
+    rows = frappe.db.sql("""
+        SELECT
+            DATE(creation) as day,
+            COALESCE(NULLIF(source, ''), %s) as source,
+            grand_total
+        FROM `tabSales Order`
+        WHERE company = %s
+            AND creation >= %s
+            AND creation <= %s
+    """, (UNKNOWN_SOURCE, company, min(missing), max(missing) + " 23:59:59"), as_dict=True)
+
+    missing_days = set(missing)
+    sketches = {_quantile_key("order_value", company, day): Counter() for day in missing}
+    for row in rows:
+        day = str(row.day)
+        if day not in missing_days:
+            continue
+        bucket = _bucket(row.grand_total)
+        sketches[_quantile_key("order_value", company, day)][bucket] += 1
+        sketches.setdefault(_quantile_key("order_value", company, day, row.source), Counter())[bucket] += 1
+
+    # Replace, not add to, whatever doc events already counted for these days
+    pipe = cache.pipeline()
+    for key, counts in sketches.items():
+        name = cache.make_key(key)
+        pipe.delete(name)
+        if counts:
+            pipe.hset(name, mapping=dict(counts))
+            pipe.expire(name, QUANTILE_TTL)
+    pipe.execute()
+
+    cache.sadd(built_key, *missing)
+    cache.expire(cache.make_key(built_key), QUANTILE_TTL)
+
+
+def _merged_counts(names):
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    for name in names:
+        pipe.hgetall(name)
+
+    counts = Counter()
+    for sketch in pipe.execute():
+        for bucket, count in sketch.items():
+            counts[int(bucket)] += int(count)
+    return counts
+
+
+def _percentiles(counts, percentiles=PERCENTILES):
+    total = sum(count for count in counts.values() if count > 0)
+    result = {f"p{p}": 0.0 for p in percentiles}
+    if not total:
+        return result
+
+    buckets = sorted(bucket for bucket, count in counts.items() if count > 0)
+    for p in percentiles:
+        rank = p / 100 * (total - 1)
+        seen = 0
+        for bucket in buckets:
+            seen += counts[bucket]
+            if seen > rank:
+                result[f"p{p}"] = round(_bucket_value(bucket), 2)
+                break
+    return result
+
+
+def order_value_percentiles(company, dates, source=None):
+    """{"p50", "p90", "p99"} of Sales Order grand totals in the range.
+
+    Args:
+        company: Company name
+        dates: {"from", "to"} range
+        source: Limit to one source; UNKNOWN_SOURCE for orders without one
+    """
+    days = _days(dates)
+    _ensure_order_values_built(company, days)
+    cache = frappe.cache()
+    counts = _merged_counts([cache.make_key(_quantile_key("order_value", company, day, source)) for day in days])
+    return _percentiles(counts)
+
+
+def rebuild_order_value_sketches(company, from_date, to_date):
+    """Rebuild the order value sketches of a range from Sales Orders."""
+    days = _days({"from": from_date, "to": to_date})
+    frappe.cache().srem(_quantile_built_key("order_value", company), *days)
+    _ensure_order_values_built(company, days)
+
+
+# --- Maintenance ---
+
+def on_sales_order_change(doc, method=None):
+    """doc_events hook: keep the order's day sketches in step with it once the save commits.
+
+    What to change is captured now and applied after commit, so a rolled
+    back save never reaches Redis.
+    """
+    if method == "on_trash":
+        old, new = _order_value(doc), None
+    else:
+        before = doc.get_doc_before_save()
+        old = _order_value(before) if before else None
+        new = _order_value(doc)
+        frappe.db.after_commit.add(partial(_add_customer, frappe._dict(
+            customer=doc.customer, company=doc.company, creation=doc.creation, source=doc.source,
+        )))
+
+    if old != new:
+        frappe.db.after_commit.add(partial(_move_order_value, doc.company, old, new))
+
+
+def reconcile_sketches():
+    """Scheduled task: rebuild the last week's sketches (moved or deleted orders, db_set drift)."""
+    today = getdate()
+    for company in frappe.get_all("Company", pluck="name"):
+        rebuild_customer_sketches(company, add_days(today, -RECONCILE_DAYS), today)
+        rebuild_order_value_sketches(company, add_days(today, -RECONCILE_DAYS), today)
@@ -0,0 +1,153 @@
+from datetime import datetime
+from functools import partial
+
+import frappe
+from frappe.utils import get_datetime, now_datetime
+from justyol_dashboard.services.transition_service import TRACKED_FIELDS
+
+# --- SLA timers ---
+# One Redis sorted set per timer and company: member = Sales Order, score =
+# when it entered the timed status. Overdue orders are a score range, so
+# counting them (ZCOUNT) or listing the oldest (ZRANGEBYSCORE) is O(log n)
+# instead of a scan of every order in the status.
+
+# Timer -> (transition log field, status, hours allowed)
+SLA_TIMERS = {
+    "pending_confirmation": ("sales_status", "Pending", 24),
+    "awaiting_pickup": ("logistics_status", "Ready to Ship", 48),
+}
+
+
+def _timer_key(timer, company):
+    return f"sla:{timer}:{company}"
+
+
+def _built_key(company):
+    return f"sla_built:{company}"
+
+
+def on_sales_order_change(doc, method=None):
+    """doc_events hook: start or stop the order's SLA timers as its statuses change.
+
+    A timer keeps its start time while the order stays in the status, and
+    restarts if the order leaves and re-enters it. The changes are applied
+    once the save commits, so a rolled back save leaves the timers alone.
+    """
+    before = None if method == "on_trash" else doc.get_doc_before_save()
+    entered = (now_datetime() if before else get_datetime(doc.creation)).timestamp()
+
+    starts, stops = [], []
+    for timer, (field, status, _hours) in SLA_TIMERS.items():
+        doc_field = TRACKED_FIELDS[field]
+        was_in = bool(before) and before.get(doc_field) == status
+        is_in = method != "on_trash" and doc.get(doc_field) == status
+
+        if before and before.company != doc.company and was_in:
+            stops.append(_timer_key(timer, before.company))
+            was_in = False
+
+        key = _timer_key(timer, doc.company)
+        if is_in and not was_in:
+            starts.append(key)
+        elif (was_in and not is_in) or method == "on_trash":
+            stops.append(key)
+
+    if starts or stops:
+        frappe.db.after_commit.add(partial(_apply_timers, doc.name, entered, starts, stops))
+
+
+def _apply_timers(sales_order, entered, starts, stops):
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    for key in stops:
+        pipe.zrem(cache.make_key(key), sales_order)
+    for key in starts:
+        pipe.zadd(cache.make_key(key), {sales_order: entered})
+    pipe.execute()
+
+
+def _ensure_built(company):
+    """Load the timers from the transition log if Redis has never held them (or lost them)."""
+    cache = frappe.cache()
+    if cache.get(cache.make_key(_built_key(company))):
+        return
+    rebuild_sla_timers(company)
+
+
+def rebuild_sla_timers(company):
+    """Rebuild a company's timers from the orders currently in each timed status.
+
+    The start time is the latest entry into the status in the transition
+    log, or the order's creation if it has no logged transition.
+    """
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    for timer, (field, status, _hours) in SLA_TIMERS.items():
+        rows = frappe.db.sql(f"""
+            SELECT
+                so.name,
+                COALESCE(MAX(t.changed_at), so.creation) as entered
+            FROM `tabSales Order` so
+            LEFT JOIN `tabDashboard Order Transition` t
+                ON t.sales_order = so.name
+                AND t.field = %(field)s
+                AND t.to_status = %(status)s
+            WHERE so.company = %(company)s
+                AND so.{TRACKED_FIELDS[field]} = %(status)s
+            GROUP BY so.name
+        """, {"company": company, "field": field, "status": status}, as_dict=True)
+
+        name = cache.make_key(_timer_key(timer, company))
+        pipe.delete(name)
+        if rows:
+            pipe.zadd(name, {row.name: get_datetime(row.entered).timestamp() for row in rows})
+    pipe.set(cache.make_key(_built_key(company)), 1)
+    pipe.execute()
+
+
+def _cutoff(timer, hours=None):
+    return now_datetime().timestamp() - (hours or SLA_TIMERS[timer][2]) * 3600
+
+
+def overdue_count(company, timer, hours=None):
+    """Number of orders that have been in the timer's status longer than allowed.
+
+    Args:
+        company: Company name
+        timer: Key of SLA_TIMERS
+        hours: Override the hours allowed by SLA_TIMERS
+    """
+    _ensure_built(company)
+    cache = frappe.cache()
+    return cache.zcount(cache.make_key(_timer_key(timer, company)), "-inf", _cutoff(timer, hours))
+
+
+def oldest_overdue(company, timer, limit=10, hours=None):
+    """The longest-waiting overdue orders, oldest first.
+
+    Returns:
+        List of {"sales_order", "since", "hours"}: when the order entered the
+        status and the hours it has spent in it.
+    """
+    _ensure_built(company)
+    cache = frappe.cache()
+    members = cache.zrangebyscore(
+        cache.make_key(_timer_key(timer, company)), "-inf", _cutoff(timer, hours),
+        start=0, num=limit, withscores=True,
+    )
+
+    now = now_datetime().timestamp()
+    return [
+        {
+            "sales_order": member.decode() if isinstance(member, bytes) else member,
+            "since": str(datetime.fromtimestamp(score).replace(microsecond=0)),
+            "hours": round((now - score) / 3600, 1),
+        }
+        for member, score in members
+    ]
+
+
+def reconcile_sla_timers():
+    """Scheduled task: repair drift from status updates that bypassed doc events (db_set, imports)."""
+    for company in frappe.get_all("Company", pluck="name"):
+        rebuild_sla_timers(company)
@@ -0,0 +1,159 @@
+import frappe
+from frappe.utils import now_datetime, add_days
+
+TRANSITION_DOCTYPE = "Dashboard Order Transition"
+
+# Logged field -> Sales Order field
+TRACKED_FIELDS = {
+    "sales_status": "custom_sales_status",
+    "logistics_status": "custom_logistics_status",
+    "shipment_status": "custom_track_shipment_status",
+}
+
+# Stage name -> ((field, status) the order enters, (field, status) that ends the stage)
+STAGES = {
+    "confirmation": (("sales_status", "Pending"), ("sales_status", "Confirmed")),
+    "preparation": (("sales_status", "Confirmed"), ("logistics_status", "Ready to Ship")),
+    "pickup": (("logistics_status", "Ready to Ship"), ("logistics_status", "Shipped")),
+    "delivery": (("logistics_status", "Shipped"), ("shipment_status", "Delivered")),
+    "return": (("logistics_status", "Shipped"), ("shipment_status", "Return")),
+}
+
+# GROUP BY expressions over the row that ends the stage
+STAGE_GROUPS = {
+    "day": "DATE(b.changed_at)",
+    "agent": "COALESCE(b.agent, 'Unknown')",
+    "zone": "COALESCE(b.zone, 'Unknown')",
+}
+
+TRANSITION_FIELDS = [
+    "name", "creation", "modified", "modified_by", "owner",
+    "sales_order", "company", "field", "from_status", "to_status", "changed_at", "agent", "zone",
+]
+
+RETENTION_DAYS = 400
+
+
+def on_sales_order_change(doc, method=None):
+    """doc_events hook: append a row for every tracked status that changed.
+
+    A new order logs its initial statuses (from_status empty), so every
+    stage has a known entry time. The agent is the order's owner, as in the
+    order facts and live counters, not whoever saved the change.
+    """
+    before = doc.get_doc_before_save()
+    changed_at = now_datetime() if before else doc.creation
+    zone = doc.shipping_address_name or doc.customer_address
+
+    records = []
+    for field, doc_field in TRACKED_FIELDS.items():
+        old = before.get(doc_field) if before else None
+        new = doc.get(doc_field)
+        if old == new:
+            continue
+        records.append([
+            frappe.generate_hash(length=20), changed_at, changed_at, frappe.session.user, frappe.session.user,
+            doc.name, doc.company, field, old, new, changed_at, doc.owner, zone,
+        ])
+
+    if records:
+        frappe.db.bulk_insert(TRANSITION_DOCTYPE, TRANSITION_FIELDS, records)
+
+
+def get_stage_durations(company, dates, stage, group_by=None):
+    """Percentiles of the time orders spent in a stage, in hours.
+
+    An order's stage ends when it enters the end status; its duration runs
+    from the latest entry into the start status before that. Orders are
+    counted on the day the stage ended.
+
+    Args:
+        company: Company name
+        dates: {"from", "to"} range of stage end dates
+        stage: Key of STAGES
+        group_by: None for one overall row, or a key of STAGE_GROUPS
+
+    Returns:
+        List of {"group", "orders", "p50", "p90", "p99"}.
+    """
+    (start_field, start_status), (end_field, end_status) = STAGES[stage]
+    group = STAGE_GROUPS[group_by] if group_by else "'All'"
+
+    rows = frappe.db.sql(f"""
+        SELECT DISTINCT
+            grp,
+            COUNT(*) OVER (PARTITION BY grp) as orders,
+            PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY duration) OVER (PARTITION BY grp) as p50,
+            PERCENTILE_CONT(0.9) WITHIN GROUP (ORDER BY duration) OVER (PARTITION BY grp) as p90,
+            PERCENTILE_CONT(0.99) WITHIN GROUP (ORDER BY duration) OVER (PARTITION BY grp) as p99
+        FROM (
+            SELECT
+                {group} as grp,
+                TIMESTAMPDIFF(SECOND, MAX(a.changed_at), b.changed_at) as duration
+            FROM `tabDashboard Order Transition` b
+            INNER JOIN `tabDashboard Order Transition` a
+                ON a.sales_order = b.sales_order
+                AND a.field = %(start_field)s
+                AND a.to_status = %(start_status)s
+                AND a.changed_at <= b.changed_at
+            WHERE b.company = %(company)s
+                AND b.field = %(end_field)s
+                AND b.to_status = %(end_status)s
+                AND b.changed_at >= %(from_date)s
+                AND b.changed_at <= %(to_date)s
+            GROUP BY b.name
+        ) durations
+        ORDER BY grp
+    """, {
+        "company": company,
+        "start_field": start_field,
+        "start_status": start_status,
+        "end_field": end_field,
+        "end_status": end_status,
+        "from_date": dates["from"],
+        "to_date": dates["to"] + " 23:59:59",
+    }, as_dict=True)
+
+    return [
+        {
+            "group": str(row.grp),
+            "orders": row.orders,
+            "p50": round(float(row.p50 or 0) / 3600, 1),
+            "p90": round(float(row.p90 or 0) / 3600, 1),
+            "p99": round(float(row.p99 or 0) / 3600, 1),
+        }
+        for row in rows
+    ]
+
+
+def seed_transitions():
+    """Log the current statuses of orders that have no transitions yet.
+
+    Their real history is unknown, so each status is taken as entered when
+    the order was created, the same assumption the age-based alerts made.
+    """
+    for field, doc_field in TRACKED_FIELDS.items():
+        frappe.db.sql(f"""
+            INSERT INTO `tabDashboard Order Transition`
+                (name, creation, modified, modified_by, owner,
+                 sales_order, company, field, from_status, to_status, changed_at, agent, zone)
+            SELECT
+                LEFT(MD5(CONCAT(so.name, %(field)s)), 20), so.creation, so.creation, so.owner, so.owner,
+                so.name, so.company, %(field)s, NULL, so.{doc_field}, so.creation, so.owner,
+                COALESCE(so.shipping_address_name, so.customer_address)
+            FROM `tabSales Order` so
+            WHERE so.{doc_field} IS NOT NULL
+                AND NOT EXISTS (
+                    SELECT 1 FROM `tabDashboard Order Transition` t
+                    WHERE t.sales_order = so.name AND t.field = %(field)s
+                )
+        """, {"field": field})
+
+
+def purge_old_transitions():
+    """Scheduled task: keep the log compact by dropping rows past RETENTION_DAYS."""
+    frappe.db.sql("""
+        DELETE FROM `tabDashboard Order Transition`
+        WHERE changed_at < %s
+    """, (add_days(now_datetime(), -RETENTION_DAYS),))
+    frappe.db.commit()
@@ -0,0 +1,33 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import nowdate
+
+from justyol_dashboard.services import live_counter_service
+from justyol_dashboard.services.live_counter_service import rebuild_live_counters
+from justyol_dashboard.tests.utils import RebuildComparisonTests, get_test_company
+
+
+class TestLiveCounters(RebuildComparisonTests, FrappeTestCase):
+    def setUp(self):
+        self.company = get_test_company()
+        self.day = nowdate()
+        self.rebuild()
+
+    def rebuild(self):
+        rebuild_live_counters(self.company, self.day)
+
+    def snapshot(self):
+        """{field: (orders, gmv)} stored for the day, leaving out emptied fields."""
+        cache = frappe.cache()
+        pipe = cache.pipeline()
+        pipe.hgetall(cache.make_key(live_counter_service._orders_key(self.company, self.day)))
+        pipe.hgetall(cache.make_key(live_counter_service._gmv_key(self.company, self.day)))
+        orders, gmv = pipe.execute()
+        return {
+            field: (int(count), round(float(gmv.get(field) or 0), 2))
+            for field, count in orders.items()
+            if int(count)
+        }
+
+    def count_orders(self):
+        return sum(count for count, _ in self.snapshot().values())
@@ -0,0 +1,60 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from justyol_dashboard.services import realtime_service
+from justyol_dashboard.services.realtime_service import get_events_since, push_dashboard_update
+
+
+class TestRealtimeEventStream(FrappeTestCase):
+    def setUp(self):
+        # No Company document is needed: with no subscribers, events are only
+        # appended to the stream
+        self.company = f"_Test Stream Company {frappe.generate_hash(length=8)}"
+
+    def tearDown(self):
+        cache = frappe.cache()
+        cache.delete(
+            cache.make_key(realtime_service._stream_key(self.company)),
+            cache.make_key(realtime_service._sequence_key(self.company)),
+        )
+
+    def push(self, count):
+        for i in range(count):
+            push_dashboard_update("test_event", {"i": i}, company=self.company)
+
+    def test_replay_is_complete_and_ordered(self):
+        self.push(5)
+        result = get_events_since(self.company, 2)
+        self.assertTrue(result["complete"])
+        self.assertEqual(result["seq"], 5)
+        self.assertEqual([event["seq"] for event in result["events"]], [3, 4, 5])
+        self.assertEqual([event["data"]["i"] for event in result["events"]], [2, 3, 4])
+
+    def test_up_to_date_client(self):
+        self.push(3)
+        self.assertEqual(get_events_since(self.company, 3), {"events": [], "seq": 3, "complete": True})
+
+    def test_client_ahead_of_sequence_must_refetch(self):
+        # e.g. the sequence key was lost and restarted below what the client saw
+        self.push(2)
+        self.assertFalse(get_events_since(self.company, 7)["complete"])
+
+    def test_trimmed_events_make_replay_incomplete(self):
+        self.push(5)
+        cache = frappe.cache()
+        cache.xtrim(cache.make_key(realtime_service._stream_key(self.company)), maxlen=2, approximate=False)
+
+        self.assertFalse(get_events_since(self.company, 0)["complete"])
+        result = get_events_since(self.company, 3)
+        self.assertTrue(result["complete"])
+        self.assertEqual([event["seq"] for event in result["events"]], [4, 5])
+
+    def test_stream_ahead_of_sequence_restarts(self):
+        self.push(3)
+        cache = frappe.cache()
+        cache.delete(cache.make_key(realtime_service._sequence_key(self.company)))
+
+        self.push(1)  # seq restarts at 1, below the stream's last entry
+        result = get_events_since(self.company, 0)
+        self.assertTrue(result["complete"])
+        self.assertEqual([event["seq"] for event in result["events"]], [1])
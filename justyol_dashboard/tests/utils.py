@@ -0,0 +1,116 @@
+import frappe
+from frappe.utils import nowdate
+
+TEST_CUSTOMER = "_Test Dashboard Customer"
+TEST_ITEM = "_Test Dashboard Item"
+
+
+def get_test_company():
+    """The site's default company, or any company when none is set."""
+    company = frappe.db.get_single_value("Global Defaults", "default_company")
+    return company or frappe.get_all("Company", pluck="name", limit=1)[0]
+
+
+def get_test_customer(customer_name=TEST_CUSTOMER):
+    """Name of a test customer, created on first use."""
+    name = frappe.db.get_value("Customer", {"customer_name": customer_name})
+    if name:
+        return name
+
+    return frappe.get_doc({
+        "doctype": "Customer",
+        "customer_name": customer_name,
+        "customer_group": "All Customer Groups",
+        "territory": "All Territories",
+    }).insert().name
+
+
+def get_test_item(item_code=TEST_ITEM):
+    """A non-stock test item, so orders need no warehouse."""
+    if not frappe.db.exists("Item", item_code):
+        frappe.get_doc({
+            "doctype": "Item",
+            "item_code": item_code,
+            "item_name": item_code,
+            "item_group": "All Item Groups",
+            "stock_uom": "Nos",
+            "is_stock_item": 0,
+        }).insert()
+    return item_code
+
+
+def make_sales_order(docstatus=0, qty=1, rate=100, customer=None, **fields):
+    """Insert a Sales Order for today.
+
+    docstatus=1 inserts it submitted in one save, as API and integration
+    imports do.
+    """
+    doc = frappe.get_doc(dict({
+        "doctype": "Sales Order",
+        "company": get_test_company(),
+        "customer": customer or get_test_customer(),
+        "transaction_date": nowdate(),
+        "delivery_date": nowdate(),
+        "docstatus": docstatus,
+        "items": [{
+            "item_code": get_test_item(),
+            "qty": qty,
+            "rate": rate,
+            "delivery_date": nowdate(),
+        }],
+    }, **fields))
+    return doc.insert()
+
+
+class RebuildComparisonTests:
+    """Sales Order scenarios checking an incrementally maintained store against its rebuild.
+
+    Mix into a FrappeTestCase and implement snapshot() (the stored state as
+    plain, comparable values), rebuild() (recompute that state from Sales
+    Orders) and count_orders() (orders the store currently counts).
+    order_fields() adds fields to every order the scenarios make.
+    """
+
+    def order_fields(self):
+        return {}
+
+    def make_order(self, **fields):
+        return make_sales_order(**dict(self.order_fields(), **fields))
+
+    def assertMatchesRebuild(self):
+        # Redis maintainers apply their changes after commit; run them as a commit would
+        frappe.db.after_commit.run()
+        incremental = self.snapshot()
+        self.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_submitted_insert_counts_once(self):
+        # An insert with docstatus=1 runs on_update and on_submit in one save
+        orders = self.count_orders()
+        self.make_order(docstatus=1)
+        frappe.db.after_commit.run()
+        self.assertEqual(self.count_orders(), orders + 1)
+        self.assertMatchesRebuild()
+
+    def test_submit_of_draft(self):
+        so = self.make_order()
+        self.assertMatchesRebuild()
+        so.submit()
+        self.assertMatchesRebuild()
+
+    def test_update_after_submit(self):
+        so = self.make_order(docstatus=1, custom_sales_status="Pending")
+        so.custom_sales_status = "Confirmed"
+        so.custom_track_shipment_status = "Delivered"
+        so.save()
+        self.assertMatchesRebuild()
+
+    def test_cancel_and_trash(self):
+        self.make_order().delete()
+        self.assertMatchesRebuild()
+
+        so = self.make_order(docstatus=1)
+        so.cancel()
+        self.assertMatchesRebuild()
+        frappe.get_doc("Sales Order", so.name).delete()
+        self.assertMatchesRebuild()